@@ -1,41 +1,149 @@
 import os
-import ast
-from utils.facebook_utils import FacebookScraper
+from utils.facebook_utils import AsyncFacebookScraper, POST_COLUMNS, get_activity_window_start, get_post_activity, \
+    parse_local_time
+from utils.checkpoint_utils import Checkpoint, read_written_rows, read_written_ids, iter_written_rows
+from utils.webhook_utils import take_webhook_rows, merge_webhook_rows
+from utils.state_utils import ScrapeState
+from utils.file_utils import merge_rows_into_csv
+from utils.pipeline_utils import stream_in_background
+from utils.config_utils import load_config, get_output_files
 
 
-if __name__ == "__main__":
+# Maximum number of scraped posts waiting for their comments to be retrieved
+POST_QUEUE_SIZE = 100
+
+
+def with_active_posts(posts, last_activity, window_start):
+    """
+    Yields posts, then the older posts that weren't among them but still got comments after window_start.
+    """
+    retrieved = set()
+    for post in posts:
+        retrieved.add(post['status_id'])
+        yield post
+
+    for status_id, last_active in sorted(last_activity.items()):
+        if last_active >= window_start and status_id not in retrieved:
+            yield {'status_id': status_id}
+
+
+def scrape_facebook(config):
     # API TOKEN MUST BELONG TO USER WHO IS ADMIN/ANALYST/EDITOR OF THE PAGE
-    # Read in the credentials and parameters from the key_params.json file
-    with open('key_params.json', 'r') as f:
-        keys = ast.literal_eval(f.read())
-        api_token = keys['keys']['Facebook']['access_token']
-        page_name = keys['parameters']['Facebook']['page_name']
-        since_date = keys['parameters']['Facebook']['since']
-        company = keys['parameters']['main']['company_folder']
+    # Get the credentials and parameters from the config parsed from key_params.json
+    api_token = config.facebook.access_token
+    page_name = config.facebook.page_name
+    since_date = config.facebook.since
+    # Number of Graph API requests made at the same time when retrieving comments (10 if left empty)
+    max_in_flight = int(config.facebook.max_in_flight or 10)
+    # Number of days after its last comment that a post's comments are still checked by incremental runs (7 if empty)
+    activity_window = int(config.facebook.activity_window or 7)
+    company = config.company
 
     # If the Facebook folder is not in the company folder already, create it
     if 'Facebook' not in os.listdir('../{}'.format(company)):
         os.mkdir('../{}/Facebook'.format(company))
 
     # Output files for the profile, engagements, posts, and comments
-    profile_output = "../{}/Facebook/{}_facebook_profile.csv".format(company, page_name)
-    engagements_output = "../{}/Facebook/{}_facebook_engagements.csv".format(company, page_name)
-    posts_output = "../{}/Facebook/{}_facebook_post.csv".format(company, page_name)
-    comments_output = "../{}/Facebook/{}_facebook_comment.csv".format(company, page_name)
+    outputs = get_output_files(config)['Facebook']
+    profile_output = outputs['profile']
+    engagements_output = outputs['engagements']
+    posts_output = outputs['posts']
+    comments_output = outputs['comments']
+    post_insights_output = outputs['post_insights']
+    state = ScrapeState(outputs['state'])
 
     # Create a Facebook Scraper object (see utils/facebook_utils.py for functions)
     # Specify how far to go back using the since_date parameter (YYYY-MM-DD)
-    fbscraper = FacebookScraper(access_token=api_token, page_name=page_name, since_date=since_date)
+    # The comments of many posts are retrieved at the same time (see AsyncFacebookScraper)
+    # With flat_comments, replies come in the same paginated stream as the comments to each post
+    fbscraper = AsyncFacebookScraper(access_token=api_token, page_name=page_name, since_date=since_date,
+                                     flat_comments=config.facebook.flat_comments, max_in_flight=max_in_flight)
     # Get the profile of the page_name specified in fbscraper and write to profile_output
     fbscraper.get_profile_facebook(output_file=profile_output)
     # Get the daily engagements of the page_name specified in fbscraper and write to engagements_output
     # Can also specify number of days to get data via the num_days parameter
     fbscraper.get_daily_engagements_facebook(output_file=engagements_output, num_days=100)
 
-    # Get the posts of the page_name specified in fbscraper and write to posts_output
-    post_columns, post_data = fbscraper.scrape_facebook_posts(output_file=posts_output)
+    # An incremental run only retrieves the posts published since the newest post of the last run (or within the
+    #   activity window, to update their counts), and the comments of the posts active within the activity window
+    # The rows it retrieves are written to separate files first and then merged into the output files
+    # A state whose newest post isn't a time (e.g. a corrupt file) is ignored, so the run retrieves everything again
+    newest_post = parse_local_time(state.get('newest_post'))
+    if config.facebook.incremental and state.get('newest_post') is not None and newest_post is None:
+        print("Ignoring the state in {}: {!r} is not a time".format(state.path, state.get('newest_post')))
+    incremental = config.facebook.incremental and newest_post is not None and \
+        os.path.isfile(posts_output) and os.path.isfile(comments_output)
+    if incremental:
+        window_start = get_activity_window_start(activity_window)
+        # Start from whichever is earlier: the newest post of the last run (so no post is missed if the last run was
+        #   longer ago than the activity window) or the start of the activity window (to update the counts of the
+        #   posts published within it)
+        fbscraper.set_since_local_time(min(newest_post, parse_local_time(window_start)).strftime('%Y-%m-%d %H:%M:%S'))
+        # Only the posts whose last activity is a time are checked again
+        last_activity = state.get('last_activity')
+        last_activity = dict((status_id, last_active) for status_id, last_active in last_activity.items()
+                             if parse_local_time(last_active) is not None) if isinstance(last_activity, dict) else {}
+        new_posts_output, new_comments_output = posts_output + '.new', comments_output + '.new'
+
+        # Files without a checkpoint are left over from a crawl that finished, so start them over
+        for output in [new_posts_output, new_comments_output]:
+            if os.path.isfile(output) and not Checkpoint(output).exists():
+                os.remove(output)
+    else:
+        new_posts_output, new_comments_output = posts_output, comments_output
+
+    # The rows changed by the webhook events received so far (see facebook_webhook.py) are merged in once this run is
+    #   done; events received from now on are left for the next run
+    webhook_posts = take_webhook_rows(outputs['webhook_posts'])
+    webhook_comments = take_webhook_rows(outputs['webhook_comments'])
 
-    # Create a list of key-value pairs for each post for quick lookup when retrieving comments of each post
-    posts = [dict(zip(post_columns, val)) for val in post_data]
-    # Get the comments of the page_name specified in fbscraper and write to comments_output
-    fbscraper.scrape_facebook_comments(posts=posts, output_file=comments_output)
+    # Get the posts of the page_name specified in fbscraper and write to new_posts_output
+    # Each post (a dict of {column: value}) is handed to the comment scraper as soon as it is written, so comments are
+    #   retrieved while the next pages of posts are still being scraped
+    new_posts = stream_in_background(fbscraper.iter_facebook_posts(output_file=new_posts_output),
+                                     maxsize=POST_QUEUE_SIZE)
+    posts = new_posts
+    if incremental:
+        # Older posts that were still getting comments within the activity window
+        posts = with_active_posts(posts, last_activity, window_start)
+    # Get the comments of the page_name specified in fbscraper and write to new_comments_output
+    try:
+        comment_columns = fbscraper.scrape_facebook_comments(posts=posts, output_file=new_comments_output)
+    finally:
+        # If the comment crawl failed, stop paging through the posts right away
+        new_posts.close()
+
+    # Get the reach and impressions of every post retrieved in this run and write to post_insights_output
+    # This is done while the post and comment checkpoints are still there, so that if it fails, a restarted crawl
+    #   doesn't write the posts and comments again
+    fbscraper.get_post_insights_facebook(status_ids=[row[0] for row in iter_written_rows(new_posts_output)],
+                                         output_file=post_insights_output)
+
+    if incremental:
+        # Replace the rows of the posts and comments retrieved again (with their updated counts) and add the new ones
+        print("Merging the new/updated posts and comments...")
+        merge_rows_into_csv(posts_output, POST_COLUMNS, read_written_rows(new_posts_output))
+        merge_rows_into_csv(comments_output, comment_columns, read_written_rows(new_comments_output))
+
+    # Add the posts and comments changed by webhook events that this run didn't retrieve again
+    merge_webhook_rows(posts_output, POST_COLUMNS, webhook_posts, read_written_ids(new_posts_output))
+    merge_webhook_rows(comments_output, comment_columns, webhook_comments, read_written_ids(new_comments_output))
+
+    # Remember how far this run got, for the next incremental run
+    newest_post, last_activity = get_post_activity(posts_output, comments_output)
+    window_start = get_activity_window_start(activity_window)
+    state.update(newest_post=newest_post,
+                 last_activity=dict((status_id, last_active) for status_id, last_active in last_activity.items()
+                                    if last_active >= window_start))
+
+    # Posts and comments are both done, so the next crawl starts from the beginning
+    Checkpoint(new_posts_output).clear()
+    Checkpoint(new_comments_output).clear()
+    if incremental:
+        os.remove(new_posts_output)
+        os.remove(new_comments_output)
+
+
+if __name__ == "__main__":
+    # Read in the credentials and parameters from the key_params.json file
+    scrape_facebook(load_config())
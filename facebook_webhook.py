@@ -0,0 +1,63 @@
+import os
+import argparse
+from utils.webhook_utils import FacebookEventWriter, make_webhook_server, replay_events
+from utils.config_utils import load_config, get_output_files
+
+
+def serve_facebook_webhook(config, port=8000, flush_interval=5):
+    # Get the credentials and parameters from the config parsed from key_params.json
+    app_secret = config.facebook.app_secret
+    verify_token = config.facebook.verify_token
+    company = config.company
+
+    # Without the app secret, the signatures of the events can't be checked
+    if not app_secret:
+        print("Set the Facebook app_secret in key_params.json to receive webhook events")
+        exit(1)
+
+    # If the Facebook folder is not in the company folder already, create it
+    if 'Facebook' not in os.listdir('../{}'.format(company)):
+        os.mkdir('../{}/Facebook'.format(company))
+
+    # Events are applied to the rows of the posts and comments files that facebook.py writes; the rows they change
+    #   are written to files of their own, which the next run of facebook.py merges in
+    fb = get_output_files(config)['Facebook']
+    writer = FacebookEventWriter(posts_file=fb['posts'], comments_file=fb['comments'],
+                                 webhook_posts_file=fb['webhook_posts'], webhook_comments_file=fb['webhook_comments'],
+                                 events_file=fb['webhook_events'], flush_interval=flush_interval)
+    server = make_webhook_server(writer, app_secret, verify_token, port=port)
+
+    print("Receiving Facebook webhook events on port {}...".format(port))
+    writer.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # Apply whatever events are still waiting
+        writer.stop()
+        print("Received {} webhook events ({} applied)".format(writer.num_events, writer.num_applied))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Receive the webhook events of the Facebook page in key_params.json '
+                                                 'and apply them to the rows of its posts and comments files.')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--flush-interval', type=float, default=5,
+                        help='seconds between writes of the events received to the output files (default: 5)')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='instead of receiving events, send the events recorded in FILE (one JSON payload per '
+                             'line) to a running receiver, signed like Facebook does')
+    parser.add_argument('--url', default='http://localhost:8000/',
+                        help='receiver to send the events to with --replay (default: http://localhost:8000/)')
+    args = parser.parse_args()
+
+    # Read in the credentials and parameters from the key_params.json file
+    config = load_config()
+
+    if args.replay:
+        replay_events(args.replay, args.url, config.facebook.app_secret)
+    else:
+        serve_facebook_webhook(config, port=args.port, flush_interval=args.flush_interval)
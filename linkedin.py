@@ -1,19 +1,18 @@
 import os
-import ast
 from utils.linkedin_utils import get_company_updates, get_historical_follower_data, \
     get_historical_status_update_statistics, get_company_follower_statistics
+from utils.state_utils import ScrapeState
+from utils.config_utils import load_config, get_output_files
 
 
-if __name__ == "__main__":
-    # Read in the credentials and parameters from the key_params.json file
-    with open('key_params.json', 'r') as f:
-        keys = ast.literal_eval(f.read())
-        consumer_key = keys['keys']['LinkedIn']['consumer_key']
-        consumer_secret = keys['keys']['LinkedIn']['consumer_secret']
-        code = keys['keys']['LinkedIn']['code']
-        access_token = keys['keys']['LinkedIn']['access_token']
-        company_id = keys['parameters']['LinkedIn']['company_id']
-        company = keys['parameters']['main']['company_folder']
+def scrape_linkedin(config):
+    # Get the credentials and parameters from the config parsed from key_params.json
+    consumer_key = config.linkedin.consumer_key
+    consumer_secret = config.linkedin.consumer_secret
+    code = config.linkedin.code
+    access_token = config.linkedin.access_token
+    company_id = config.linkedin.company_id
+    company = config.company
 
     # If the LinkedIn folder is not in the company folder already, create it
     if 'LinkedIn' not in os.listdir('../{}'.format(company)):
@@ -21,22 +20,35 @@ if __name__ == "__main__":
 
     # Output files for the posts, comments, historical followers, historical status update statistics, and
     #   company follower statistics
-    posts_output = '../{}/LinkedIn/linkedin_post.csv'.format(company)
-    comments_output = '../{}/LinkedIn/linkedin_comment.csv'.format(company)
-    hist_follower_output = '../{}/LinkedIn/linkedin_historical_followers.csv'.format(company)
-    hist_status_update_output = '../{}/LinkedIn/linkedin_historical_status_update_statistics.csv'.format(company)
-    company_follower_output = '../{}/LinkedIn/linkedin_company_follower_statistics.json'.format(company)
+    outputs = get_output_files(config)['LinkedIn']
+    posts_output = outputs['posts']
+    comments_output = outputs['comments']
+    hist_follower_output = outputs['historical_followers']
+    hist_status_update_output = outputs['historical_status_updates']
+    company_follower_output = outputs['company_follower_statistics']
+    state = ScrapeState(outputs['state'])
 
-    # Get the posts and comments to those posts of the company and write them, respectively, to posts_output and
-    #   comments_output
-    get_company_updates(cid=company_id, access_token=access_token, posts_output=posts_output, comments_output=comments_output)
+    # Get the posts and comments to those posts of the company and merge them, respectively, into posts_output and
+    #   comments_output; if an earlier run retrieved the posts up to some time, only the newer posts are retrieved
+    since_ts = state.get('newest_update') if os.path.isfile(posts_output) else None
+    newest_update = get_company_updates(cid=company_id, access_token=access_token, posts_output=posts_output,
+                                        comments_output=comments_output, since_ts=since_ts)
+    # Remember the newest post, for the next run
+    if newest_update is not None:
+        state.update(newest_update=newest_update)
     # Get the historical follower data (paid, organic, total), broken down by interval (which can be changed), and
     #   starting from from_ts (which is a UNIX timestamp in ms, see https://www.epochconverter.com), and write the
-    #   output to hist_follower_output
+    #   output to hist_follower_output; if the file already has data, only the days after it are retrieved
     get_historical_follower_data(cid=company_id, interval='day', access_token=access_token, output_file=hist_follower_output, from_ts='1514764800000')
     # Get the historical status update statistics (number of impressions), broken down by interval
     #   (which can be changed), and starting from from_ts (which is a UNIX timestamp in ms,
-    #   see https://www.epochconverter.com), and write it to hist_status_update_output
+    #   see https://www.epochconverter.com), and write it to hist_status_update_output; if the file already has data,
+    #   only the days after it are retrieved
     get_historical_status_update_statistics(cid=company_id, interval='day', access_token=access_token, output_file=hist_status_update_output, from_ts='1514764800000')
     # Get the company follower statistics and write it to company_follower_output
     get_company_follower_statistics(cid=company_id, access_token=access_token, output_file=company_follower_output)
+
+
+if __name__ == "__main__":
+    # Read in the credentials and parameters from the key_params.json file
+    scrape_linkedin(load_config())
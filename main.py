@@ -1,89 +1,222 @@
-from utils.file_utils import join_post_files, join_comment_files
-from utils.facebook_utils import split_fb_reactions
-from utils.weibo_utils import convert_to_datetime
-from utils.nlp_utils import NLP
-import os
 import time
-import datetime
-import ast
 
+# Record the start time of program execution (before anything else is imported, so the startup cost is measured)
+start = time.time()
 
-if __name__ == "__main__":
-
-    # Get the folder name where the Facebook, Instagram, LinkedIn, Twitter, and Weibo folders are stored
-    with open('key_params.json', 'r') as f:
-        keys = ast.literal_eval(f.read())
-        company = keys['parameters']['main']['company_folder']
+from utils.file_utils import join_post_files, join_comment_files
+from utils.pipeline_utils import Task, run_dag
+from utils.ratelimit_utils import report_rate_limits
+from utils.config_utils import load_config, load_batch, get_output_files
+from utils.config_utils import HTTP_READ_TIMEOUT, HTTP_MAX_CONNECTIONS_PER_HOST
+from utils.manifest_utils import RunManifest
+from utils.startup_utils import lazy_function, report_startup
+import os
+import sys
+import argparse
+
+
+# Every stage imports its module (and the SDKs it needs, e.g. tweepy or bosonnlp) only when it actually runs
+scrape_facebook = lazy_function('facebook', 'scrape_facebook')
+scrape_instagram = lazy_function('instagram', 'scrape_instagram')
+scrape_linkedin = lazy_function('linkedin', 'scrape_linkedin')
+scrape_twitter = lazy_function('twitter', 'scrape_twitter')
+scrape_weibo = lazy_function('weibo', 'scrape_weibo')
+scrape_weibo_comments = lazy_function('weibo', 'scrape_weibo_comments')
+process_nlp = lazy_function('utils.nlp_utils', 'process_nlp')
+split_fb_reactions = lazy_function('utils.facebook_utils', 'split_fb_reactions')
+
+
+def build_pipeline(config, prefix=''):
+    """
+    Builds the dependency graph of every stage for one company.
+    Each channel's chain (scrape -> NLP -> channel post-processing) only depends on its own earlier stages, and the
+    joins only wait on the stages that produce the files they read.
+    Channels without a page/user name in config are left out.
+
+    :param prefix: (str) added to the name of every stage so several companies can share one graph
+    """
+    company = config.company
+    folder = '../{}'.format(company)
+    outputs = get_output_files(config)
+
+    # Files written by the NLP and post-processing stages, e.g. ../company/Facebook/company_facebook_post_nlp.csv
+    def stage_file(channel, filetype, suffix):
+        return '{}/{}/{}_{}_{}.csv'.format(folder, channel, company, filetype, suffix)
+
+    tasks = []
+
+    # Phase 1: Scraping, Phase 2: Natural Language Processing, and Phase 3: Post-Processing of every channel
+    if config.facebook.page_name:
+        fb = outputs['Facebook']
+        tasks += [
+            Task(prefix + 'Facebook scrape', scrape_facebook, (config,),
+                 outputs=[fb['profile'], fb['engagements'], fb['posts'], fb['comments'], fb['post_insights']],
+                 checkpointed=[fb['posts'], fb['comments'], fb['post_insights']]),
+            Task(prefix + 'Facebook post NLP', process_nlp, (folder + '/Facebook', company, 'Facebook post'),
+                 deps=[prefix + 'Facebook scrape'],
+                 inputs=[fb['posts']], outputs=[stage_file('Facebook', 'facebook_post', 'nlp')]),
+            Task(prefix + 'Facebook comment NLP', process_nlp,
+                 (folder + '/Facebook', company, 'Facebook comment'), deps=[prefix + 'Facebook scrape'],
+                 inputs=[fb['comments']], outputs=[stage_file('Facebook', 'facebook_comment', 'nlp')]),
+            # Split Facebook reactions (needs both the post and comment NLP files)
+            Task(prefix + 'Facebook split reactions', split_fb_reactions, (folder + '/Facebook', company),
+                 deps=[prefix + 'Facebook post NLP', prefix + 'Facebook comment NLP'],
+                 inputs=[stage_file('Facebook', 'facebook_post', 'nlp'),
+                         stage_file('Facebook', 'facebook_comment', 'nlp')],
+                 outputs=[stage_file('Facebook', 'facebook_post', 'final'),
+                          stage_file('Facebook', 'facebook_comment', 'final')]),
+        ]
+    if config.instagram.username:
+        ig = outputs['Instagram']
+        # The NLP stages write into the folder they read, so their files are left out of its fingerprint
+        ig_nlp_files = [stage_file('Instagram', 'instagram_post', 'final'),
+                        stage_file('Instagram', 'instagram_comment', 'final')]
+        tasks += [
+            # instaloader keeps track of what it already downloaded, so the folder is never cleared
+            Task(prefix + 'Instagram scrape', scrape_instagram, (config,), outputs=[ig['profile']]),
+            Task(prefix + 'Instagram post NLP', process_nlp,
+                 (folder + '/Instagram', company, 'Instagram post'), deps=[prefix + 'Instagram scrape'],
+                 inputs=[ig['folder']], ignored=ig_nlp_files,
+                 outputs=[stage_file('Instagram', 'instagram_post', 'final')]),
+            Task(prefix + 'Instagram comment NLP', process_nlp,
+                 (folder + '/Instagram', company, 'Instagram comment'), deps=[prefix + 'Instagram scrape'],
+                 inputs=[ig['folder']], ignored=ig_nlp_files,
+                 outputs=[stage_file('Instagram', 'instagram_comment', 'final')]),
+        ]
+    if config.linkedin.company_id:
+        li = outputs['LinkedIn']
+        tasks += [
+            # Every file but the company statistics is added to by every run, so they must not be cleared
+            Task(prefix + 'LinkedIn scrape', scrape_linkedin, (config,),
+                 outputs=[li['posts'], li['comments'], li['historical_followers'], li['historical_status_updates'],
+                          li['company_follower_statistics']],
+                 checkpointed=[li['posts'], li['comments'], li['historical_followers'],
+                               li['historical_status_updates']]),
+            Task(prefix + 'LinkedIn post NLP', process_nlp, (folder + '/LinkedIn', company, 'LinkedIn post'),
+                 deps=[prefix + 'LinkedIn scrape'],
+                 inputs=[li['posts']], outputs=[stage_file('LinkedIn', 'linkedin_post', 'final')]),
+            Task(prefix + 'LinkedIn comment NLP', process_nlp,
+                 (folder + '/LinkedIn', company, 'LinkedIn comment'), deps=[prefix + 'LinkedIn scrape'],
+                 inputs=[li['comments']], outputs=[stage_file('LinkedIn', 'linkedin_comment', 'final')]),
+        ]
+    if config.twitter.handle:
+        tw = outputs['Twitter']
+        tasks += [
+            # Incremental runs merge into the tweets of earlier runs, so they must not be cleared
+            Task(prefix + 'Twitter scrape', scrape_twitter, (config,),
+                 outputs=[tw['profile'], tw['tweets']] +
+                         [path for files in tw['competitors'].values() for path in [files['profile'], files['tweets']]],
+                 checkpointed=[tw['tweets']] + [files['tweets'] for files in tw['competitors'].values()]
+                              if config.twitter.incremental else []),
+            Task(prefix + 'Twitter tweet NLP', process_nlp, (folder + '/Twitter', company, 'Twitter tweet'),
+                 deps=[prefix + 'Twitter scrape'],
+                 inputs=[tw['tweets']], outputs=[stage_file('Twitter', 'twitter_tweet', 'final')]),
+        ]
+    if config.weibo.username:
+        wb = outputs['Weibo']
+        tasks += [
+            Task(prefix + 'Weibo scrape', scrape_weibo, (config,),
+                 outputs=[wb['tweets'], wb['profile']], checkpointed=[wb['tweets']]),
+            # Comments are retrieved in a stage of their own, so that if m.weibo.cn refuses them, the tweets still go
+            #   through NLP and into the join
+            Task(prefix + 'Weibo comment scrape', scrape_weibo_comments, (config,), deps=[prefix + 'Weibo scrape'],
+                 outputs=[wb['comments']], checkpointed=[wb['comments']]),
+            Task(prefix + 'Weibo tweet NLP', process_nlp, (folder + '/Weibo', company, 'Weibo tweet'),
+                 deps=[prefix + 'Weibo scrape'],
+                 inputs=[wb['tweets']], outputs=[stage_file('Weibo', 'weibo_tweet', 'final')]),
+            Task(prefix + 'Weibo comment NLP', process_nlp, (folder + '/Weibo', company, 'Weibo comment'),
+                 deps=[prefix + 'Weibo comment scrape'],
+                 inputs=[wb['comments']], outputs=[stage_file('Weibo', 'weibo_comment', 'final')]),
+        ]
+
+    # Combine all posts/tweets and comments into 2 big files once the channels that were scraped are done; a failed
+    #   channel is left out instead of stopping the join
+    post_deps = ['Facebook split reactions', 'Weibo tweet NLP', 'Instagram post NLP', 'Twitter tweet NLP',
+                 'LinkedIn post NLP']
+    comment_deps = ['Facebook split reactions', 'Instagram comment NLP', 'LinkedIn comment NLP', 'Weibo comment NLP']
+    post_tasks = [task for task in tasks if task.name in [prefix + name for name in post_deps]]
+    comment_tasks = [task for task in tasks if task.name in [prefix + name for name in comment_deps]]
+    tasks += [
+        Task(prefix + 'Join posts', join_post_files, (folder, company),
+             deps=[task.name for task in post_tasks], require_success=False,
+             inputs=[path for task in post_tasks for path in task.outputs
+                     if path.endswith('post_final.csv') or path.endswith('tweet_final.csv')],
+             outputs=[folder + '/posts.csv']),
+        Task(prefix + 'Join comments', join_comment_files, (folder, company),
+             deps=[task.name for task in comment_tasks], require_success=False,
+             inputs=[path for task in comment_tasks for path in task.outputs
+                     if path.endswith('comment_final.csv')],
+             outputs=[folder + '/comments.csv']),
+    ]
+
+    return tasks
 
-    # If the designated folder doesn't exist, create it
-    if company not in os.listdir('../'):
-        os.mkdir('../{}'.format(company))
 
-    # Record the start time of program execution
-    start = time.time()
+if __name__ == "__main__":
 
-    print('*' * 75 + '\nPhase 1: Scraping...\n' + '*' * 75)
-    # Scrape Facebook; runs the script on the command line
-    os.system('python facebook.py')
-    # Scrape Instagram; runs the script on the command line
-    os.system('python instagram.py')
+    parser = argparse.ArgumentParser(description='Scrape every social media channel, run NLP, and join the results.')
+    parser.add_argument('--max-workers', type=int, default=5,
+                        help='maximum number of stages running at the same time (default: 5)')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='scrape every company listed in FILE (see batch_params.json) instead of the single '
+                             'company in key_params.json')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the stages that completed in the last run (according to its manifest) and only '
+                             'rerun the stages that failed or never ran')
+    parser.add_argument('--max-connections', type=int, default=HTTP_MAX_CONNECTIONS_PER_HOST,
+                        help='maximum number of open connections to each API host (default: {})'.format(
+                            HTTP_MAX_CONNECTIONS_PER_HOST))
+    parser.add_argument('--timeout', type=float, default=HTTP_READ_TIMEOUT,
+                        help='seconds to wait for an API to respond before giving up on a request (default: {})'.format(
+                            HTTP_READ_TIMEOUT))
+    args = parser.parse_args()
+
+    # Every HTTP call to the Graph API, LinkedIn, and Weibo goes through one pooled session
+    # http_utils (and requests with it) is only imported here when the defaults are overridden; otherwise the first
+    #   stage that makes a request imports it
+    if args.timeout != HTTP_READ_TIMEOUT or args.max_connections != HTTP_MAX_CONNECTIONS_PER_HOST:
+        from utils import http_utils
+        http_utils.configure(read_timeout=args.timeout, max_connections_per_host=args.max_connections)
+
+    # Read key_params.json once; the resulting config (with the folder name where the Facebook, Instagram,
+    #   LinkedIn, Twitter, and Weibo folders are stored) is passed to every stage
+    configs = load_batch(args.batch) if args.batch else [load_config()]
+
+    # If the designated folders don't exist, create them
+    for config in configs:
+        if config.company not in os.listdir('../'):
+            os.mkdir('../{}'.format(config.company))
+
+    print('*' * 75 + '\nScraping, Natural Language Processing, and Post-Processing...\n' + '*' * 75)
+    # Every stage starts as soon as the stages it depends on have finished; a stage that fails only holds back the
+    #   stages that need its output
+    # In batch mode, the stages of every company share the same pool of workers
+    tasks = []
+    for config in configs:
+        prefix = '{}: '.format(config.company) if args.batch else ''
+        tasks += build_pipeline(config, prefix=prefix)
+
+    # The manifest records the progress of every stage so that a failed run can be resumed with --resume
+    if args.batch:
+        manifest_file = '../{}_manifest.json'.format(os.path.splitext(os.path.basename(args.batch))[0])
+    else:
+        manifest_file = '../{}/run_manifest.json'.format(configs[0].company)
+    manifest = RunManifest(manifest_file, resume=args.resume)
+
+    startup = time.time() - start
+    statuses = run_dag(tasks, max_workers=args.max_workers, manifest=manifest, resume=args.resume)
+
+    # Delete the NLP engine (if any stage started it) since we are not using it anymore
+    if 'utils.nlp_utils' in sys.modules:
+        sys.modules['utils.nlp_utils'].shut_down_nlp()
+
+    for stage, status in sorted(statuses.items()):
+        print("{}: exit status {}".format(stage, status))
+    print()
+    report_rate_limits()
+    print()
+    report_startup(startup)
     print()
-    # Scrape LinkedIn; runs the script on the command line
-    os.system('python linkedin.py')
-    # Scrape Twitter; runs the script on the command line
-    os.system('python twitter.py')
-    # Scrape Weibo; runs the script on the command line
-    os.system('python weibo.py')
-
-
-    print('*' * 75 + '\nPhase 2: Natural Language Processing...\n' + '*' * 75)
-
-    # Instantiate NLP engine
-    now = datetime.datetime.strftime(datetime.datetime.now(), '[%B %d, %Y %H:%M:%S]')
-    print(now + " - Starting up NLP engine...\n")
-    nlp = NLP()
-
-    # Run NLP on Facebook posts
-    nlp.process_nlp('../{}/Facebook'.format(company), company, 'Facebook post')
-
-    # Run NLP on Facebook comments
-    nlp.process_nlp('../{}/Facebook'.format(company), company, 'Facebook comment')
-
-    # Run NLP on Weibo tweets
-    nlp.process_nlp('../{}/Weibo'.format(company), company, 'Weibo tweet')
-
-    # Run NLP on Instagram posts
-    nlp.process_nlp('../{}/Instagram'.format(company), company, 'Instagram post')
-
-    # Run NLP on Instagram comments
-    nlp.process_nlp('../{}/Instagram'.format(company), company, 'Instagram comment')
-
-    # Run NLP on Twitter tweets
-    nlp.process_nlp('../{}/Twitter'.format(company), company, 'Twitter tweet')
-
-    # Run NLP on LinkedIn posts
-    nlp.process_nlp('../{}/LinkedIn'.format(company), company, 'LinkedIn post')
-
-    # Run NLP on LinkedIn comments
-    nlp.process_nlp('../{}/LinkedIn'.format(company), company, 'LinkedIn comment')
-
-    # Delete NLP engine since we are not using anymore
-    now = datetime.datetime.strftime(datetime.datetime.now(), '[%B %d, %Y %H:%M:%S]')
-    print(now + " - Shutting down NLP engine...\n")
-    del nlp
-    NLP.count -= 1
-
-    print('*' * 75 + '\nPhase 3: Post-Processing...\n' + '*' * 75)
-
-    # Split Facebook reactions
-    split_fb_reactions('../{}/Facebook'.format(company), company)
-
-    # Convert Weibo dates to datetimes
-    convert_to_datetime('../{}/Weibo'.format(company), company)
-
-    # Combine all posts/tweets and comments into 2 big files
-    join_post_files('../{}'.format(company), company)
-    join_comment_files('../{}'.format(company), company)
 
     end = time.time()
-    print("Entire process finished in {} seconds!".format(end-start))
\ No newline at end of file
+    print("Entire process finished in {} seconds!".format(end-start))
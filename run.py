@@ -1,9 +1,13 @@
 import os
+import sys
 import datetime
 
+# Pass any command line options (e.g. --max-workers 3) through to main.py
+options = ' '.join(sys.argv[1:])
+
 # If the Operating System is Linux, Unix, or macOS, we can automatically generate a log of the terminal output
 if os.name == 'posix':
-    os.system("script -a ../{}_log.txt python main.py".format(datetime.datetime.now().strftime("%Y-%m-%d_%Hh%Mm%Ss")))
+    os.system("script -a ../{}_log.txt python main.py {}".format(datetime.datetime.now().strftime("%Y-%m-%d_%Hh%Mm%Ss"), options))
 # Otherwise, just run the script without logging
 else:
-    os.system("python main.py")
\ No newline at end of file
+    os.system("python main.py {}".format(options))
@@ -1,34 +1,44 @@
 import tweepy
 import os
-import ast
-from utils.twitter_utils import get_profile_twitter, get_tweets_twitter
+from utils.twitter_utils import collect_twitter
+from utils.config_utils import load_config, get_output_files
 
 
-if __name__ == "__main__":
-    # Read in the credentials and parameters from the key_params.json file
-    with open('key_params.json', 'r') as f:
-        keys = ast.literal_eval(f.read())
-        api_key = keys['keys']['Twitter']['api_key']
-        api_secret = keys['keys']['Twitter']['api_secret']
-        access_token = keys['keys']['Twitter']['access_token']
-        access_token_secret = keys['keys']['Twitter']['access_token_secret']
-        twitter_handle = keys['parameters']['Twitter']['handle']
-        company = keys['parameters']['main']['company_folder']
-
-    # Create the API object using Twitter's OAuth system
+def scrape_twitter(config):
+    # Get the credentials and parameters from the config parsed from key_params.json
+    api_key = config.twitter.api_key
+    api_secret = config.twitter.api_secret
+    access_token = config.twitter.access_token
+    access_token_secret = config.twitter.access_token_secret
+    twitter_handle = config.twitter.handle
+    competitor_handles = config.twitter.competitor_handles
+    company = config.company
+
+    # Create the API credentials using Twitter's OAuth system
     auth = tweepy.OAuthHandler(api_key, api_secret)
     auth.set_access_token(access_token, access_token_secret)
-    api = tweepy.API(auth)
 
-    # If the Twitter folder is not in the company folder already, create it
+    # If the Twitter folder (and the folder of the competitors' files) is not in the company folder already, create it
     if 'Twitter' not in os.listdir('../{}'.format(company)):
         os.mkdir('../{}/Twitter'.format(company))
+    if competitor_handles and 'Competitors' not in os.listdir('../{}/Twitter'.format(company)):
+        os.mkdir('../{}/Twitter/Competitors'.format(company))
+
+    # Output files for the profile and tweets of every handle; the competitors' files are kept apart so that only the
+    #   company's own tweets go through NLP
+    outputs = get_output_files(config)['Twitter']
+    output_files = {twitter_handle: outputs}
+    output_files.update(outputs['competitors'])
 
-    # Output files for the profile and tweets
-    profile_output = "../{}/Twitter/{}_twitter_profile.csv".format(company, twitter_handle)
-    tweet_output = "../{}/Twitter/{}_twitter_tweet.csv".format(company, twitter_handle)
+    # Get the Twitter profile and tweets (as many as Twitter returns) of the specified twitter handle and of the
+    #   competitors' handles, several at a time
+    stats = collect_twitter([twitter_handle] + competitor_handles, auth, output_files,
+                            incremental=config.twitter.incremental)
 
-    # Get the Twitter profile of the specified twitter handle and write it to profile_output
-    get_profile_twitter(name=twitter_handle, api=api, output_file=profile_output)
-    # Get the tweets of the specified twitter handle (at most num_tweets) and write it to tweet_output
-    get_tweets_twitter(name=twitter_handle, api=api, output_file=tweet_output, num_tweets=1000)
+    # The competitors are only nice to have, but the company's own tweets are needed by the rest of the pipeline
+    if stats[twitter_handle]['failed']:
+        raise RuntimeError("Failed to get {}'s Twitter tweets".format(twitter_handle))
+
+if __name__ == "__main__":
+    # Read in the credentials and parameters from the key_params.json file
+    scrape_twitter(load_config())
@@ -0,0 +1,81 @@
+import os
+import csv
+import json
+from utils.file_utils import write_json_atomic
+
+
+class Checkpoint(object):
+    """
+    Pagination position of a long crawl (e.g. the comment cursor of the post being scraped), saved next to the crawl's
+    output file as {output_file}.checkpoint. A restarted crawl reads it back to continue from the last saved position
+    instead of fetching every page again.
+    """
+    def __init__(self, output_file):
+        self.path = output_file + '.checkpoint'
+        self.output_file = output_file
+        self.state = {}
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.state = json.loads(f.read())
+
+
+    def exists(self):
+        # A checkpoint is only useful if the rows written before it was saved are still there
+        return len(self.state) > 0 and os.path.isfile(self.output_file)
+
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+
+    def save(self, **state):
+        """
+        Replaces the saved position with state. Only call this once every row fetched before this position has been
+        written to the output file.
+        """
+        self.state = state
+        write_json_atomic(self.path, state)
+
+
+    def clear(self):
+        # The crawl finished, so the next crawl starts from the beginning
+        self.state = {}
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def iter_written_rows(output_file):
+    """
+    Reads the rows (without the header) that a crawl already wrote to output_file one at a time, without loading the
+    whole file.
+
+    :return: generator of rows (each a list of strings)
+    """
+    if not os.path.isfile(output_file):
+        return
+
+    with open(output_file, 'r') as rf:
+        reader = csv.reader(rf)
+        # Skip the header
+        next(reader, None)
+        for row in reader:
+            yield row
+
+
+def read_written_rows(output_file):
+    """
+    Reads the rows (without the header) that a crawl already wrote to output_file.
+
+    :return: list of rows (each a list of strings)
+    """
+    return list(iter_written_rows(output_file))
+
+
+def read_written_ids(output_file, id_column=0):
+    """
+    Reads the ids of the rows that a crawl already wrote to output_file, so that a restarted crawl can skip them.
+
+    :return: set of ids (as strings)
+    """
+    return set(row[id_column] for row in iter_written_rows(output_file) if len(row) > id_column)
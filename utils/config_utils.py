@@ -0,0 +1,184 @@
+import ast
+import copy
+from collections import namedtuple
+
+
+# Credentials and parameters of each channel, taken from key_params.json
+FacebookConfig = namedtuple('FacebookConfig', ['access_token', 'page_name', 'since', 'max_in_flight',
+                                               'flat_comments', 'incremental', 'activity_window', 'app_secret',
+                                               'verify_token'])
+InstagramConfig = namedtuple('InstagramConfig', ['login_username', 'login_password', 'username'])
+LinkedInConfig = namedtuple('LinkedInConfig', ['consumer_key', 'consumer_secret', 'code', 'access_token',
+                                               'company_id'])
+TwitterConfig = namedtuple('TwitterConfig', ['api_key', 'api_secret', 'access_token', 'access_token_secret',
+                                             'handle', 'incremental', 'competitor_handles'])
+WeiboConfig = namedtuple('WeiboConfig', ['username'])
+
+# Everything needed to scrape one company; company is the name of the folder the output is stored in
+Config = namedtuple('Config', ['company', 'facebook', 'instagram', 'linkedin', 'twitter', 'weibo'])
+
+# Defaults of the HTTP session shared by the scrapers (see utils/http_utils.py). They live here rather than in
+#   http_utils so that main.py can show them in --help without importing requests at startup
+# Seconds to wait for a connection to be made and for the server to send data; without a timeout, a dead connection
+#   can hang a stage forever
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+# Number of connections kept open (and reused) per host; callers wait for a free connection beyond that
+HTTP_MAX_CONNECTIONS_PER_HOST = 10
+# Number of hosts whose connection pools are kept around
+HTTP_MAX_HOSTS = 20
+
+
+def read_key_params(path='key_params.json'):
+    """
+    Reads key_params.json as a dict (see key_params.json for the layout).
+    """
+    with open(path, 'r') as f:
+        return ast.literal_eval(f.read())
+
+
+def parse_config(keys):
+    """
+    Converts the dict read from key_params.json into a Config.
+
+    :param keys: (dict) parsed key_params.json
+    :return: Config
+    """
+    credentials = keys['keys']
+    params = keys['parameters']
+
+    return Config(
+        company=params['main']['company_folder'],
+        facebook=FacebookConfig(access_token=credentials['Facebook']['access_token'],
+                                page_name=params['Facebook']['page_name'],
+                                since=params['Facebook']['since'],
+                                # Optional; how many Graph API requests the comment crawl makes at the same time
+                                max_in_flight=params['Facebook'].get('max_in_flight', ''),
+                                # Optional; "true" to retrieve replies through the flat comment stream
+                                flat_comments=str(params['Facebook'].get('flat_comments', '')).lower() == 'true',
+                                # Optional; "true" to only retrieve what changed since the last run, and the number
+                                #   of days a post's comments are checked again after its last activity
+                                incremental=str(params['Facebook'].get('incremental', '')).lower() == 'true',
+                                activity_window=params['Facebook'].get('activity_window', ''),
+                                # Optional; only needed to receive webhook events (see facebook_webhook.py)
+                                app_secret=credentials['Facebook'].get('app_secret', ''),
+                                verify_token=credentials['Facebook'].get('verify_token', '')),
+        instagram=InstagramConfig(login_username=credentials['Instagram']['username'],
+                                  login_password=credentials['Instagram']['password'],
+                                  username=params['Instagram']['username']),
+        linkedin=LinkedInConfig(consumer_key=credentials['LinkedIn']['consumer_key'],
+                                consumer_secret=credentials['LinkedIn']['consumer_secret'],
+                                code=credentials['LinkedIn']['code'],
+                                access_token=credentials['LinkedIn']['access_token'],
+                                company_id=params['LinkedIn']['company_id']),
+        twitter=TwitterConfig(api_key=credentials['Twitter']['api_key'],
+                              api_secret=credentials['Twitter']['api_secret'],
+                              access_token=credentials['Twitter']['access_token'],
+                              access_token_secret=credentials['Twitter']['access_token_secret'],
+                              handle=params['Twitter']['handle'],
+                              # Optional; "true" to only retrieve the tweets newer than the last run's
+                              incremental=str(params['Twitter'].get('incremental', '')).lower() == 'true',
+                              # Optional; other handles (e.g. competitors) to collect, separated by commas
+                              competitor_handles=[handle.strip() for handle in
+                                                  params['Twitter'].get('competitor_handles', '').split(',')
+                                                  if handle.strip()]),
+        weibo=WeiboConfig(username=params['Weibo']['username']))
+
+
+def load_config(path='key_params.json'):
+    """
+    Reads and parses key_params.json once; the resulting Config is passed to every stage.
+    """
+    return parse_config(read_key_params(path))
+
+
+def load_batch(batch_file, path='key_params.json'):
+    """
+    Reads the list of companies to scrape in batch mode.
+    Every entry has the same layout as key_params.json. Credentials an entry leaves out are taken from
+    key_params.json, so companies can share credentials or use their own; parameters an entry leaves out are left
+    empty, so a company is only scraped on the channels listed in its entry.
+
+    :return: list of Config, one for each company
+    """
+    keys = read_key_params(path)
+    with open(batch_file, 'r') as f:
+        batch = ast.literal_eval(f.read())
+
+    configs = []
+    for entry in batch['companies']:
+        entry_keys = {'keys': copy.deepcopy(keys['keys']),
+                      'parameters': dict((channel, dict((name, '') for name in values))
+                                         for channel, values in keys['parameters'].items())}
+        for section in ['keys', 'parameters']:
+            for channel, values in entry.get(section, {}).items():
+                entry_keys[section].setdefault(channel, {}).update(values)
+        configs.append(parse_config(entry_keys))
+
+    return configs
+
+
+def get_output_files(config):
+    """
+    Paths of the files written by each channel's scraper, so that the scrapers and the pipeline agree on them.
+
+    :return: (dict) {channel: {name: path}}
+    """
+    company = config.company
+    page_name = config.facebook.page_name
+    instagram_username = config.instagram.username
+    twitter_handle = config.twitter.handle
+    weibo_name = config.weibo.username
+
+    return {
+        'Facebook': {
+            'profile': "../{}/Facebook/{}_facebook_profile.csv".format(company, page_name),
+            'engagements': "../{}/Facebook/{}_facebook_engagements.csv".format(company, page_name),
+            'posts': "../{}/Facebook/{}_facebook_post.csv".format(company, page_name),
+            'comments': "../{}/Facebook/{}_facebook_comment.csv".format(company, page_name),
+            # Kept out of the 'facebook_post' file names, which NLP reads as posts
+            'post_insights': "../{}/Facebook/{}_facebook_insights.csv".format(company, page_name),
+            # Rows added or changed by webhook events (see facebook_webhook.py), merged in by the next scraping run
+            'webhook_posts': "../{}/Facebook/{}_facebook_webhook_posts.csv".format(company, page_name),
+            'webhook_comments': "../{}/Facebook/{}_facebook_webhook_comments.csv".format(company, page_name),
+            # Every webhook event received (see facebook_webhook.py), one JSON object per line
+            'webhook_events': "../{}/Facebook/{}_facebook_webhook_events.jsonl".format(company, page_name),
+            # What the earlier runs retrieved, for incremental runs
+            'state': "../{}/Facebook/{}_facebook_state.json".format(company, page_name),
+        },
+        'Instagram': {
+            'profile': '../{}/Instagram/{}_instagram_profile.csv'.format(company, instagram_username),
+            # instaloader downloads every post and its comments into this folder
+            'folder': '../{}/Instagram'.format(company),
+        },
+        'LinkedIn': {
+            'posts': '../{}/LinkedIn/linkedin_post.csv'.format(company),
+            'comments': '../{}/LinkedIn/linkedin_comment.csv'.format(company),
+            'historical_followers': '../{}/LinkedIn/linkedin_historical_followers.csv'.format(company),
+            'historical_status_updates':
+                '../{}/LinkedIn/linkedin_historical_status_update_statistics.csv'.format(company),
+            'company_follower_statistics':
+                '../{}/LinkedIn/linkedin_company_follower_statistics.json'.format(company),
+            # What the earlier runs retrieved, so that later runs only retrieve what is new
+            'state': '../{}/LinkedIn/linkedin_state.json'.format(company),
+        },
+        'Twitter': {
+            'profile': "../{}/Twitter/{}_twitter_profile.csv".format(company, twitter_handle),
+            'tweets': "../{}/Twitter/{}_twitter_tweet.csv".format(company, twitter_handle),
+            # What the earlier runs retrieved, for incremental runs
+            'state': "../{}/Twitter/{}_twitter_state.json".format(company, twitter_handle),
+            # The same files for every competitor handle, kept out of the company's NLP
+            'competitors': dict((handle, {
+                'profile': "../{}/Twitter/Competitors/{}_twitter_profile.csv".format(company, handle),
+                'tweets': "../{}/Twitter/Competitors/{}_twitter_tweet.csv".format(company, handle),
+                'state': "../{}/Twitter/Competitors/{}_twitter_state.json".format(company, handle),
+            }) for handle in config.twitter.competitor_handles),
+        },
+        'Weibo': {
+            'tweets': "../{}/Weibo/{}_weibo_tweet.csv".format(company, weibo_name),
+            'profile': "../{}/Weibo/{}_weibo_profile.csv".format(company, weibo_name),
+            'comments': "../{}/Weibo/{}_weibo_comment.csv".format(company, weibo_name),
+            # The tweets whose comments are still to be retrieved (see weibo.py)
+            'state': "../{}/Weibo/{}_weibo_state.json".format(company, weibo_name),
+        },
+    }
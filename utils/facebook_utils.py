@@ -1,8 +1,136 @@
 import os
 import csv
+import calendar
+import json
 import time
+import random
 import datetime
-import requests
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from utils import http_utils
+from utils.ratelimit_utils import get_rate_limiter
+from utils.checkpoint_utils import Checkpoint, read_written_rows, read_written_ids, iter_written_rows
+from utils.file_utils import merge_rows_into_csv
+
+
+# Column names of the posts csv file
+POST_COLUMNS = ["status_id", "status_message", "link_name", "status_type", "status_link", "status_published",
+                "num_reactions", "num_comments", "num_shares", "num_likes", "num_loves", "num_wows", "num_hahas",
+                "num_sads", "num_angrys", "num_special"]
+
+# Column names of the comments csv file
+COMMENT_COLUMNS = ["comment_id", "status_id", "parent_id", "comment_message", "comment_author", "comment_published",
+                   "num_reactions", "num_likes", "num_loves", "num_wows", "num_hahas", "num_sads", "num_angrys",
+                   "num_special"]
+
+# Reaction types counted separately for every post and comment (num_likes, num_loves, ...)
+REACTION_TYPES = ['like', 'love', 'wow', 'haha', 'sad', 'angry']
+# Graph API error codes meaning that too many calls were made (https://developers.facebook.com/docs/graph-api/using-graph-api/error-handling)
+RATE_LIMIT_ERROR_CODES = [4, 17, 32, 613]
+# Maximum number of requests the Graph API accepts in one batch request
+MAX_BATCH_SIZE = 50
+# Number of times a request is sent before giving up on it; the wait before the next try doubles after every failure,
+#   starting at BACKOFF_BASE seconds and going up to MAX_BACKOFF seconds
+MAX_TRIES = 8
+BACKOFF_BASE = 5
+MAX_BACKOFF = 300
+# Minimum number of seconds between two saves of the posts whose comments are done (see
+#   AsyncFacebookScraper.scrape_facebook_comments)
+CHECKPOINT_INTERVAL = 10
+
+
+class GraphAPIError(Exception):
+    """
+    Raised when the Graph API rejects a request (HTTP 400), which retrying the same request will not fix.
+    """
+    pass
+
+
+class GraphAPIRetryError(Exception):
+    """
+    Raised when a request to the Graph API still fails after MAX_TRIES tries.
+    """
+    pass
+
+
+def get_graph_usage(headers):
+    """
+    Reads how much of the rate limits was used from the headers of a Graph API response:
+    X-App-Usage: {"call_count": 28, "total_time": 25, "total_cputime": 25} (in percent)
+    X-Business-Use-Case-Usage: {business_id: [{"type": "pages", "call_count": 28, "total_time": 25,
+                                              "total_cputime": 25, "estimated_time_to_regain_access": 0}]}
+    where estimated_time_to_regain_access is in minutes.
+
+    :return: (usage, regain_access_in): the highest percentage in either header, and the number of seconds until
+             Facebook accepts calls again (0 if it didn't say); None if neither header was sent
+    """
+    usage, regain_access_in = None, 0
+    counters = ['call_count', 'total_time', 'total_cputime']
+
+    try:
+        if headers.get('X-App-Usage'):
+            app_usage = json.loads(headers['X-App-Usage'])
+            usage = max(app_usage.get(counter, 0) for counter in counters)
+
+        if headers.get('X-Business-Use-Case-Usage'):
+            for entries in json.loads(headers['X-Business-Use-Case-Usage']).values():
+                for entry in entries:
+                    usage = max([usage or 0] + [entry.get(counter, 0) for counter in counters])
+                    regain_access_in = max(regain_access_in, entry.get('estimated_time_to_regain_access', 0) * 60)
+    # A malformed header only means that the calls aren't slowed down
+    except (ValueError, AttributeError):
+        return None
+
+    return None if usage is None else (usage, regain_access_in)
+
+
+def parse_local_time(text):
+    """
+    Parses a time in the format of the times in the output files (e.g. '2018-08-01 12:00:00').
+
+    :return: datetime, or None if text isn't such a time (e.g. a header row, or a corrupt state file)
+    """
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def get_activity_window_start(days):
+    """
+    Gets the time days days ago, in the format and time zone (Hong Kong time) of the times in the output files.
+    """
+    now = datetime.datetime.utcnow() + datetime.timedelta(hours=+8)
+    return (now - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def get_post_activity(posts_file, comments_file):
+    """
+    Reads when each post was last active from the post and comment files, for the next incremental run.
+    Rows whose time can't be read (e.g. a header written again by an older version) are left out.
+
+    :return: (newest_post, last_activity): the time the newest post was published, and {status_id: time of the post's
+             newest comment (or of the post itself if it has no comments)}
+    """
+    newest_post = None
+    last_activity = {}
+
+    # status_published and comment_published are both in the 6th column
+    for row in iter_written_rows(posts_file):
+        published = parse_local_time(row[5]) if len(row) > 5 else None
+        if published is None:
+            continue
+        newest_post = published if newest_post is None else max(newest_post, published)
+        last_activity[row[0]] = published
+
+    for row in iter_written_rows(comments_file):
+        published = parse_local_time(row[5]) if len(row) > 5 else None
+        if published is not None and row[1] in last_activity:
+            last_activity[row[1]] = max(last_activity[row[1]], published)
+
+    return (None if newest_post is None else newest_post.strftime('%Y-%m-%d %H:%M:%S'),
+            dict((status_id, published.strftime('%Y-%m-%d %H:%M:%S'))
+                 for status_id, published in last_activity.items()))
 
 
 # Splits reactions on each line to multiline reaction type and count (see docstring)
@@ -110,7 +238,7 @@ def split_fb_reactions(readpath, company):
 # Facebook Scraper Object
 # Contains functions for scraping posts, comments, profile, and engagements
 class FacebookScraper(object):
-    def __init__(self, access_token, page_name, since_date):
+    def __init__(self, access_token, page_name, since_date, flat_comments=False):
         # The root endpoint of the Facebook Graph API
         self.root = 'https://graph.facebook.com/v3.0/'
         # The node to get to page_name's posts
@@ -123,26 +251,90 @@ class FacebookScraper(object):
         self.__access_token = access_token
         # Set the page_name so this object has access to the variable
         self.page_name = page_name
-
-
-    # Send request until success, wait for 5 seconds upon failure before next request
-    def _request_until_success(self, url):
-        success = False
-        while success is False:
+        # Every scraper using the same access token shares its rate limit (e.g. several companies in a batch)
+        self.limiter = get_rate_limiter('Facebook', access_token)
+        # Whether the reaction counts can be requested as aliased fields together with the posts/comments; turned off
+        #   if the API version rejects aliasing
+        self.aliased_reactions = True
+        # Whether to retrieve each post's comments and replies as one flat stream (see _get_comment_base_url)
+        self.flat_comments = flat_comments
+
+
+    # Only retrieve the posts published at or after local_time (in the format and time zone of the output files)
+    def set_since_local_time(self, local_time):
+        since = datetime.datetime.strptime(local_time, '%Y-%m-%d %H:%M:%S') + datetime.timedelta(hours=-8)
+        self.since = "&since={}".format(calendar.timegm(since.timetuple()))
+
+
+    # Send a single HTTP GET request, counting it against the access token's rate limit
+    def _request(self, url, params=None):
+        self.limiter.wait()
+        response = http_utils.get(url, params=params)
+        self._record_usage(response)
+        return response
+
+
+    # Tell the rate limiter how much of the app's and page's limits is used (sent with every Graph API response), so
+    #   that calls slow down before Facebook starts rejecting them
+    def _record_usage(self, response):
+        usage = get_graph_usage(response.headers)
+        if usage is not None:
+            self.limiter.report_usage(*usage)
+
+
+    # Send a single Graph batch request (several GET requests in one HTTP round trip); every request in the batch
+    #   counts against the access token's rate limit
+    def _request_batch(self, url, relative_urls):
+        for _ in relative_urls:
+            self.limiter.wait()
+
+        batch = [{'method': 'GET', 'relative_url': relative_url} for relative_url in relative_urls]
+        response = http_utils.post(url, data={'access_token': self.__access_token, 'batch': json.dumps(batch),
+                                              'include_headers': 'false'})
+        self._record_usage(response)
+        return response
+
+
+    # Send request until success, waiting longer after every failure; give up after MAX_TRIES tries
+    # If batch (list of urls relative to url) is given, they are sent as one batch request to url instead
+    def _request_until_success(self, url, batch=None):
+        for attempt in range(1, MAX_TRIES + 1):
             # Send HTTP GET request to the specified url
             try:
-                response = requests.get(url)
+                response = self._request(url) if batch is None else self._request_batch(url, batch)
                 if response.ok is True:
-                    success = True
-            # If the request fails, try again in 5 seconds
+                    return response.json()
+
+                if response.status_code == 400:
+                    error = response.json().get('error', {})
+                    # Rate limit errors are sent as 400s as well; those go away after waiting, and every other call
+                    #   with this access token should slow down too
+                    if error.get('code') in RATE_LIMIT_ERROR_CODES:
+                        self.limiter.report_usage(100)
+                        raise Exception("Rate limit reached: {}".format(error.get('message')))
+                    # Otherwise the request itself is invalid, so sending it again won't help
+                    raise GraphAPIError(error.get('message', response.text))
+
+                raise Exception("HTTP error {}: {}".format(response.status_code, response.text))
+            except GraphAPIError:
+                raise
+            # If the request fails, try again after a random wait of up to BACKOFF_BASE * 2^(attempt - 1) seconds, so
+            #   that callers failing at the same time don't all retry at the same time
             except Exception as e:
-                print(e)
-                time.sleep(5)
+                last_error = e
+                if attempt == MAX_TRIES:
+                    break
 
+                delay = random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (attempt - 1)))
+                print(e)
                 print("Error for URL {}: {}".format(url, datetime.datetime.now()))
-                print("Retrying.")
+                print("Retrying in {} seconds (try {} of {}).".format(round(delay, 1), attempt + 1, MAX_TRIES))
+
+                self.limiter.record_backoff(delay)
+                time.sleep(delay)
 
-        return response.json()
+        # The access token is part of the url, so it is left out of the error
+        raise GraphAPIRetryError("Giving up on {} after {} tries: {}".format(url.split('?')[0], MAX_TRIES, last_error))
 
 
     # To deal with encoding Chinese/other arbitrary characters before writing to csv
@@ -161,20 +353,78 @@ class FacebookScraper(object):
         return base_url + fields
 
 
+    # Get the request url (without fields) for retrieving a page of comments to node (a post or a comment)
+    # With flat_comments, the comments to a post and every reply to them come in one stream, each with the comment it
+    #   replies to (its parent), so the replies don't need requests of their own
+    def _get_comment_base_url(self, node, after):
+        stream_param = '&filter=stream' if self.flat_comments else ''
+        after_param = '' if after == '' else "&after={}".format(after)
+
+        return self.root + "/{}/comments".format(node) + self.params + stream_param + after_param
+
+
     # Get the request url for retrieving comments; also specify the data fields that we want to retrieve
     def _get_comment_feed_url(self, base_url):
-        fields = "&fields=id,message,reactions.limit(0).summary(true)" + \
-                 ",created_time,comments,from,attachment"
+        if self.flat_comments:
+            fields = "&fields=id,message,reactions.limit(0).summary(true)" + \
+                     ",created_time,parent,from,attachment"
+        else:
+            fields = "&fields=id,message,reactions.limit(0).summary(true)" + \
+                     ",created_time,comments,from,attachment"
 
         return base_url + fields
 
 
+    # Get the id of the comment that comment replies to; only given in the flat comment stream
+    def _get_parent_id(self, comment, default=''):
+        return comment['parent']['id'] if 'parent' in comment else default
+
+
+    # Get the fields that retrieve the count of each reaction type under an alias (e.g. reactions_like), so that they
+    #   come in the same request as the posts/comments
+    def _get_aliased_reaction_fields(self):
+        return "".join(",reactions.type({}).limit(0).summary(total_count).as(reactions_{})".format(reaction_type.upper(),
+                                                                                                 reaction_type)
+                       for reaction_type in REACTION_TYPES)
+
+
+    # Get the reactions for each post/comment from the aliased reaction fields; None if the aliases are missing
+    def _get_aliased_reactions(self, data):
+        reactions_dict = {}  # dict of {id: tuple<6>}
+
+        for item in data:
+            if any('reactions_{}'.format(reaction_type) not in item for reaction_type in REACTION_TYPES):
+                return None
+            reactions_dict[item['id']] = tuple(item['reactions_{}'.format(reaction_type)]['summary']['total_count']
+                                               for reaction_type in REACTION_TYPES)
+
+        return reactions_dict
+
+
+    # Request a page of posts/comments together with the reactions to each of them
+    # Uses a single request with aliased reaction fields; if the API rejects them, falls back to one request per
+    #   reaction type (get_reactions) for this and every later page
+    def _request_with_reactions(self, base_url, feed_url, get_reactions):
+        if self.aliased_reactions:
+            try:
+                page = self._request_until_success(feed_url + self._get_aliased_reaction_fields())
+                reactions = self._get_aliased_reactions(page['data'])
+                if reactions is not None:
+                    return page, reactions
+            except GraphAPIError as e:
+                print("Aliased reaction fields were rejected: {}".format(e))
+
+            print("Requesting each reaction type separately from now on.")
+            self.aliased_reactions = False
+
+        return self._request_until_success(feed_url), get_reactions(base_url)
+
+
     # Get the reactions for each post
     def _get_reactions_to_posts(self, base_url):
-        reaction_types = ['like', 'love', 'wow', 'haha', 'sad', 'angry']
         reactions_dict = {}  # dict of {status_id: tuple<6>}
 
-        for reaction_type in reaction_types:
+        for reaction_type in REACTION_TYPES:
             # Specify that we want the count of each reaction type
             fields = "&fields=reactions.type({}).limit(0).summary(total_count)".format(reaction_type.upper())
             url = base_url + fields
@@ -198,10 +448,9 @@ class FacebookScraper(object):
 
     # Get the reactions for each comment
     def _get_reactions_to_comments(self, base_url):
-        reaction_types = ['like', 'love', 'wow', 'haha', 'sad', 'angry']
         reactions_dict = {}  # dict of {status_id: tuple<6>}
 
-        for reaction_type in reaction_types:
+        for reaction_type in REACTION_TYPES:
             # Specify that we want the count of each reaction type
             fields = "&fields=reactions.type({}).limit(0).summary(total_count)".format(reaction_type.upper())
             url = base_url + fields
@@ -287,42 +536,82 @@ class FacebookScraper(object):
                 comment_published, num_reactions)
 
 
-    # Main function to scrape posts and reactions
-    def scrape_facebook_posts(self, output_file):
-        # Column names in the resulting csv file
-        columns = ["status_id", "status_message", "link_name", "status_type", "status_link", "status_published",
-                   "num_reactions", "num_comments", "num_shares", "num_likes", "num_loves", "num_wows", "num_hahas",
-                   "num_sads", "num_angrys", "num_special"]
-        # Write these column names to the file first
+    # Writes a batch of rows to the output file
+    def _write_batch(self, output_file, batch, num_processed, item_type):
+        print("Writing items {} to {} to {}...".format(num_processed - len(batch) + 1, num_processed, output_file))
         with open(output_file, 'a') as wf:
             writer = csv.writer(wf)
-            writer.writerow(columns)
+            for row in batch:
+                writer.writerow(row)
+        print("Done writing!")
+        print("{} {} Processed: {}".format(num_processed, item_type, datetime.datetime.now()))
+
+
+    # Main function to scrape posts and reactions; returns the column names and every post
+    def scrape_facebook_posts(self, output_file):
+        all_posts = [tuple(post[column] for column in POST_COLUMNS) for post in self.iter_facebook_posts(output_file)]
+
+        return POST_COLUMNS, all_posts
+
+
+    # Scrapes posts and reactions, yielding each post (a dict of {column: value}) as soon as its page is written, so
+    #   that e.g. its comments can be retrieved while the next pages of posts are still being scraped
+    def iter_facebook_posts(self, output_file):
+        # Column names in the resulting csv file
+        columns = POST_COLUMNS
+
+        # The cursor of the next page is saved after every page, so that a restarted crawl continues from there
+        checkpoint = Checkpoint(output_file)
 
         # Parameters to keep track of progress
         has_next_page = True    # Facebook uses paging to handle long responses
         num_processed = 0       # total number of posts processed thus far
         start = time.time()     # time at which scraping started
-        all_posts = []          # contains every post scraped; we need to return this to retrieve comments for each post
+
+        # Ids of the posts in the output file; posts already in it (e.g. written just before a crash) are not written again
+        written = set()
+
+        if checkpoint.exists():
+            # Continue from the saved cursor; the posts written before it are still needed to retrieve their comments
+            for row in iter_written_rows(output_file):
+                written.add(row[0])
+                yield dict(zip(columns, row))
+            after = checkpoint.get('after')
+
+            # Every post was already retrieved (e.g. the crawl was stopped while scraping comments)
+            if after is None:
+                print("Already retrieved {} of {}'s statuses in an earlier crawl!\n".format(len(written), self.page_name))
+                return
+
+            print("Resuming {}'s Facebook posts from the last saved cursor ({} posts already written)..."
+                  .format(self.page_name, len(written)))
+        else:
+            # Write these column names to the file first, replacing the rows of earlier crawls
+            with open(output_file, 'w') as wf:
+                writer = csv.writer(wf)
+                writer.writerow(columns)
+
+            after = ''
+            # Saved right away so that a restarted crawl doesn't write the column names again
+            checkpoint.save(after=after)
 
         print("Scraping {}'s Facebook page for posts...".format(self.page_name))
 
-        after = ''
         # Keep looking for posts as long as there is another page of results
         while has_next_page:
-            after = '' if after is '' else "&after={}".format(after)
+            after_param = '' if after == '' else "&after={}".format(after)
             # Assemble the complete URL to send an HTTP GET request to
-            base_url = self.root + self.node + self.params + after + self.since
+            base_url = self.root + self.node + self.params + after_param + self.since
             url = self._get_post_feed_url(base_url)
 
-            # Request the data using an HTTP request
-            posts = self._request_until_success(url)
-            # Get the reactions to each of the posts
-            reactions = self._get_reactions_to_posts(base_url)
+            # Request the data and the reactions to each of the posts using an HTTP request
+            posts, reactions = self._request_with_reactions(base_url, url, self._get_reactions_to_posts)
 
+            batch = []          # contains the posts of this page (for batch output)
             for post in posts['data']:
 
                 # Ensure it is a post with the expected metadata
-                if 'reactions' in post:
+                if 'reactions' in post and post['id'] not in written:
                     post_data = self._process_post_reaction_data(post)
                     reactions_data = reactions[post_data[0]]
 
@@ -330,174 +619,195 @@ class FacebookScraper(object):
                     num_special = post_data[6] - sum(reactions_data)
 
                     # Add the post to our batch
-                    all_posts.append(post_data + reactions_data + (num_special,))
+                    batch.append(post_data + reactions_data + (num_special,))
+                    written.add(post_data[0])
 
                 num_processed += 1
 
-                # Once our batch size reaches 100, we write it to the output file
-                if num_processed % 100 == 0:
-                    print("Writing items {} to {} to {}...".format(num_processed - 99, num_processed, output_file))
-                    with open(output_file, 'a') as wf:
-                        writer = csv.writer(wf)
-                        for row in all_posts[-100:]:
-                            writer.writerow(row)
-                    print("Done writing!")
-                    print("{} Statuses Processed: {}".format(num_processed, datetime.datetime.now()))
+            # Write every page to the output file before saving the cursor of the next page
+            if len(batch) > 0:
+                self._write_batch(output_file, batch, num_processed, 'Statuses')
 
             # If there is no next page, we're done.
             if 'paging' in posts:
                 after = posts['paging']['cursors']['after']
+                checkpoint.save(after=after)
             else:
                 has_next_page = False
 
-        # Ensure that if there are any remaining posts, we write it to the output file
-        if num_processed % 100 > 0:
-            print("Writing remaining {} items to {}...".format(num_processed % 100, output_file))
-            with open(output_file, 'a') as wf:
-                writer = csv.writer(wf)
-                for row in all_posts[-(num_processed % 100):]:
-                    writer.writerow(row)
-            print("Done writing!")
+            for post_data in batch:
+                yield dict(zip(columns, post_data))
+
+        # Every post is written; the checkpoint is kept (with no cursor) until the caller is done with the posts, so
+        #   that a restarted crawl doesn't scrape them again (call Checkpoint(output_file).clear() when done)
+        checkpoint.save(after=None)
 
         end = time.time()
         print("Successfully retrieved {} of {}'s statuses in {} seconds!\n".format(num_processed, self.page_name, end - start))
 
-        return columns, all_posts
-
 
     # Main function to scrape comments and reactions
     def scrape_facebook_comments(self, posts, output_file):
         # Column names in the resulting csv file
-        columns = ["comment_id", "status_id", "parent_id", "comment_message",
-                       "comment_author", "comment_published", "num_reactions",
-                       "num_likes", "num_loves", "num_wows", "num_hahas",
-                       "num_sads", "num_angrys", "num_special"]
-        # Write these column names to the file first
-        with open(output_file, 'a') as wf:
-            writer = csv.writer(wf)
-            writer.writerow(columns)
+        columns = COMMENT_COLUMNS
+
+        # The position of the crawl (current post, comment cursor, and sub-comment cursor) is saved regularly, so that
+        #   a restarted crawl continues from there
+        # Saved position: {'status_id': post being scraped, 'after': cursor of the comment page being scraped (None
+        #   once every comment of the post is written), 'comment_id': comment whose replies are being scraped,
+        #   'sub_after': cursor of the reply page being scraped}
+        checkpoint = Checkpoint(output_file)
+
+        if checkpoint.exists():
+            # Comments already in the output file (e.g. written just before a crash) are not written again
+            written = read_written_ids(output_file)
+            position = checkpoint.state
+            print("Resuming {}'s Facebook comments from the last saved cursor ({} comments already written)..."
+                  .format(self.page_name, len(written)))
+        else:
+            # Write these column names to the file first, replacing the rows of earlier crawls
+            with open(output_file, 'w') as wf:
+                writer = csv.writer(wf)
+                writer.writerow(columns)
+
+            written = set()
+            position = {'status_id': None}
+            # Saved right away so that a restarted crawl doesn't write the column names again
+            checkpoint.save(**position)
 
         # Parameters to keep track of progress
         num_processed = 0       # total number of posts processed thus far
         start = time.time()     # time at which scraping started
-        batch = []              # contains only 100 posts at a time (for batch output)
+        batch = []              # contains the comments not written yet (for batch output)
+
+        # Writes the comments in the batch and then saves the position; rows are always written before the position
+        #   that comes after them is saved
+        def save(**state):
+            if len(batch) > 0:
+                self._write_batch(output_file, batch, num_processed, 'Comments')
+                del batch[:]
+            checkpoint.save(**state)
 
         print("Scraping {}'s Facebook page for comments...".format(self.page_name))
 
-        after = ''
+        # Skip the posts before the saved one; they are already done
+        skipping = position.get('status_id') is not None
+
         # Go through each post, get its status id, and retrieve all comments corresponding to that status id
         for post in posts:
+            status_id = post['status_id']
+            resume_comment_id, resume_sub_after = None, ''
+
+            if skipping:
+                if status_id != position['status_id']:
+                    continue
+                skipping = False
+                # Every comment of the saved post is already written
+                if position.get('after') is None:
+                    continue
+                after = position['after']
+                resume_comment_id = position.get('comment_id')
+                resume_sub_after = position.get('sub_after', '')
+            else:
+                after = ''
+
             has_next_page = True
 
             # Keep looking for comments as long as there is another page of results
             while has_next_page:
 
                 # Assemble the complete URL to send an HTTP GET request to
-                node = "/{}/comments".format(post['status_id'])
-                after = '' if after is '' else "&after={}".format(after)
-                base_url = self.root + node + self.params + after
+                base_url = self._get_comment_base_url(status_id, after)
                 url = self._get_comment_feed_url(base_url)
 
-                # Request the data using an HTTP request
-                comments = self._request_until_success(url)
-                # Get the reactions to each of the comments
-                reactions = self._get_reactions_to_comments(base_url)
+                # Request the data and the reactions to each of the comments using an HTTP request
+                comments, reactions = self._request_with_reactions(base_url, url, self._get_reactions_to_comments)
+
+                # When resuming in the middle of this page, the replies to the comments before the saved comment are
+                #   already written
+                skip_replies = resume_comment_id in [comment['id'] for comment in comments['data']]
 
                 # For each comment, also retrieve every comment to the comment
                 for comment in comments['data']:
-                    comment_data = self._process_comment_reaction_data(comment, post['status_id'])
-                    reactions_data = reactions[comment_data[0]]
+                    sub_after = ''
+                    if skip_replies and comment['id'] == resume_comment_id:
+                        skip_replies = False
+                        sub_after = resume_sub_after
 
-                    # calculate thankful/pride through algebra
-                    num_special = comment_data[6] - sum(reactions_data)
+                    if comment['id'] not in written:
+                        comment_data = self._process_comment_reaction_data(comment, status_id,
+                                                                           self._get_parent_id(comment))
+                        reactions_data = reactions[comment_data[0]]
 
-                    # Add the comment to our batch
-                    batch.append(comment_data + reactions_data + (num_special,))
+                        # calculate thankful/pride through algebra
+                        num_special = comment_data[6] - sum(reactions_data)
 
-                    num_processed += 1
+                        # Add the comment to our batch
+                        batch.append(comment_data + reactions_data + (num_special,))
+                        written.add(comment_data[0])
 
-                    if 'comments' in comment:
+                        num_processed += 1
+
+                    if 'comments' in comment and not skip_replies:
                         has_next_subpage = True
-                        sub_after = ''
 
                         # Basically the same as before, except now we are looking for comments to comments instead of
                         #   comments to posts
                         while has_next_subpage:
-                            sub_node = "/{}/comments".format(comment['id'])
-                            sub_after = '' if sub_after is '' else "&after={}".format(
-                                sub_after)
-                            sub_base_url = self.root + sub_node + self.params + sub_after
+                            sub_base_url = self._get_comment_base_url(comment['id'], sub_after)
 
                             sub_url = self._get_comment_feed_url(sub_base_url)
-                            sub_comments = self._request_until_success(sub_url)
-                            sub_reactions = self._get_reactions_to_comments(sub_base_url)
+                            sub_comments, sub_reactions = self._request_with_reactions(sub_base_url, sub_url,
+                                                                                       self._get_reactions_to_comments)
 
                             for sub_comment in sub_comments['data']:
-                                sub_comment_data = self._process_comment_reaction_data(sub_comment, post['status_id'], comment['id'])
+                                if sub_comment['id'] in written:
+                                    continue
+
+                                sub_comment_data = self._process_comment_reaction_data(sub_comment, status_id, comment['id'])
                                 sub_reactions_data = sub_reactions[sub_comment_data[0]]
 
                                 num_sub_special = sub_comment_data[6] - sum(sub_reactions_data)
 
                                 # Add the comment to our batch
                                 batch.append(sub_comment_data + sub_reactions_data + (num_sub_special,))
+                                written.add(sub_comment_data[0])
 
                                 num_processed += 1
 
-                                # Once our batch size reaches 100, we write it to the output file and clear the batch
-                                if len(batch) == 100:
-                                    print("Writing items {} to {} to {}...".format(num_processed - 99, num_processed,
-                                                                                   output_file))
-                                    with open(output_file, 'a') as wf:
-                                        writer = csv.writer(wf)
-                                        for row in batch:
-                                            writer.writerow(row)
-                                    batch = []
-                                    print("Done writing!")
-                                    print("{} Comments Processed: {}".format(num_processed, datetime.datetime.now()))
-
                             # Keep looking for comments to comments if there is another page of results
                             # If there is no next page, we're done.
-                            if 'paging' in sub_comments:
-                                if 'next' in sub_comments['paging']:
-                                    sub_after = sub_comments['paging']['cursors']['after']
-                                else:
-                                    has_next_subpage = False
+                            if 'paging' in sub_comments and 'next' in sub_comments['paging']:
+                                sub_after = sub_comments['paging']['cursors']['after']
+                                save(status_id=status_id, after=after, comment_id=comment['id'], sub_after=sub_after)
                             else:
                                 has_next_subpage = False
 
-                    # Once our batch size reaches 100, we write it to the output file and clear the batch
-                    if len(batch) == 100:
-                        print("Writing items {} to {} to {}...".format(num_processed - 99, num_processed, output_file))
-                        with open(output_file, 'a') as wf:
-                            writer = csv.writer(wf)
-                            for row in batch:
-                                writer.writerow(row)
-                        batch = []
-                        print("Done writing!")
-                        print("{} Comments Processed: {}".format(num_processed, datetime.datetime.now()))
+                resume_comment_id = None
 
                 # Keep looking for comments to posts if there is another page of results
                 # If there is no next page, we're done.
-                if 'paging' in comments:
-                    if 'next' in comments['paging']:
-                        after = comments['paging']['cursors']['after']
-                    else:
-                        has_next_page = False
+                if 'paging' in comments and 'next' in comments['paging']:
+                    after = comments['paging']['cursors']['after']
+                    save(status_id=status_id, after=after)
                 else:
                     has_next_page = False
 
+            # Every comment of this post is written
+            save(status_id=status_id, after=None)
+
         # Ensure that if there are any remaining comments, we write it to the output file
         if len(batch) > 0:
-            print("Writing remaining {} items to {}...".format(len(batch), output_file))
-            with open(output_file, 'a') as wf:
-                writer = csv.writer(wf)
-                for row in batch:
-                    writer.writerow(row)
-            print("Done writing!")
+            self._write_batch(output_file, batch, num_processed, 'Comments')
+
+        # The crawl is complete, so the next crawl starts from the beginning
+        checkpoint.clear()
 
         end = time.time()
         print("Successfully retrieved {} of {}'s comments in {} seconds!\n".format(num_processed, self.page_name, end - start))
 
+        return columns
+
 
     # Gets profile data of the page
     def get_profile_facebook(self, output_file):
@@ -508,8 +818,8 @@ class FacebookScraper(object):
         link = self.root + self.page_name + '/'
         # Request the data using an HTTP request, passing in the necessary access_token parameter and specifying the
         #   data fields that we are interested in
-        response = requests.get(link, params={'access_token': self.__access_token,
-                                              'fields': 'id, about, engagement, fan_count, link, name, username'})
+        response = self._request(link, params={'access_token': self.__access_token,
+                                               'fields': 'id, about, engagement, fan_count, link, name, username'})
         # Convert the response to a JSON object
         response = response.json()
 
@@ -526,27 +836,110 @@ class FacebookScraper(object):
         print("Successfully retrieved {}'s Facebook profile in {} seconds!\n".format(self.page_name, end - start))
 
 
+    # Gets the lifetime insights metrics of several posts (up to MAX_BATCH_SIZE) with a single request
+    # If the request is rejected (e.g. one of the posts has no insights because the page only shared it), each post
+    #   is requested on its own and the posts that are still rejected are left out
+    # Returns {status_id: {metric: value}}
+    def _get_post_insights_chunk(self, status_ids, metrics):
+        fields = '&fields=insights.metric({}).period(lifetime)'.format(','.join(metrics))
+        base_url = self.root + self.params + fields
+
+        try:
+            responses = [self._request_until_success(base_url + '&ids=' + ','.join(status_ids))]
+        except GraphAPIError as e:
+            print("Insights request for {} posts was rejected ({}); requesting each post separately.".format(
+                len(status_ids), e))
+            responses = []
+            for status_id in status_ids:
+                try:
+                    responses.append(self._request_until_success(base_url + '&ids=' + status_id))
+                except GraphAPIError as e:
+                    print("Leaving out the insights of {}: {}".format(status_id, e))
+
+        insights = {}
+        for response in responses:
+            for status_id, post in response.items():
+                insights[status_id] = dict((entry['name'], entry['values'][0]['value'])
+                                           for entry in post.get('insights', {}).get('data', [])
+                                           if len(entry['values']) > 0)
+
+        return insights
+
+
+    # Gets the reach and impressions of every post in status_ids (organic and paid)
+    # The posts are requested MAX_BATCH_SIZE at a time, max_workers requests at the same time
+    def get_post_insights_facebook(self, status_ids, output_file, max_workers=4):
+        print("Getting the insights of {}'s Facebook posts...".format(self.page_name))
+        start = time.time()
+
+        metrics = ['post_impressions', 'post_impressions_unique', 'post_impressions_organic',
+                   'post_impressions_organic_unique', 'post_impressions_paid', 'post_impressions_paid_unique']
+        # Column names in the resulting csv file
+        columns = ['status_id'] + metrics
+
+        status_ids = list(status_ids)
+        chunks = [status_ids[i:i + MAX_BATCH_SIZE] for i in range(0, len(status_ids), MAX_BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda chunk: self._get_post_insights_chunk(chunk, metrics), chunks)
+
+            # Posts without insights get empty values
+            output_data = []
+            for chunk, insights in zip(chunks, results):
+                for status_id in chunk:
+                    post_insights = insights.get(status_id, {})
+                    output_data.append([status_id] + [post_insights.get(metric, '') for metric in metrics])
+
+        # The insights of posts retrieved in earlier runs are replaced with the new values
+        merge_rows_into_csv(output_file, columns, output_data)
+
+        end = time.time()
+        print("Successfully retrieved the insights of {} of {}'s posts in {} seconds!\n".format(
+            len(output_data), self.page_name, end - start))
+
+
+    # Gets the values of the insights metrics of the page for every day in [since, until) with a single request
+    # If the request is rejected (e.g. a metric isn't available for the page), each metric is requested on its own
+    #   and the metrics that are still rejected are left out
+    # Returns {metric: {end_time: value}}
+    def _get_insights_window(self, metrics, since, until):
+        base_url = self.root + self.page_name + '/insights' + self.params + \
+            '&period=day&since={}&until={}'.format(since.strftime('%Y-%m-%d'), until.strftime('%Y-%m-%d'))
+
+        try:
+            responses = [self._request_until_success(base_url + '&metric=' + ','.join(metrics))]
+        except GraphAPIError as e:
+            print("Insights request for {} to {} was rejected ({}); requesting each metric separately.".format(
+                since.date(), until.date(), e))
+            responses = []
+            for metric in metrics:
+                try:
+                    responses.append(self._request_until_success(base_url + '&metric=' + metric))
+                except GraphAPIError as e:
+                    print("Leaving out {}: {}".format(metric, e))
+
+        values = {}
+        for response in responses:
+            for entry in response['data']:
+                # Only one period is requested, but keep the first entry of each metric just in case
+                if entry['name'] not in values:
+                    values[entry['name']] = dict((value['end_time'], value['value']) for value in entry['values'])
+
+        return values
+
+
     # Gets paid and organic impressions and engagements (at the day level)
-    def get_daily_engagements_facebook(self, output_file, num_days=10):
+    def get_daily_engagements_facebook(self, output_file, num_days=10, window_days=30, max_workers=4):
         print("Getting {}'s Facebook engagements...".format(self.page_name))
         start = time.time()
 
-        # Assemble the complete URLs to send an HTTP GET request to
-        engagement = self.root + self.page_name + '/insights/page_content_activity_by_action_type_unique'
-        total = self.root + self.page_name + '/insights/page_impressions'
-        total_unique = self.root + self.page_name + '/insights/page_impressions_unique'
-        organic = self.root + self.page_name + '/insights/page_impressions_organic'
-        organic_unique = self.root + self.page_name + '/insights/page_impressions_organic_unique'
-        paid = self.root + self.page_name + '/insights/page_impressions_paid'
-        paid_unique = self.root + self.page_name + '/insights/page_impressions_paid_unique'
-
-        lt_engagement = self.root + self.page_name + '/insights/post_activity_by_action_type_unique'
-        lt_total = self.root + self.page_name + '/insights/post_impressions'
-        lt_total_unique = self.root + self.page_name + '/insights/post_impressions_unique'
-        lt_organic = self.root + self.page_name + '/insights/post_impressions_organic'
-        lt_organic_unique = self.root + self.page_name + '/insights/post_impressions_organic_unique'
-        lt_paid = self.root + self.page_name + '/insights/post_impressions_paid'
-        lt_paid_unique = self.root + self.page_name + '/insights/post_impressions_paid_unique'
+        # The metrics to retrieve, in the order of the columns below
+        page_metrics = ['page_content_activity_by_action_type_unique', 'page_impressions',
+                        'page_impressions_unique', 'page_impressions_organic', 'page_impressions_organic_unique',
+                        'page_impressions_paid', 'page_impressions_paid_unique']
+        lifetime_metrics = ['post_activity_by_action_type_unique', 'post_impressions', 'post_impressions_unique',
+                            'post_impressions_organic', 'post_impressions_organic_unique', 'post_impressions_paid',
+                            'post_impressions_paid_unique']
 
         # Column names in the resulting csv file
         columns = ["Date",
@@ -569,115 +962,35 @@ class FacebookScraper(object):
             writer = csv.writer(wf)
             writer.writerow(columns)
 
+        # Split the last num_days days into windows of window_days days; every window takes a single request for all
+        #   the metrics, and the windows are requested at the same time
+        until = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        since = until - datetime.timedelta(days=num_days)
+        windows = []
+        while since < until:
+            windows.append((since, min(since + datetime.timedelta(days=window_days), until)))
+            since = windows[-1][1]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda window: self._get_insights_window(page_metrics + lifetime_metrics,
+                                                                                  *window), windows))
+
+        # Merge the windows into {metric: {end_time: value}}
+        values = dict((metric, {}) for metric in page_metrics + lifetime_metrics)
+        for result in results:
+            for metric, metric_values in result.items():
+                values.setdefault(metric, {}).update(metric_values)
+
+        # Assemble the data corresponding to the column names, one row per day starting from the latest day
+        # Ensure that there is data to be accessed before trying to access nonexistent fields; otherwise, replace
+        #   them with empty strings
         output_data = []
+        for end_time in sorted(values['page_impressions'], reverse=True):
+            page_data = tuple(values[metric].get(end_time, '') for metric in page_metrics)
+            lifetime_data = tuple(values[metric].get(end_time, '') for metric in lifetime_metrics)
+            lifetime_end_time = end_time if end_time in values['post_impressions'] else ''
 
-        # The loop does num_days // 2 + 1 because each response gives us 2 days worth of data (current and previous day).
-        # This is to stay consistent with what the caller wants in num_days
-        for _ in range(num_days // 2 + 1):
-            # Request the data using an HTTP request, passing in the necessary access_token parameter
-            e_resp = requests.get(engagement, params={'access_token': self.__access_token})
-            t_resp = requests.get(total, params={'access_token': self.__access_token})
-            tu_resp = requests.get(total_unique, params={'access_token': self.__access_token})
-            o_resp = requests.get(organic, params={'access_token': self.__access_token})
-            ou_resp = requests.get(organic_unique, params={'access_token': self.__access_token})
-            p_resp = requests.get(paid, params={'access_token': self.__access_token})
-            pu_resp = requests.get(paid_unique, params={'access_token': self.__access_token})
-
-            lt_e_resp = requests.get(lt_engagement, params={'access_token': self.__access_token})
-            lt_t_resp = requests.get(lt_total, params={'access_token': self.__access_token})
-            lt_tu_resp = requests.get(lt_total_unique, params={'access_token': self.__access_token})
-            lt_o_resp = requests.get(lt_organic, params={'access_token': self.__access_token})
-            lt_ou_resp = requests.get(lt_organic_unique, params={'access_token': self.__access_token})
-            lt_p_resp = requests.get(lt_paid, params={'access_token': self.__access_token})
-            lt_pu_resp = requests.get(lt_paid_unique, params={'access_token': self.__access_token})
-
-            # Convert the response to a JSON object
-            e_resp = e_resp.json()
-            t_resp = t_resp.json()
-            tu_resp = tu_resp.json()
-            o_resp = o_resp.json()
-            ou_resp = ou_resp.json()
-            p_resp = p_resp.json()
-            pu_resp = pu_resp.json()
-
-            lt_e_resp = lt_e_resp.json()
-            lt_t_resp = lt_t_resp.json()
-            lt_tu_resp = lt_tu_resp.json()
-            lt_o_resp = lt_o_resp.json()
-            lt_ou_resp = lt_ou_resp.json()
-            lt_p_resp = lt_p_resp.json()
-            lt_pu_resp = lt_pu_resp.json()
-
-            # Access the data field in the response
-            e_data = e_resp['data']
-            t_data = t_resp['data']
-            tu_data = tu_resp['data']
-            o_data = o_resp['data']
-            ou_data = ou_resp['data']
-            p_data = p_resp['data']
-            pu_data = pu_resp['data']
-
-            lt_e_data = lt_e_resp['data']
-            lt_t_data = lt_t_resp['data']
-            lt_tu_data = lt_tu_resp['data']
-            lt_o_data = lt_o_resp['data']
-            lt_ou_data = lt_ou_resp['data']
-            lt_p_data = lt_p_resp['data']
-            lt_pu_data = lt_pu_resp['data']
-
-            # Assemble the data corresponding to the column names; day 1 is the current day, day 2 is the previous day
-            # Ensure that there is data to be accessed before trying to access nonexistent fields; otherwise, replace
-            #   them with empty strings
-            if len(lt_t_data) > 0:
-                day1_data = (t_data[0]['values'][1]['end_time'], e_data[0]['values'][1]['value'],
-                             t_data[0]['values'][1]['value'], tu_data[0]['values'][1]['value'],
-                             o_data[0]['values'][1]['value'], ou_data[0]['values'][1]['value'],
-                             p_data[0]['values'][1]['value'], pu_data[0]['values'][1]['value'],
-                             lt_t_data[0]['values'][1]['end_time'], lt_e_data[0]['values'][1]['value'],
-                             lt_t_data[0]['values'][1]['value'], lt_tu_data[0]['values'][1]['value'],
-                             lt_o_data[0]['values'][1]['value'], lt_ou_data[0]['values'][1]['value'],
-                             lt_p_data[0]['values'][1]['value'], lt_pu_data[0]['values'][1]['value'])
-
-                day2_data = (t_data[0]['values'][0]['end_time'], e_data[0]['values'][0]['value'],
-                             t_data[0]['values'][0]['value'], tu_data[0]['values'][0]['value'],
-                             o_data[0]['values'][0]['value'], ou_data[0]['values'][0]['value'],
-                             p_data[0]['values'][0]['value'], pu_data[0]['values'][0]['value'],
-                             lt_t_data[0]['values'][0]['end_time'], lt_e_data[0]['values'][0]['value'],
-                             lt_t_data[0]['values'][0]['value'], lt_tu_data[0]['values'][0]['value'],
-                             lt_o_data[0]['values'][0]['value'], lt_ou_data[0]['values'][0]['value'],
-                             lt_p_data[0]['values'][0]['value'], lt_pu_data[0]['values'][0]['value'])
-            else:
-                day1_data = (t_data[0]['values'][1]['end_time'], e_data[0]['values'][1]['value'],
-                             t_data[0]['values'][1]['value'], tu_data[0]['values'][1]['value'],
-                             o_data[0]['values'][1]['value'], ou_data[0]['values'][1]['value'],
-                             p_data[0]['values'][1]['value'], pu_data[0]['values'][1]['value'],
-                             '', '', '', '', '', '', '')
-
-                day2_data = (t_data[0]['values'][0]['end_time'], e_data[0]['values'][0]['value'],
-                             t_data[0]['values'][0]['value'], tu_data[0]['values'][0]['value'],
-                             o_data[0]['values'][0]['value'], ou_data[0]['values'][0]['value'],
-                             p_data[0]['values'][0]['value'], pu_data[0]['values'][0]['value'],
-                             '', '', '', '', '', '', '')
-
-            output_data.append(day1_data)
-            output_data.append(day2_data)
-
-            # Keep looking for engagements as long as there is another page of results
-            engagement = e_resp['paging']['previous']
-            total = t_resp['paging']['previous']
-            total_unique = tu_resp['paging']['previous']
-            organic = o_resp['paging']['previous']
-            organic_unique = ou_resp['paging']['previous']
-            paid = p_resp['paging']['previous']
-            paid_unique = pu_resp['paging']['previous']
-
-            lt_engagement = lt_e_resp['paging']['previous']
-            lt_total = lt_t_resp['paging']['previous']
-            lt_total_unique = lt_tu_resp['paging']['previous']
-            lt_organic = lt_o_resp['paging']['previous']
-            lt_organic_unique = lt_ou_resp['paging']['previous']
-            lt_paid = lt_p_resp['paging']['previous']
-            lt_paid_unique = lt_pu_resp['paging']['previous']
+            output_data.append((end_time,) + page_data + (lifetime_end_time,) + lifetime_data)
 
         # Write the data to the output
         with open(output_file, 'a') as wf:
@@ -687,3 +1000,345 @@ class FacebookScraper(object):
 
         end = time.time()
         print("Successfully retrieved {}'s Facebook engagements in {} seconds!\n".format(self.page_name, end - start))
+
+
+class _GraphBatcher(object):
+    """
+    Collects the requests made by the coroutines of AsyncFacebookScraper and sends them in Graph batch requests of up to
+    MAX_BATCH_SIZE requests each, so that e.g. the next comment pages of 50 posts take one HTTP round trip instead of 50.
+    The response to each request is handed back to the coroutine that made it.
+    """
+    def __init__(self, scraper, batch_size=MAX_BATCH_SIZE, delay=0.01):
+        self.scraper = scraper
+        self.batch_size = batch_size
+        # Seconds to wait for more requests before sending a batch that isn't full
+        self.delay = delay
+        self.num_batches = 0
+        self.__pending = []     # [(url, future)] of the requests not sent yet
+        self.__timer = None
+
+
+    async def fetch(self, url):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.__pending.append((url, future))
+
+        if len(self.__pending) >= self.batch_size:
+            self.__flush()
+        elif self.__timer is None:
+            self.__timer = loop.call_later(self.delay, self.__flush)
+
+        return await future
+
+
+    def __flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+        while len(self.__pending) > 0:
+            batch, self.__pending = self.__pending[:self.batch_size], self.__pending[self.batch_size:]
+            asyncio.ensure_future(self.__send(batch))
+
+
+    async def __send(self, batch):
+        scraper = self.scraper
+        root = scraper.root
+        loop = asyncio.get_event_loop()
+
+        try:
+            async with scraper._semaphore:
+                responses = await loop.run_in_executor(scraper._executor, scraper._request_until_success, root,
+                                                       [url[len(root):] for url, _ in batch])
+            self.num_batches += 1
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # A reply with fewer responses than requests (or none at all) leaves the rest to be sent again
+        responses = responses if isinstance(responses, list) else []
+        responses += [None] * (len(batch) - len(responses))
+
+        # Every future is settled, even if a response can't be read, so no coroutine waits for it forever
+        for (url, future), response in zip(batch, responses):
+            if future.done():
+                continue
+            try:
+                self.__settle(url, future, response)
+            except Exception as e:
+                future.set_exception(e)
+
+
+    def __settle(self, url, future, response):
+        # A body that isn't JSON (e.g. an HTML error page from a proxy) is treated like a timed out request
+        try:
+            body = None if response is None else json.loads(response['body'])
+        except ValueError:
+            response, body = None, None
+
+        # Every request in a batch succeeds or fails on its own
+        if response is not None and response['code'] == 200:
+            future.set_result(body)
+            return
+
+        # The request itself is invalid, so sending it again won't help (e.g. aliased fields are not supported)
+        error = body.get('error', {}) if isinstance(body, dict) else {}
+        if response is not None and response['code'] == 400 and error.get('code') not in RATE_LIMIT_ERROR_CODES:
+            future.set_exception(GraphAPIError(error.get('message', response['body'])))
+            return
+
+        # The request timed out or failed for a reason that may go away (e.g. the rate limit); send it on its own
+        #   until it succeeds
+        asyncio.ensure_future(self.__retry(url, future))
+
+
+    async def __retry(self, url, future):
+        try:
+            future.set_result(await self.scraper._fetch_one(url))
+        except Exception as e:
+            future.set_exception(e)
+
+
+# Facebook Scraper Object that retrieves the comments of many posts at the same time
+# Writes the same CSV files as FacebookScraper; only scrape_facebook_comments is different
+class AsyncFacebookScraper(FacebookScraper):
+    """
+    Comment scraping with FacebookScraper waits for every page of comments, reactions, and replies one at a time, so
+    on pages with many posts it is bound by the latency of the Graph API. This scraper runs the comment crawl on an
+    asyncio event loop instead: up to max_in_flight posts are crawled at the same time, the reactions of a page and the
+    replies to the comments on a page are requested together, and at most max_in_flight requests are in flight at once.
+    The pages of a single post are still requested in order, and the rows of each post are written in the same order
+    as FacebookScraper writes them.
+
+    requests is blocking, so each request is run on a worker thread (through the shared connection pool, see
+    utils/http_utils.py) and still counts against the access token's rate limit.
+
+    If batch_size is more than 1, the requests of all the posts being crawled are packed into Graph batch requests of
+    up to batch_size requests (see _GraphBatcher), max_in_flight batches at a time, and batch_size posts are crawled at
+    the same time to fill them.
+    """
+    def __init__(self, access_token, page_name, since_date, flat_comments=False, max_in_flight=10,
+                 batch_size=MAX_BATCH_SIZE):
+        super(AsyncFacebookScraper, self).__init__(access_token, page_name, since_date, flat_comments)
+        # Maximum number of requests (or batch requests) at the same time
+        self.max_in_flight = max_in_flight
+        # Maximum number of requests in one batch request (1 to send every request on its own)
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self._batcher = None
+
+
+    # Send request until success on a worker thread, without holding up the event loop
+    async def _fetch_one(self, url):
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._executor, self._request_until_success, url)
+
+
+    # Send request until success, as part of a batch request if batching is on
+    async def _fetch(self, url):
+        if self._batcher is not None:
+            return await self._batcher.fetch(url)
+        return await self._fetch_one(url)
+
+
+    # Get the reactions for each comment, requesting every reaction type at the same time
+    async def _fetch_reactions(self, base_url):
+        urls = [base_url + "&fields=reactions.type({}).limit(0).summary(total_count)".format(reaction_type.upper())
+                for reaction_type in REACTION_TYPES]
+        responses = await asyncio.gather(*[self._fetch(url) for url in urls])
+
+        reactions_dict = {}  # dict of {comment_id: tuple<6>}
+        for response in responses:
+            comments_seen = set()  # to remove duplicate comments
+            for comment in response['data']:
+                comments_seen.add((comment['id'], comment['reactions']['summary']['total_count']))
+
+            for id, reaction_count in comments_seen:
+                reactions_dict[id] = reactions_dict.get(id, ()) + (reaction_count,)
+
+        return reactions_dict
+
+
+    # Get every page of comments under node (a post or a comment), in order, as rows of the output file
+    async def _fetch_comments(self, status_id, node_id, written, parent_id=''):
+        rows = []
+        after = ''
+        has_next_page = True
+
+        while has_next_page:
+            base_url = self._get_comment_base_url(node_id, after)
+            url = self._get_comment_feed_url(base_url)
+
+            # Request the page and its reactions together (see _request_with_reactions)
+            comments, reactions = None, None
+            if self.aliased_reactions:
+                try:
+                    comments = await self._fetch(url + self._get_aliased_reaction_fields())
+                    reactions = self._get_aliased_reactions(comments['data'])
+                except GraphAPIError as e:
+                    print("Aliased reaction fields were rejected: {}".format(e))
+
+                if reactions is None and self.aliased_reactions:
+                    print("Requesting each reaction type separately from now on.")
+                    self.aliased_reactions = False
+
+            if reactions is None:
+                comments, reactions = await asyncio.gather(self._fetch(url), self._fetch_reactions(base_url))
+
+            # Replies are only retrieved for comments to posts; request the replies to every comment on the page
+            #   together, then put each comment's replies right after it
+            if parent_id == '':
+                replies = await asyncio.gather(*[self._fetch_comments(status_id, comment['id'], written, comment['id'])
+                                                 if 'comments' in comment else self._no_replies()
+                                                 for comment in comments['data']])
+            else:
+                replies = [[] for _ in comments['data']]
+
+            for comment, comment_replies in zip(comments['data'], replies):
+                if comment['id'] not in written:
+                    comment_data = self._process_comment_reaction_data(comment, status_id,
+                                                                       self._get_parent_id(comment, parent_id))
+                    reactions_data = reactions[comment_data[0]]
+
+                    # calculate thankful/pride through algebra
+                    num_special = comment_data[6] - sum(reactions_data)
+
+                    rows.append(comment_data + reactions_data + (num_special,))
+                    written.add(comment_data[0])
+
+                rows += comment_replies
+
+            # Keep looking for comments if there is another page of results
+            # If there is no next page, we're done.
+            if 'paging' in comments and 'next' in comments['paging']:
+                after = comments['paging']['cursors']['after']
+            else:
+                has_next_page = False
+
+        return rows
+
+
+    async def _no_replies(self):
+        return []
+
+
+    # Hands the ids of the posts that aren't done yet to the workers, through a queue of at most one post per worker
+    # posts may be a generator that blocks (e.g. posts that are still being scraped), so it is advanced on a thread
+    #   of its own
+    async def _feed_posts(self, posts, done, queue, num_workers):
+        loop = asyncio.get_event_loop()
+        posts = iter(posts)
+
+        while True:
+            post = await loop.run_in_executor(None, next, posts, None)
+            if post is None:
+                break
+            if post['status_id'] not in done:
+                await queue.put(post['status_id'])
+
+        # Tell every worker that there are no more posts
+        for _ in range(num_workers):
+            await queue.put(None)
+
+
+    # Crawls the posts taken from the queue one after the other, writing the comments of each post once it is done
+    async def _comment_worker(self, queue, written, write_post):
+        while True:
+            status_id = await queue.get()
+            if status_id is None:
+                return
+
+            rows = await self._fetch_comments(status_id, status_id, written)
+            write_post(status_id, rows)
+
+
+    async def _scrape_comments(self, posts, done, written, write_post):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._batcher = _GraphBatcher(self, self.batch_size) if self.batch_size > 1 else None
+        num_workers = self.batch_size if self._batcher is not None else self.max_in_flight
+        # Every worker takes the next post from the same queue, so each post is crawled exactly once
+        queue = asyncio.Queue(maxsize=num_workers)
+        workers = [asyncio.ensure_future(self._feed_posts(posts, done, queue, num_workers))]
+        workers += [asyncio.ensure_future(self._comment_worker(queue, written, write_post))
+                    for _ in range(num_workers)]
+        try:
+            await asyncio.gather(*workers)
+        except Exception:
+            # Stop the other workers before giving up, so that nothing is left running on the closed event loop
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+
+
+    # Main function to scrape comments and reactions
+    def scrape_facebook_comments(self, posts, output_file):
+        # Column names in the resulting csv file
+        columns = COMMENT_COLUMNS
+
+        # Posts are crawled at the same time, so instead of a cursor, the checkpoint keeps the ids of the posts whose
+        #   comments are all written: {'done': [status_id, ...]}
+        checkpoint = Checkpoint(output_file)
+
+        if checkpoint.exists():
+            # Comments already in the output file (e.g. written just before a crash) are not written again
+            written = read_written_ids(output_file)
+            done = set(checkpoint.get('done', []))
+            print("Resuming {}'s Facebook comments ({} posts and {} comments already written)..."
+                  .format(self.page_name, len(done), len(written)))
+        else:
+            # Write these column names to the file first, replacing the rows of earlier crawls
+            with open(output_file, 'w') as wf:
+                writer = csv.writer(wf)
+                writer.writerow(columns)
+
+            written = set()
+            done = set()
+            # Saved right away so that a restarted crawl doesn't write the column names again
+            checkpoint.save(done=[])
+
+        # Parameters to keep track of progress
+        progress = {'num_processed': 0,     # total number of comments processed thus far
+                    'saved': time.time()}   # time at which the checkpoint was last saved
+        start = time.time()                 # time at which scraping started
+
+        # Called on the event loop as soon as every comment of a post is retrieved; rows are written before the post
+        #   is recorded as done
+        # The checkpoint is saved at most every CHECKPOINT_INTERVAL seconds (and once the crawl stops), since it holds
+        #   every post done so far; the posts done since the last save are crawled again by a restarted crawl, but
+        #   their comments are not written again
+        def write_post(status_id, rows):
+            if len(rows) > 0:
+                progress['num_processed'] += len(rows)
+                self._write_batch(output_file, rows, progress['num_processed'], 'Comments')
+            done.add(status_id)
+            if time.time() - progress['saved'] >= CHECKPOINT_INTERVAL:
+                checkpoint.save(done=sorted(done))
+                progress['saved'] = time.time()
+
+        print("Scraping {}'s Facebook page for comments ({} requests at a time)...".format(self.page_name,
+                                                                                          self.max_in_flight))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._scrape_comments(posts, done, written, write_post))
+        finally:
+            loop.close()
+            self._executor.shutdown()
+            # Save every post done, also if the crawl was stopped
+            # Once every comment is written, the checkpoint is kept (with every post done) until the caller is done
+            #   with the comments, so that a restarted crawl doesn't write them again (call
+            #   Checkpoint(output_file).clear() when done)
+            checkpoint.save(done=sorted(done))
+
+        if self._batcher is not None:
+            print("Sent {} batch requests of up to {} requests each".format(self._batcher.num_batches, self.batch_size))
+
+        end = time.time()
+        print("Successfully retrieved {} of {}'s comments in {} seconds!\n".format(progress['num_processed'],
+                                                                                  self.page_name, end - start))
+
+        return columns
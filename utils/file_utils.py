@@ -1,7 +1,70 @@
 import os
 import csv
+import json
 import time
-import ast
+import contextlib
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Opens a temporary file to write instead of path, and moves it over path once the with block is done, so that a
+    crash can never leave a half-written file behind.
+
+    :return: the temporary file, opened for writing
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        yield f
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path, data, **kwargs):
+    """
+    Writes data to path as JSON (see atomic_write); kwargs are passed to json.dumps.
+    """
+    with atomic_write(path) as f:
+        f.write(json.dumps(data, **kwargs))
+
+
+def merge_rows_into_csv(output_file, columns, rows, key_column=0):
+    """
+    Merges rows into output_file (e.g. the posts retrieved by an incremental run into the posts of earlier runs).
+    A row whose key (the value in key_column) is already in the file replaces the existing row, e.g. a post whose
+    reaction counts changed; the other rows are added at the end. If output_file doesn't exist, it is created with
+    columns as the header.
+
+    :return: (num_updated, num_added)
+    """
+    existing = []
+    if os.path.isfile(output_file):
+        with open(output_file, 'r') as rf:
+            reader = csv.reader(rf)
+            existing = list(reader)[1:]
+
+    new_rows = dict((str(row[key_column]), row) for row in rows)
+    num_updated, num_added = 0, 0
+
+    # A crash while writing leaves the file as it was
+    with atomic_write(output_file) as wf:
+        writer = csv.writer(wf)
+        writer.writerow(columns)
+
+        for row in existing:
+            key = row[key_column] if len(row) > key_column else None
+            if key in new_rows:
+                writer.writerow(new_rows.pop(key))
+                num_updated += 1
+            else:
+                writer.writerow(row)
+
+        # Whatever is left wasn't in the file yet; keep the order the rows came in
+        for row in rows:
+            if str(row[key_column]) in new_rows:
+                writer.writerow(new_rows.pop(str(row[key_column])))
+                num_added += 1
+
+    return num_updated, num_added
 
 
 def join_post_files(readpath, company):
@@ -52,6 +115,7 @@ def join_post_files(readpath, company):
                                 new_row = [None] * len(header)
                                 new_row[0] = 'Weibo'
                                 new_row[1] = company
+                                new_row[2] = row[6]
                                 new_row[7] = row[0]
                                 new_row[3] = row[1]
                                 new_row[8] = row[5]
@@ -59,10 +123,10 @@ def join_post_files(readpath, company):
                                 new_row[10] = row[3]
                                 new_row[11] = 'likes'
                                 new_row[12] = row[5]
-                                new_row[13] = row[6]
-                                new_row[14] = row[7]
-                                new_row[15] = row[8]
-                                new_row[16] = row[9]
+                                new_row[13] = row[7]
+                                new_row[14] = row[8]
+                                new_row[15] = row[9]
+                                new_row[16] = row[10]
                                 data_output.append(new_row)
 
                     # Instagram columns need to be adjusted to mean the same as Facebook columns; if no corresponding
@@ -97,25 +161,28 @@ def join_post_files(readpath, company):
                         with open(os.path.join(social_media_source_path, readfile), 'r') as rf:
                             reader = csv.reader(rf)
                             for row in reader:
+                                # Find the columns by name in the header (see TWEET_COLUMNS in utils/twitter_utils.py
+                                #   and the NLP columns after them)
                                 if not header_found:
                                     header_found = True
+                                    columns = dict((name, i) for i, name in enumerate(row))
                                     continue
                                 new_row = [None] * len(header)
                                 new_row[0] = 'Twitter'
                                 new_row[1] = company
-                                new_row[7] = row[0]
-                                new_row[2] = row[1]
-                                new_row[3] = row[2]
-                                metadata = ast.literal_eval(row[4])
-                                new_row[6] = metadata['urls'][0]['expanded_url'] if len(metadata['urls']) > 0 else ''
-                                new_row[10] = row[8]
-                                new_row[8] = row[9]
+                                new_row[7] = row[columns['created_at']]
+                                new_row[2] = row[columns['id_str']]
+                                new_row[3] = row[columns['full_text']]
+                                # The first link in the tweet
+                                new_row[6] = row[columns['urls']].split(' ')[0]
+                                new_row[10] = row[columns['retweet_count']]
+                                new_row[8] = row[columns['favorite_count']]
                                 new_row[11] = 'likes'
-                                new_row[12] = row[9]
-                                new_row[13] = row[10]
-                                new_row[14] = row[11]
-                                new_row[15] = row[12]
-                                new_row[16] = row[13]
+                                new_row[12] = row[columns['favorite_count']]
+                                new_row[13] = row[columns['sentiment_pos']]
+                                new_row[14] = row[columns['sentiment_neg']]
+                                new_row[15] = row[columns['keyword']]
+                                new_row[16] = row[columns['keyword_weight']]
                                 data_output.append(new_row)
 
                     # LinkedIn columns need to be adjusted to mean the same as Facebook columns; if no corresponding
@@ -192,9 +259,35 @@ def join_comment_files(readpath, company):
                                     continue
                                 data_output.append(row)
 
-                    # Weibo has no comment data
+                    # Weibo columns need to be adjusted to mean the same as Facebook columns; if no corresponding
+                    #   column is found, leave it empty
                     elif 'weibo' in readfile:
-                        continue
+                        with open(os.path.join(social_media_source_path, readfile), 'r') as rf:
+                            reader = csv.reader(rf)
+                            for row in reader:
+                                # Find the columns by name in the header (see get_comments_weibo in
+                                #   utils/weibo_utils.py and the NLP columns after them)
+                                if not header_found:
+                                    header_found = True
+                                    columns = dict((name, i) for i, name in enumerate(row))
+                                    continue
+                                new_row = [None] * len(header)
+                                new_row[0] = 'Weibo'
+                                new_row[1] = company
+                                new_row[2] = row[columns['comment_id']]
+                                new_row[3] = row[columns['mblog_id']]
+                                new_row[4] = row[columns['parent_id']]
+                                new_row[5] = row[columns['Comment']]
+                                new_row[6] = row[columns['comment_author']]
+                                new_row[7] = row[columns['Created at']]
+                                new_row[8] = row[columns['num_likes']]
+                                new_row[9] = 'likes'
+                                new_row[10] = row[columns['num_likes']]
+                                new_row[11] = row[columns['sentiment_pos']]
+                                new_row[12] = row[columns['sentiment_neg']]
+                                new_row[13] = row[columns['keyword']]
+                                new_row[14] = row[columns['keyword_weight']]
+                                data_output.append(new_row)
 
                     # Instagram columns need to be adjusted to mean the same as Facebook columns; if no corresponding
                     #   column is found, leave it empty
@@ -0,0 +1,81 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from utils.config_utils import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_MAX_HOSTS
+
+
+# Changed with configure() (e.g. from main.py's --timeout and --max-connections)
+CONNECT_TIMEOUT = HTTP_CONNECT_TIMEOUT
+READ_TIMEOUT = HTTP_READ_TIMEOUT
+MAX_CONNECTIONS_PER_HOST = HTTP_MAX_CONNECTIONS_PER_HOST
+MAX_HOSTS = HTTP_MAX_HOSTS
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(connect_timeout=None, read_timeout=None, max_connections_per_host=None):
+    """
+    Changes the timeouts and the per-host connection limit. Takes effect for every request made afterwards.
+    """
+    global _session, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_CONNECTIONS_PER_HOST
+
+    with _session_lock:
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+        if max_connections_per_host is not None:
+            MAX_CONNECTIONS_PER_HOST = max_connections_per_host
+            # The connection pools are sized when the session is created, so start a new one
+            if _session is not None:
+                _session.close()
+                _session = None
+
+
+def get_session():
+    """
+    Gets the HTTP session shared by every scraper in this process, creating it on first use.
+    The session keeps connections alive and reuses them, so repeated calls to the same API (e.g. thousands of Graph
+    API calls for Facebook comments) don't pay for a new TCP/TLS handshake every time.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # pool_block makes callers wait for a free connection instead of opening more than
+            #   MAX_CONNECTIONS_PER_HOST connections to one host
+            adapter = HTTPAdapter(pool_connections=MAX_HOSTS, pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+                                  pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            # Ask for compressed responses; requests decompresses them transparently
+            session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+            _session = session
+
+        return _session
+
+
+def get(url, params=None, timeout=None, **kwargs):
+    """
+    Sends an HTTP GET request through the shared session.
+
+    :param timeout: (float or tuple) overrides the default (CONNECT_TIMEOUT, READ_TIMEOUT)
+    :return: requests.Response
+    """
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT) if timeout is None else timeout
+
+    return get_session().get(url, params=params, timeout=timeout, **kwargs)
+
+
+def post(url, data=None, timeout=None, **kwargs):
+    """
+    Sends an HTTP POST request through the shared session.
+
+    :param timeout: (float or tuple) overrides the default (CONNECT_TIMEOUT, READ_TIMEOUT)
+    :return: requests.Response
+    """
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT) if timeout is None else timeout
+
+    return get_session().post(url, data=data, timeout=timeout, **kwargs)
@@ -1,54 +1,208 @@
-import requests
+from utils import http_utils
 import time
 import json
-import csv
+import calendar
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils.ratelimit_utils import get_rate_limiter
+from utils.file_utils import merge_rows_into_csv
+from utils.checkpoint_utils import iter_written_rows
 
 
-def get_company_updates(cid, access_token, posts_output, comments_output):
+# Number of company updates (and comments) requested per page, and number of pages requested at the same time
+PAGE_SIZE = 50
+MAX_PAGES_IN_FLIGHT = 4
+# Number of days of historical statistics requested at a time (several windows are requested at the same time)
+WINDOW_DAYS = 90
+
+
+class LinkedInAPIError(Exception):
+    """
+    Raised when a LinkedIn API request fails.
+    """
+    pass
+
+
+def _to_local_time(timestamp):
+    # LinkedIn gives times as UNIX timestamps in ms; the output files use Hong Kong time
+    return (datetime.datetime.utcfromtimestamp(timestamp/1000) + datetime.timedelta(hours=+8)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _request_linkedin(link, access_token, params=None):
+    """
+    Sends an HTTP GET request to the LinkedIn API once the access token's rate limit allows it.
+
+    :return: (dict) the JSON response
+    """
+    params = dict(params or {}, oauth2_access_token=access_token)
+
+    get_rate_limiter('LinkedIn', access_token).wait()
+    response = http_utils.get(link, params=params)
+    if not response.ok:
+        raise LinkedInAPIError("An error occurred! Error code {}: {}".format(response.status_code, response.reason))
+
+    return json.loads(response.text)
+
+
+def _get_all_update_comments(cid, update, access_token):
+    """
+    Gets every comment to a company update. The update only comes with its first comments, so the rest are requested
+    PAGE_SIZE at a time.
+
+    :return: list of comments
+    """
+    comments = update['updateComments'].get('values', [])
+    total = update['updateComments']['_total']
+    if len(comments) >= total:
+        return comments
+
+    link = 'https://api.linkedin.com/v1/companies/{}/updates/key={}/update-comments?format=json'.format(
+        cid, update['updateKey'])
+    comments = []
+    while len(comments) < total:
+        output = _request_linkedin(link, access_token, {'start': len(comments), 'count': PAGE_SIZE})
+        page = output.get('values', [])
+        if len(page) == 0:
+            break
+        comments += page
+
+    return comments
+
+
+def get_company_updates(cid, access_token, posts_output, comments_output, since_ts=None):
+    """
+    Gets the updates (posts) of a company page and every comment to them, and merges them into posts_output and
+    comments_output (an update or comment already in the files replaces its row).
+    The updates are requested PAGE_SIZE at a time, MAX_PAGES_IN_FLIGHT pages at the same time, newest first.
+
+    :param since_ts: (int) if given, only the updates published after this UNIX timestamp (in ms) are retrieved
+    :return: (int) timestamp of the newest update retrieved, or since_ts if there were no new updates
+    """
     # URL to send an HTTP GET request to
     link = 'https://api.linkedin.com/v1/companies/{}/updates?format=json'.format(cid)
 
     print("Getting LinkedIn Company Updates...")
     start = time.time()
 
-    # Request the data using an HTTP request, passing in the necessary access_token parameter
-    response = requests.get(link, params={'oauth2_access_token': access_token})
+    updates = []
+    newest_ts = since_ts
+
+    with ThreadPoolExecutor(max_workers=MAX_PAGES_IN_FLIGHT) as executor:
+        # The first page also gives the total number of updates
+        first_page = _request_linkedin(link, access_token, {'start': 0, 'count': PAGE_SIZE})
+        total = first_page.get('_total', 0)
+        pages = [first_page]
+        page_start = PAGE_SIZE
+
+        while True:
+            done = False
+            for output in pages:
+                for row in output.get('values', []):
+                    # The updates are newest first, so the rest were retrieved by earlier runs
+                    if since_ts is not None and row['timestamp'] <= since_ts:
+                        done = True
+                        break
+                    updates.append(row)
+                if done or len(output.get('values', [])) == 0:
+                    done = True
+                    break
+
+            if done or page_start >= total:
+                break
+
+            # Request the next few pages at the same time
+            starts = range(page_start, min(page_start + PAGE_SIZE * MAX_PAGES_IN_FLIGHT, total), PAGE_SIZE)
+            pages = list(executor.map(lambda page: _request_linkedin(link, access_token,
+                                                                     {'start': page, 'count': PAGE_SIZE}), starts))
+            page_start += PAGE_SIZE * len(starts)
+
+        # Get every comment to every update, a few updates at the same time
+        all_comments = list(executor.map(lambda update: _get_all_update_comments(cid, update, access_token), updates))
+
+    # Posts
+    header = ['status_id', 'status_message', 'status_published', 'num_comments', 'num_likes']
+    rows = []
+    # Extract the relevant data fields and write it to posts_output
+    for row in updates:
+        new_row = [row['updateContent']['companyStatusUpdate']['share']['id'],
+                   row['updateContent']['companyStatusUpdate']['share']['comment'],
+                   _to_local_time(row['timestamp']),
+                   row['updateComments']['_total'], row['likes']['_total']]
+        rows.append(new_row)
+        newest_ts = row['timestamp'] if newest_ts is None else max(newest_ts, row['timestamp'])
+    merge_rows_into_csv(posts_output, header, rows)
+
+    # Comments
+    header = ['comment_id', 'comment_message', 'comment_published']
+    rows = []
+    # Extract the relevant data fields and write it to comments_output
+    for comments in all_comments:
+        for comment in comments:
+            new_row = [comment['id'], comment['comment'], _to_local_time(comment['timestamp'])]
+            rows.append(new_row)
+    merge_rows_into_csv(comments_output, header, rows)
 
     end = time.time()
-
-    if response.ok:
-        output = json.loads(response.text)
-
-        # Posts
-        with open(posts_output, 'a') as wf:
-            writer = csv.writer(wf)
-            header = ['status_id', 'status_message', 'status_published', 'num_comments', 'num_likes']
-            writer.writerow(header)
-
-            # Extract the relevant data fields and write it to posts_output
-            for row in output['values']:
-                new_row = [row['updateContent']['companyStatusUpdate']['share']['id'],
-                           row['updateContent']['companyStatusUpdate']['share']['comment'],
-                           (datetime.datetime.utcfromtimestamp(row['timestamp']/1000) + datetime.timedelta(hours=+8)).strftime('%Y-%m-%d %H:%M:%S'),
-                           row['updateComments']['_total'], row['likes']['_total']]
-                writer.writerow(new_row)
-
-        # Comments
-        with open(comments_output, 'a') as wf:
-            writer = csv.writer(wf)
-            header = ['comment_id', 'comment_message', 'comment_published']
-            writer.writerow(header)
-
-            # Extract the relevant data fields and write it to comments_output
-            for row in output['values']:
-                for comment in row['updateComments']['values']:
-                    new_row = [comment['id'], comment['comment'],
-                               (datetime.datetime.utcfromtimestamp(comment['timestamp']/1000) + datetime.timedelta(hours=+8)).strftime('%Y-%m-%d %H:%M:%S')]
-                    writer.writerow(new_row)
-        print("Successfully retrieved LinkedIn Company Updates in {} seconds!\n".format(end-start))
-    else:
-        print("An error occurred! Error code {}: {}".format(response.status_code, response.reason))
+    print("Successfully retrieved {} LinkedIn Company Updates and {} comments in {} seconds!\n".format(
+        len(updates), len(rows), end-start))
+
+    return newest_ts
+
+
+def _get_last_stored_time(output_file):
+    # Time (UNIX timestamp in ms) of the last row of a historical statistics file, or None if it has no rows
+    last_date = None
+    for row in iter_written_rows(output_file):
+        # Older runs wrote the header again every time
+        if len(row) > 0 and row[0] != 'date':
+            last_date = row[0]
+    if last_date is None:
+        return None
+
+    # The dates are in Hong Kong time (see _to_local_time)
+    date = datetime.datetime.strptime(last_date, '%Y-%m-%d %H:%M:%S') - datetime.timedelta(hours=+8)
+    return calendar.timegm(date.timetuple()) * 1000
+
+
+def _get_historical_statistics(link, interval, access_token, output_file, header, get_row, from_ts):
+    """
+    Gets historical statistics (one row per interval) and merges them into output_file by date.
+    Only the time since the last row in output_file is requested (or since from_ts if the file has no rows yet); a long
+    range is split into windows of WINDOW_DAYS days that are requested at the same time.
+
+    :param get_row: function that gets the values of the columns after the date from a data point
+    :param from_ts: (str) when to start (UNIX timestamp in ms) if output_file has no rows yet
+    :return: (num_updated, num_added)
+    """
+    last_ts = _get_last_stored_time(output_file)
+    # The last stored interval is asked for again in case it wasn't over yet when it was stored; its row is replaced
+    #   with the new values
+    start_ts = int(from_ts) if last_ts is None else last_ts
+    end_ts = int(time.time() * 1000)
+
+    # Split the range into windows
+    window = WINDOW_DAYS * 24 * 60 * 60 * 1000
+    windows = [(window_start, min(window_start + window, end_ts)) for window_start in range(start_ts, end_ts, window)]
+
+    # Request the data of every window using an HTTP request, passing in the necessary access_token parameter,
+    #   when to start and end (UNIX timestamps in ms), and the interval between data points
+    def get_window(window_range):
+        output = _request_linkedin(link, access_token, {'start-timestamp': window_range[0],
+                                                        'end-timestamp': window_range[1],
+                                                        'time-granularity': interval})
+        return output.get('values', [])
+
+    with ThreadPoolExecutor(max_workers=MAX_PAGES_IN_FLIGHT) as executor:
+        values = [value for window_values in executor.map(get_window, windows) for value in window_values]
+
+    # Windows share their boundaries, so the same data point can come twice
+    rows = {}
+    for value in sorted(values, key=lambda value: value['time']):
+        # Extract the relevant data fields
+        rows[_to_local_time(value['time'])] = get_row(value)
+
+    # Replace the rows of the dates already stored and add the others
+    return merge_rows_into_csv(output_file, header, [[date] + row for date, row in sorted(rows.items())])
 
 
 def get_historical_follower_data(cid, interval, access_token, output_file, from_ts='1514764800000'):
@@ -58,28 +212,15 @@ def get_historical_follower_data(cid, interval, access_token, output_file, from_
     print("Getting Historical Follower Data...")
     start = time.time()
 
-    # Request the data using an HTTP request, passing in the necessary access_token parameter,
-    #   when to start (UNIX timestamp in ms), and the interval between data points
-    response = requests.get(link, params={'oauth2_access_token': access_token, 'start-timestamp': from_ts, 'time-granularity': interval})
+    num_updated, num_added = _get_historical_statistics(
+        link, interval, access_token, output_file,
+        header=['date', 'num_organic_followers', 'num_paid_followers', 'num_total_followers'],
+        get_row=lambda value: [value['organicFollowerCount'], value['paidFollowerCount'], value['totalFollowerCount']],
+        from_ts=from_ts)
 
     end = time.time()
-
-    if response.ok:
-        output = json.loads(response.text)
-
-        with open(output_file, 'a') as wf:
-            writer = csv.writer(wf)
-            header = ['date', 'num_organic_followers', 'num_paid_followers', 'num_total_followers']
-            writer.writerow(header)
-
-            # Extract the relevant data fields and write it to the output
-            for row in output['values']:
-                new_row = [(datetime.datetime.utcfromtimestamp(row['time']/1000) + datetime.timedelta(hours=+8)).strftime('%Y-%m-%d %H:%M:%S'),
-                           row['organicFollowerCount'], row['paidFollowerCount'], row['totalFollowerCount']]
-                writer.writerow(new_row)
-        print("Successfully retrieved Historical Follower Data in {} seconds!\n".format(end-start))
-    else:
-        print("An error occurred! Error code {}: {}".format(response.status_code, response.reason))
+    print("Successfully retrieved Historical Follower Data ({} rows updated, {} added) in {} seconds!\n".format(
+        num_updated, num_added, end-start))
 
 
 def get_historical_status_update_statistics(cid, interval, access_token, output_file, from_ts='1514764800000'):
@@ -89,28 +230,15 @@ def get_historical_status_update_statistics(cid, interval, access_token, output_
     print("Getting Historical Status Update Statistics...")
     start = time.time()
 
-    # Request the data using an HTTP request, passing in the necessary access_token parameter,
-    #   when to start (UNIX timestamp in ms), and the interval between data points
-    response = requests.get(link, params={'oauth2_access_token': access_token, 'start-timestamp': from_ts, 'time-granularity': interval})
+    num_updated, num_added = _get_historical_statistics(
+        link, interval, access_token, output_file,
+        header=['date', 'num_impressions'],
+        get_row=lambda value: [value['impressionCount']],
+        from_ts=from_ts)
 
     end = time.time()
-
-    if response.ok:
-        output = json.loads(response.text)
-
-        with open(output_file, 'a') as wf:
-            writer = csv.writer(wf)
-            header = ['date', 'num_impressions']
-            writer.writerow(header)
-
-            # Extract the relevant data fields and write it to the output
-            for row in output['values']:
-                new_row = [(datetime.datetime.utcfromtimestamp(row['time']/1000) + datetime.timedelta(hours=+8)).strftime('%Y-%m-%d %H:%M:%S'),
-                           row['impressionCount']]
-                writer.writerow(new_row)
-        print("Successfully retrieved Historical Status Update Statistics in {} seconds!\n".format(end-start))
-    else:
-        print("An error occurred! Error code {}: {}".format(response.status_code, response.reason))
+    print("Successfully retrieved Historical Status Update Statistics ({} rows updated, {} added) in {} seconds!\n"
+          .format(num_updated, num_added, end-start))
 
 
 def get_company_follower_statistics(cid, access_token, output_file):
@@ -122,7 +250,8 @@ def get_company_follower_statistics(cid, access_token, output_file):
 
     # Request the data using an HTTP request, passing in the necessary access_token parameter,
     #   when to start (UNIX timestamp in ms), and the interval between data points
-    response = requests.get(link, params={'oauth2_access_token': access_token})
+    get_rate_limiter('LinkedIn', access_token).wait()
+    response = http_utils.get(link, params={'oauth2_access_token': access_token})
 
     end = time.time()
 
@@ -0,0 +1,92 @@
+import os
+import json
+import datetime
+import threading
+from utils.file_utils import write_json_atomic
+
+
+def fingerprint(path, ignored=()):
+    """
+    Cheap fingerprint of a file or folder, used to tell whether a stage's inputs changed since it last ran.
+    Files are fingerprinted by size and modification time; folders by the number of files, their total size, and
+    the latest modification time of any file in them.
+
+    :param ignored: paths of the files in the folder that are left out
+    :return: (list) fingerprint, or None if the path doesn't exist
+    """
+    ignored = set(os.path.normpath(ignored_path) for ignored_path in ignored)
+
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime]
+
+    if os.path.isdir(path):
+        num_files, total_size, latest = 0, 0, 0.0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                if os.path.normpath(os.path.join(dirpath, filename)) in ignored:
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                num_files += 1
+                total_size += stat.st_size
+                latest = max(latest, stat.st_mtime)
+        return [num_files, total_size, latest]
+
+    return None
+
+
+class RunManifest(object):
+    """
+    Records, in a JSON file, which stages of a run completed, the fingerprints of their inputs, and the paths of their
+    outputs. A resumed run uses it to skip the stages that already completed and only rerun the others.
+
+    Layout of the file:
+    {stage name: {'status': 'running' | 'complete' | 'failed', 'inputs': {path: fingerprint},
+                  'outputs': [path, ...], 'finished': 'YYYY-mm-dd HH:MM:SS'}}
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.stages = {}
+        # Stages finish on different threads, so updates to the file are made one at a time
+        self.__lock = threading.Lock()
+
+        # A new run starts with an empty manifest; a resumed run picks up where the last one left off
+        if resume and os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.stages = json.loads(f.read())
+
+
+    def __save(self):
+        write_json_atomic(self.path, self.stages, indent=4, sort_keys=True)
+
+
+    def is_complete(self, task):
+        """
+        A stage can be skipped if it completed, its inputs haven't changed since, and its outputs still exist.
+        """
+        with self.__lock:
+            stage = self.stages.get(task.name)
+            if stage is None or stage['status'] != 'complete':
+                return False
+
+            inputs = dict((path, fingerprint(path, task.ignored)) for path in task.inputs)
+            if inputs != stage['inputs']:
+                return False
+
+            return all(os.path.exists(path) for path in task.outputs)
+
+
+    def start(self, task):
+        with self.__lock:
+            self.stages[task.name] = {'status': 'running',
+                                      'inputs': dict((path, fingerprint(path, task.ignored)) for path in task.inputs),
+                                      'outputs': list(task.outputs), 'finished': None}
+            self.__save()
+
+
+    def finish(self, task, success):
+        with self.__lock:
+            stage = self.stages[task.name]
+            stage['status'] = 'complete' if success else 'failed'
+            stage['finished'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.__save()
@@ -2,6 +2,7 @@ from bosonnlp import BosonNLP, HTTPError
 import datetime
 import time
 import os
+import threading
 import json
 import csv
 
@@ -165,6 +166,9 @@ class NLP(object):
 
         self.nlp = _BosonNLPWrapper(self.tokens[0])
 
+        # Several NLP stages can run at the same time, so switching tokens must happen one stage at a time
+        self.lock = threading.Lock()
+
         NLP.count += 1
 
 
@@ -181,6 +185,21 @@ class NLP(object):
         return new_token
 
 
+    def __switch_token(self, failed_nlp):
+        # Only the first stage to see a token fail switches to the next token; the other stages just retry with the
+        #   token it switched to instead of burning through the rest of the tokens
+        with self.lock:
+            if self.nlp is not failed_nlp:
+                return
+            if self.tokens_remaining <= 0:
+                print("All API tokens exhausted.")
+                exit()
+            self.tokens_remaining -= 1
+            new_token = self.__get_next_token()
+            print("Using new API token {}...".format(new_token))
+            self.nlp = _BosonNLPWrapper(new_token)
+
+
     def __run_nlp(self, readpath, company, type, text_position):
 
         # For updating progress
@@ -202,12 +221,12 @@ class NLP(object):
             if 'csv' in readfile and ('post' in readfile or 'comment' in readfile or 'tweet' in readfile):
                 filetype = type.lower().replace(' ', '_')
                 if filetype in readfile:
-                    # LinkedIn and Twitter don't require further processing, so they can be _final after running NLP
-                    if 'linkedin' in filetype or 'twitter' in filetype:
+                    # LinkedIn, Twitter, and Weibo don't require further processing, so they can be _final after
+                    #   running NLP
+                    if 'linkedin' in filetype or 'twitter' in filetype or 'weibo' in filetype:
                         writefile = '{}_{}_final.csv'.format(company, filetype)
                     # Facebook needs to get reactions split
                     # Instagram is NOT dealt with in this function
-                    # Weibo needs to have its datetimes converted
                     else:
                         writefile = '{}_{}_nlp.csv'.format(company, filetype)
 
@@ -238,18 +257,13 @@ class NLP(object):
                         # Try to run sentiment analysis and keyword extraction
                         # If it fails due to an HTTPError, try another api token and if all are exhausted, then quit
                         while True:
+                            nlp = self.nlp
                             try:
-                                sentiment = self.nlp.get_sentiment(texts[i])
-                                keywords = self.nlp.extract_keywords(texts[i])
+                                sentiment = nlp.get_sentiment(texts[i])
+                                keywords = nlp.extract_keywords(texts[i])
                                 break
                             except HTTPError:
-                                if self.tokens_remaining <= 0:
-                                    print("All API tokens exhausted.")
-                                    exit()
-                                self.tokens_remaining -= 1
-                                new_token = self.__get_next_token()
-                                print("Using new API token {}....".format(new_token))
-                                self.nlp = _BosonNLPWrapper(new_token)
+                                self.__switch_token(nlp)
 
                         # Get the original data in the row
                         row = data[i]
@@ -351,18 +365,13 @@ class NLP(object):
                     # Try to run sentiment analysis and keyword extraction
                     # If it fails due to an HTTPError, try another api token and if all are exhausted, then quit
                     while True:
+                        nlp = self.nlp
                         try:
-                            sentiment = self.nlp.get_sentiment(caption)
-                            keywords = self.nlp.extract_keywords(caption)
+                            sentiment = nlp.get_sentiment(caption)
+                            keywords = nlp.extract_keywords(caption)
                             break
                         except HTTPError:
-                            if self.tokens_remaining <= 0:
-                                print("All API tokens exhausted.")
-                                exit()
-                            self.tokens_remaining -= 1
-                            new_token = self.__get_next_token()
-                            print("Using new API token {}...".format(new_token))
-                            self.nlp = _BosonNLPWrapper(new_token)
+                            self.__switch_token(nlp)
 
                     # Get the positive and negative sentiment scores
                     pos, neg = sentiment['positive'], sentiment['negative']
@@ -454,19 +463,13 @@ class NLP(object):
                         # Try to run sentiment analysis and keyword extraction
                         # If it fails due to an HTTPError, try another api token and if all are exhausted, then quit
                         while True:
+                            nlp = self.nlp
                             try:
-                                sentiment = self.nlp.get_sentiment(comments[i])
-                                keywords = self.nlp.extract_keywords(comments[i])
+                                sentiment = nlp.get_sentiment(comments[i])
+                                keywords = nlp.extract_keywords(comments[i])
                                 break
                             except HTTPError:
-                                if self.tokens_remaining <= 0:
-                                    print("All API tokens exhausted.")
-                                    exit()
-                                self.tokens_remaining -= 1
-                                new_token = self.__get_next_token()
-                                now = datetime.datetime.strftime(datetime.datetime.now(), '[%B %d, %Y %H:%M:%S]')
-                                print("Using new API token {}...".format(new_token))
-                                self.nlp = _BosonNLPWrapper(new_token)
+                                self.__switch_token(nlp)
 
                         # Get the positive and negative sentiment scores
                         pos, neg = sentiment['positive'], sentiment['negative']
@@ -517,6 +520,8 @@ class NLP(object):
             return self.__run_nlp(readpath, company, filetype, 3)
         elif filetype == 'weibo tweet':
             return self.__run_nlp(readpath, company, filetype, 1)
+        elif filetype == 'weibo comment':
+            return self.__run_nlp(readpath, company, filetype, 3)
         elif filetype == 'instagram post':
             return self.__ig_posts_nlp(readpath, company)
         elif filetype == 'instagram comment':
@@ -527,3 +532,38 @@ class NLP(object):
             return self.__run_nlp(readpath, company, filetype, 1)
         elif filetype == 'linkedin comment':
             return self.__run_nlp(readpath, company, filetype, 1)
+
+
+# NLP engine shared by every NLP stage of the pipeline; started the first time a stage needs it
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def process_nlp(readpath, company, type):
+    """
+    Runs NLP.process_nlp with the shared NLP engine, starting the engine up the first time it is needed so that
+    nothing is set up for runs (or channels) that never get to the NLP stage.
+    """
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            now = datetime.datetime.strftime(datetime.datetime.now(), '[%B %d, %Y %H:%M:%S]')
+            print(now + " - Starting up NLP engine...\n")
+            _engine = NLP()
+
+    return _engine.process_nlp(readpath, company, type)
+
+
+def shut_down_nlp():
+    """
+    Deletes the shared NLP engine once no stage needs it anymore.
+    """
+    global _engine
+
+    with _engine_lock:
+        if _engine is not None:
+            now = datetime.datetime.strftime(datetime.datetime.now(), '[%B %d, %Y %H:%M:%S]')
+            print(now + " - Shutting down NLP engine...\n")
+            _engine = None
+            NLP.count -= 1
@@ -0,0 +1,235 @@
+import os
+import sys
+import time
+import queue
+import datetime
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# Exit statuses reported for every task
+SUCCESS = 0
+FAILED = 1
+SKIPPED = 2
+
+
+class Task(object):
+    """
+    A single stage of the pipeline (e.g. scraping a channel or running NLP on one file type).
+
+    :param name: (str) unique name of the task, used to refer to it from other tasks' deps
+    :param func: function to run; called as func(*args)
+    :param args: (tuple) arguments passed to func
+    :param deps: (list) names of the tasks that must finish before this task can start
+    :param require_success: (bool) if True, the task is skipped when any of its deps did not succeed; if False, the
+                            task runs once its deps have finished, whatever their outcome (e.g. joining whatever
+                            channel files exist)
+    :param inputs: (list) paths of the files/folders the task reads; a resumed run reruns the task if they changed
+    :param outputs: (list) paths of the files/folders the task writes
+    :param checkpointed: (list) outputs that the task resumes by itself from a saved checkpoint (see
+                         utils/checkpoint_utils.py); a resumed run does not clear them
+    :param ignored: (list) paths inside the input folders that are not inputs (e.g. the files that stages write into
+                    an input folder), so that writing them doesn't count as a change of the inputs
+    """
+    def __init__(self, name, func, args=(), deps=(), require_success=True, inputs=(), outputs=(), checkpointed=(),
+                 ignored=()):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = list(deps)
+        self.require_success = require_success
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.checkpointed = list(checkpointed)
+        self.ignored = list(ignored)
+
+
+def stream_in_background(iterable, maxsize=100, join_timeout=30):
+    """
+    Iterates over iterable on a thread of its own and yields its items through a queue of at most maxsize items, so
+    that the consumer can work on the first items while the next ones are being produced (e.g. retrieving the comments
+    of the posts scraped so far while the next pages of posts are scraped). The producer waits whenever the queue is
+    full, so no more than maxsize items are kept in memory.
+    An exception raised by the producer is raised again in the consumer once it gets there.
+    When the consumer stops early (it fails, or the generator is closed), the producer is told to stop before it
+    fetches the next item, and is waited for at most join_timeout seconds.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item, error=None):
+        # Wait for room in the queue, but give up once the consumer is gone
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            # Check before every item, so that no more pages are fetched (and written) once the consumer is gone
+            while not stop.is_set():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                if not put(item):
+                    break
+        except BaseException:
+            put(end, sys.exc_info()[1])
+            return
+        finally:
+            # Let the iterable clean up (e.g. close its output file) on this thread
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        put(end)
+
+    # A daemon thread, so that a producer stuck on a request doesn't keep the process alive
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join(join_timeout)
+        if producer.is_alive():
+            print("The producer thread didn't stop within {} seconds; leaving it behind".format(join_timeout))
+
+
+def _run_task(task, manifest=None, resume=False):
+    """
+    Runs a single task and catches anything it raises so that one task failing does not take down the other tasks
+    running alongside it. If a manifest is given, the task's progress is recorded in it.
+
+    :return: (name, exit_status, seconds)
+    """
+    start = time.time()
+
+    if manifest is not None:
+        if resume and manifest.is_complete(task):
+            print("Skipping {} because it already completed in an earlier run\n".format(task.name))
+            return task.name, SUCCESS, 0.0
+
+        # Outputs are appended to, so whatever an earlier, unfinished attempt wrote has to go before the task reruns;
+        #   otherwise the rows (and headers) it wrote would be duplicated
+        if resume:
+            for path in task.outputs:
+                if os.path.isfile(path) and path not in task.checkpointed:
+                    os.remove(path)
+
+        manifest.start(task)
+
+    try:
+        task.func(*task.args)
+        status = SUCCESS
+    # SystemExit is caught as well because some of the stages call exit() when they give up
+    except (Exception, SystemExit):
+        print("Task {} failed:".format(task.name))
+        traceback.print_exc()
+        status = FAILED
+    end = time.time()
+
+    if manifest is not None:
+        manifest.finish(task, status == SUCCESS)
+
+    return task.name, status, end - start
+
+
+def _check_graph(tasks):
+    # Every dependency must refer to a known task and the graph must not contain cycles, otherwise the executor
+    #   would wait forever
+    names = set(tasks)
+    for task in tasks.values():
+        for dep in task.deps:
+            if dep not in names:
+                raise ValueError("Task {} depends on unknown task {}".format(task.name, dep))
+
+    visited = set()
+    for name in tasks:
+        path = set()
+        stack = [(name, iter(tasks[name].deps))]
+        path.add(name)
+        while stack:
+            current, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                stack.pop()
+                path.discard(current)
+                visited.add(current)
+            elif dep in path:
+                raise ValueError("Dependency cycle detected at task {}".format(dep))
+            elif dep not in visited:
+                path.add(dep)
+                stack.append((dep, iter(tasks[dep].deps)))
+
+
+def run_dag(tasks, max_workers=5, manifest=None, resume=False):
+    """
+    Runs a dependency graph of tasks on a shared thread pool.
+    A task starts as soon as all of its deps have finished, so every channel's chain (scrape -> NLP ->
+    post-processing) moves along on its own instead of waiting for every other channel at each phase.
+
+    :param tasks: list of Task objects
+    :param max_workers: (int) maximum number of tasks running at the same time
+    :param manifest: (RunManifest) if given, every task's progress is recorded in it
+    :param resume: (bool) skip the tasks the manifest says already completed (with unchanged inputs) and clear the
+                   outputs of the others before rerunning them
+    :return: statuses: (dict) {name: exit_status} where exit_status is SUCCESS, FAILED, or SKIPPED (a dependency
+             did not succeed)
+    """
+    tasks = dict((task.name, task) for task in tasks)
+    if len(tasks) == 0:
+        return {}
+    _check_graph(tasks)
+
+    statuses = {}
+    running = {}  # {future: name}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(statuses) < len(tasks):
+            # Start (or skip) every task whose deps have all finished
+            progress = True
+            while progress:
+                progress = False
+                for name, task in tasks.items():
+                    if name in statuses or name in running.values():
+                        continue
+                    if any(dep not in statuses for dep in task.deps):
+                        continue
+
+                    if task.require_success and any(statuses[dep] != SUCCESS for dep in task.deps):
+                        statuses[name] = SKIPPED
+                        print("Skipping {} because a task it depends on did not succeed\n".format(name))
+                        # Skipping a task can make other tasks ready (or skippable), so look again
+                        progress = True
+                    else:
+                        running[executor.submit(_run_task, task, manifest, resume)] = name
+
+            if len(running) == 0:
+                break
+
+            # Wait for at least one running task to finish
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                name, status, seconds = future.result()
+                statuses[name] = status
+
+                now = datetime.datetime.strftime(datetime.datetime.now(), '[%B %d, %Y %H:%M:%S]')
+                print(now + " - {} {} in {} seconds (exit status {})\n".format(
+                    name, 'finished' if status == SUCCESS else 'FAILED', seconds, status))
+
+    return statuses
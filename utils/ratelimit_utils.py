@@ -0,0 +1,147 @@
+import time
+import threading
+from collections import deque
+
+
+# Default number of calls allowed per credential in every period (in seconds) for each channel
+# Several companies can share one credential, so the limit applies to all of the credential's calls together
+DEFAULT_LIMITS = {
+    'Facebook': (600, 60),
+    'LinkedIn': (300, 60),
+    'Twitter': (900, 900),
+    # m.weibo.cn has no published limit, so stay polite
+    'Weibo': (20, 10),
+}
+# Limits of the endpoints that have a window of their own, for each channel; calls to these endpoints are counted
+#   separately from the credential's other calls
+ENDPOINT_LIMITS = {
+    'Twitter': {
+        'statuses/user_timeline': (900, 900),
+        'statuses/lookup': (900, 900),
+        'users/show': (900, 900),
+    },
+}
+
+# Usage of the limit (in percent, as reported by the API) above which calls are slowed down, and the pause (in seconds)
+#   before every call once the usage reaches 100%
+SLOWDOWN_USAGE = 75
+MAX_SLOWDOWN = 60
+
+_limiters = {}  # {(channel, credential, endpoint): RateLimiter}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    Keeps the calls made with one credential under max_calls in any window of period seconds, and keeps track of how
+    many calls were made and how long callers had to wait.
+    If the API reports how much of its own limit is used (see report_usage), calls are also slowed down as that usage
+    gets close to 100%, and held back entirely while the API says it won't accept calls.
+    Shared by every thread that uses the credential.
+    """
+    def __init__(self, max_calls, period):
+        self.max_calls = max_calls
+        self.period = period
+        self.num_calls = 0          # total number of calls made with this credential
+        self.time_waited = 0.0      # total time (in seconds) spent waiting for the limit
+        self.time_throttled = 0.0   # total time (in seconds) spent slowing down for the API's usage or backing off
+        self.usage = 0              # latest usage of the API's limit (in percent)
+        self.__resume_at = 0.0      # time before which the API won't accept calls
+        self.__calls = deque()      # times of the calls made in the current window
+        self.__lock = threading.Lock()
+        # wait() sleeps while holding __lock, so the usage is updated under a lock of its own
+        self.__usage_lock = threading.Lock()
+
+
+    def wait(self):
+        """
+        Blocks until another call can be made without going over the limit, then records the call.
+        """
+        with self.__lock:
+            # Slow down as the usage reported by the API gets close to its limit
+            delay = max(self.__resume_at - time.time(), self.__get_slowdown())
+            if delay > 0:
+                self.record_backoff(delay)
+                time.sleep(delay)
+
+            while True:
+                now = time.time()
+                # Forget the calls that have left the window
+                while len(self.__calls) > 0 and self.__calls[0] <= now - self.period:
+                    self.__calls.popleft()
+
+                if len(self.__calls) < self.max_calls:
+                    self.__calls.append(now)
+                    self.num_calls += 1
+                    return
+
+                # Wait until the oldest call in the window expires
+                delay = self.__calls[0] + self.period - now
+                self.time_waited += delay
+                time.sleep(delay)
+
+
+    def __get_slowdown(self):
+        # No pause below SLOWDOWN_USAGE, growing to MAX_SLOWDOWN at 100%
+        if self.usage <= SLOWDOWN_USAGE:
+            return 0
+        return MAX_SLOWDOWN * ((min(self.usage, 100) - SLOWDOWN_USAGE) / (100.0 - SLOWDOWN_USAGE)) ** 2
+
+
+    def report_usage(self, usage, regain_access_in=0):
+        """
+        Records how much of its limit the API says was used (e.g. Facebook's X-App-Usage header).
+
+        :param usage: (float) percent of the limit used
+        :param regain_access_in: (float) seconds until the API accepts calls again, if it said so
+        """
+        with self.__usage_lock:
+            self.usage = usage
+            if regain_access_in > 0:
+                self.__resume_at = max(self.__resume_at, time.time() + regain_access_in)
+
+
+    def record_backoff(self, seconds):
+        """
+        Records time spent waiting before retrying a call that failed (or slowing down for the API's usage).
+        """
+        with self.__usage_lock:
+            self.time_throttled += seconds
+
+
+def get_rate_limiter(channel, credential, endpoint=None):
+    """
+    Gets the rate limiter of a credential, creating it the first time the credential is used.
+    Every caller using the same credential for the same channel (and endpoint) gets the same limiter.
+
+    :param channel: (str) 'Facebook', 'LinkedIn', or 'Twitter'
+    :param credential: (str) access token (or other key) the calls are made with
+    :param endpoint: (str) endpoint with a limit of its own (see ENDPOINT_LIMITS), e.g. 'statuses/user_timeline'
+    :return: RateLimiter
+    """
+    with _limiters_lock:
+        if (channel, credential, endpoint) not in _limiters:
+            if endpoint is None:
+                max_calls, period = DEFAULT_LIMITS[channel]
+            else:
+                max_calls, period = ENDPOINT_LIMITS[channel][endpoint]
+            _limiters[(channel, credential, endpoint)] = RateLimiter(max_calls, period)
+
+        return _limiters[(channel, credential, endpoint)]
+
+
+def report_rate_limits():
+    """
+    Prints the number of calls made, the time spent waiting for the rate limit, and the time spent throttled (slowing
+    down for the API's usage or backing off after errors) for every credential used so far.
+    Credentials are masked so that they don't end up in the logs.
+    """
+    with _limiters_lock:
+        limiters = sorted(_limiters.items(), key=lambda item: (item[0][0], item[0][1], item[0][2] or ''))
+
+    for (channel, credential, endpoint), limiter in limiters:
+        masked = '...' + credential[-4:] if len(credential) > 4 else '...'
+        name = channel if endpoint is None else '{} {}'.format(channel, endpoint)
+        print("{} credential {}: {} calls, waited {} seconds for the rate limit, throttled for {} seconds "
+              "(last reported usage {}%)".format(name, masked, limiter.num_calls, limiter.time_waited,
+                                                 limiter.time_throttled, limiter.usage))
@@ -0,0 +1,51 @@
+import time
+import importlib
+import threading
+
+
+_import_times = {}  # {module name: seconds spent on its first import}
+_import_lock = threading.Lock()
+
+
+def timed_import(name):
+    """
+    Imports a module and records how long the first import took, so that the cost of the heavy SDKs (tweepy,
+    instaloader, bosonnlp, weibo_scraper, requests) can be reported.
+
+    :param name: (str) module name, e.g. 'utils.nlp_utils'
+    :return: the imported module
+    """
+    start = time.time()
+    module = importlib.import_module(name)
+    end = time.time()
+
+    with _import_lock:
+        # Only the first import does any work; later imports come straight from the module cache
+        _import_times.setdefault(name, end - start)
+
+    return module
+
+
+def lazy_function(module_name, function_name):
+    """
+    Returns a function that imports module_name the first time it is called and then calls
+    module_name.function_name. Used for the stages of the pipeline so that a channel's SDK is only imported when its
+    stage actually runs.
+    """
+    def call(*args, **kwargs):
+        return getattr(timed_import(module_name), function_name)(*args, **kwargs)
+
+    call.__name__ = function_name
+
+    return call
+
+
+def report_startup(startup_seconds):
+    """
+    Prints how long the program took to start up and how long each lazily imported module took to import.
+    """
+    print("Started up in {} seconds".format(startup_seconds))
+    with _import_lock:
+        import_times = sorted(_import_times.items(), key=lambda item: -item[1])
+    for name, seconds in import_times:
+        print("Imported {} in {} seconds".format(name, seconds))
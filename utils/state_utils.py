@@ -0,0 +1,41 @@
+import os
+import json
+from utils.file_utils import write_json_atomic
+
+
+class ScrapeState(object):
+    """
+    What a scraper retrieved in earlier runs (e.g. the time of the newest post seen), kept in a JSON file between runs
+    so that an incremental run only fetches what is new.
+
+    A Checkpoint (see utils/checkpoint_utils.py) isn't used for this because it belongs to one crawl of one output
+    file: it only counts while that file exists, every save replaces the whole position, and it is cleared once the
+    crawl finishes. A state outlives the crawls, is updated a few values at a time (e.g. by the stages of one channel
+    in turn), and is only ever replaced, never cleared.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                try:
+                    self.values = json.loads(f.read())
+                except ValueError:
+                    print("Ignoring the state in {}: it is not valid JSON".format(path))
+            # A state that isn't a dict of values is as good as no state
+            if not isinstance(self.values, dict):
+                print("Ignoring the state in {}: it is not a dict of values".format(path))
+                self.values = {}
+
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+
+    def update(self, **values):
+        """
+        Sets values and saves the state. Only call this once the data the values describe is in the output files.
+        """
+        self.values.update(values)
+        write_json_atomic(self.path, self.values, indent=4, sort_keys=True)
@@ -1,14 +1,92 @@
+import os
 import time
 import csv
 import datetime
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import tweepy
+from utils.ratelimit_utils import get_rate_limiter
+from utils.checkpoint_utils import iter_written_rows
+from utils.file_utils import merge_rows_into_csv
+from utils.state_utils import ScrapeState
 
 
-def get_profile_twitter(name, api, output_file):
+# Column names of the tweets csv file; urls, hashtags, mentions, and media are taken from the tweet's entities (see
+#   get_tweet_row)
+TWEET_COLUMNS = ['created_at', 'id_str', 'full_text', 'truncated', 'urls', 'hashtags', 'mentions', 'media', 'source',
+                 'in_reply_to_status_id', 'in_reply_to_user_id', 'retweet_count', 'favorite_count']
+# Twitter only returns the 3200 newest tweets of a timeline, at most 200 per call
+TIMELINE_LIMIT = 3200
+PAGE_SIZE = 200
+# Number of tweets looked up per call when refreshing their counts
+LOOKUP_SIZE = 100
+
+
+def _call_twitter(api, endpoint, method, stats=None, **params):
+    """
+    Calls a method of api once the credential's rate limit for endpoint allows it. Every thread using the same
+    credential shares the same limit for each endpoint, and the limit is kept in step with the remaining calls
+    Twitter reports (e.g. calls made by other processes with the same credential), so the calls never go over it.
+
+    :param endpoint: (str) endpoint the method calls (see ENDPOINT_LIMITS in utils/ratelimit_utils.py)
+    :param stats: (dict) if given, its 'calls' count is increased
+    :return: whatever method returns
+    """
+    limiter = get_rate_limiter('Twitter', api.auth.access_token, endpoint)
+    limiter.wait()
+    result = method(**params)
+    if stats is not None:
+        stats['calls'] += 1
+
+    # x-rate-limit-remaining is the number of calls left in the endpoint's current window, which ends at
+    #   x-rate-limit-reset (in seconds since the epoch)
+    headers = getattr(getattr(api, 'last_response', None), 'headers', None) or {}
+    if 'x-rate-limit-remaining' in headers and 'x-rate-limit-limit' in headers:
+        limit, remaining = int(headers['x-rate-limit-limit']), int(headers['x-rate-limit-remaining'])
+        regain_access_in = int(headers.get('x-rate-limit-reset', 0)) - time.time() if remaining == 0 else 0
+        limiter.report_usage(100.0 * (limit - remaining) / max(limit, 1), regain_access_in)
+
+    return result
+
+
+def get_tweet_row(data):
+    """
+    Gets the values of TWEET_COLUMNS from a tweet's JSON. The entities of the tweet are written as space-separated
+    lists, in the order they appear in the tweet: urls has the expanded links, hashtags the hashtags (without #),
+    mentions the screen names mentioned (without @), and media the links to the photos and videos.
+
+    :return: (list) row of the tweets csv file
+    """
+    entities = data.get('entities', {})
+    # extended_entities has every photo of the tweet, entities only the first
+    media = data.get('extended_entities', entities).get('media', [])
+
+    values = {
+        'urls': ' '.join(url['expanded_url'] for url in entities.get('urls', []) if url.get('expanded_url')),
+        'hashtags': ' '.join(hashtag['text'] for hashtag in entities.get('hashtags', [])),
+        'mentions': ' '.join(mention['screen_name'] for mention in entities.get('user_mentions', [])),
+        'media': ' '.join(item['media_url_https'] for item in media),
+    }
+
+    return [values[key] if key in values else data[key] for key in TWEET_COLUMNS]
+
+
+def has_tweet_columns(output_file):
+    """
+    Checks whether output_file was written with the current TWEET_COLUMNS, so that new rows can be merged into it.
+    """
+    if not os.path.isfile(output_file):
+        return False
+    with open(output_file, 'r') as rf:
+        return next(csv.reader(rf), None) == TWEET_COLUMNS
+
+
+def get_profile_twitter(name, api, output_file, stats=None):
     print("Getting {}'s Twitter profile...".format(name))
     start = time.time()
 
-    # Get the profile of the user corresponding to name
-    user = api.get_user(screen_name=name)
+    # Get the profile of the user corresponding to name; the call counts against the credential's rate limit
+    user = _call_twitter(api, 'users/show', api.get_user, stats, screen_name=name)
     profile = list(user.__dict__.items())[1][1]
 
     columns = ['id_str', 'name', 'screen_name', 'location', 'description', 'url', 'followers_count', 'friends_count',
@@ -28,31 +106,86 @@ def get_profile_twitter(name, api, output_file):
     print("Successfully retrieved {}'s Twitter profile in {} seconds!\n".format(name, end-start))
 
 
-def get_tweets_twitter(name, api, output_file, num_tweets=100):
+def iter_timeline_twitter(name, api, num_tweets=TIMELINE_LIMIT, since_id=None, stats=None):
+    """
+    Pages through the tweet timeline of a user, newest first, one page of at most PAGE_SIZE tweets per call. Every page
+    asks for the tweets older than the oldest tweet of the page before (max_id), so pages never overlap.
+
+    :param num_tweets: (int) maximum number of tweets (including retweets) to go through; Twitter only returns the
+                       TIMELINE_LIMIT newest tweets of a timeline
+    :param since_id: (str) if given, only the tweets newer than this tweet are returned
+    :param stats: (dict) if given, its 'calls' count is increased for every page
+    :return: generator of tweets (each the tweet's JSON as a dict)
+    """
+    max_id = None
+    num_retrieved = 0
+
+    while num_retrieved < num_tweets:
+        # Expand all the tweets (because Twitter shortens tweets that are over 140 characters)
+        params = {'screen_name': name, 'count': min(PAGE_SIZE, num_tweets - num_retrieved), 'tweet_mode': 'extended'}
+        if max_id is not None:
+            params['max_id'] = max_id
+        if since_id:
+            params['since_id'] = since_id
+
+        # Every page counts against the credential's rate limit
+        page = _call_twitter(api, 'statuses/user_timeline', api.user_timeline, stats, **params)
+        # An empty page means the start of the timeline (or since_id) was reached
+        if len(page) == 0:
+            return
+
+        for tweet in page:
+            yield tweet._json
+        num_retrieved += len(page)
+        max_id = min(tweet._json['id'] for tweet in page) - 1
+
+
+def get_tweets_twitter(name, api, output_file, num_tweets=TIMELINE_LIMIT, since_id=None, stats=None):
+    """
+    Gets the tweets of a user (leaving out retweets) and writes them to output_file.
+    If since_id is given, only the tweets newer than it are retrieved and they are merged into the tweets already in
+    output_file; otherwise output_file is written from the start.
+
+    :param stats: (dict) if given, its 'calls' and 'tweets' counts are increased
+    :return: (str) id of the newest tweet retrieved, or since_id if there were no new tweets
+    """
     # Column names in the resulting csv file
-    columns = ['created_at', 'id_str', 'full_text', 'truncated', 'entities', 'source', 'in_reply_to_status_id',
-               'in_reply_to_user_id', 'retweet_count', 'favorite_count']
-    # Write these column names to the file first
-    with open(output_file, 'a') as wf:
-        writer = csv.writer(wf)
-        writer.writerow(columns)
+    columns = TWEET_COLUMNS
+
+    # Files written with other columns (e.g. by an older version) can't be merged into, so they are written again
+    incremental = since_id is not None and has_tweet_columns(output_file)
+    if not incremental:
+        # Write these column names to the file first, replacing whatever it held
+        with open(output_file, 'w') as wf:
+            writer = csv.writer(wf)
+            writer.writerow(columns)
 
     # Parameters to keep track of progress
     num_processed = 0  # total number of tweets processed thus far
     start = time.time()  # time at which scraping started
     batch = []  # contains only 100 tweets at a time (for batch output)
+    new_tweets = []  # contains every new tweet of an incremental run, merged into the output file at the end
+    newest_id = since_id
 
-    print("Getting {}'s Twitter tweets...".format(name))
+    if incremental:
+        print("Getting {}'s Twitter tweets newer than tweet {}...".format(name, since_id))
+    else:
+        print("Getting {}'s Twitter tweets...".format(name))
+
+    # Get the tweet timeline of the specified user, only considering at most num_tweets tweets
+    for data in iter_timeline_twitter(name, api, num_tweets=num_tweets, since_id=since_id if incremental else None,
+                                      stats=stats):
+        if newest_id is None or int(data['id_str']) > int(newest_id):
+            newest_id = data['id_str']
 
-    # Get the tweet timeline of the specified user, only considering at most 'count' tweets and expand all the
-    #   tweets (because Twitter shortens tweets that are over 140 characters)
-    for tweet in api.user_timeline(screen_name=name, count=num_tweets, tweet_mode='extended'):
-        data = tweet._json
         # Only get the tweet if it isn't retweeted (if it's retweeted, it means someone else wrote the tweet)
         if 'retweeted_status' not in data.keys():
             # Extract the data corresponding to the fields listed in columns
-            new_data = [data[key] for key in columns]
-            batch.append(new_data)
+            new_data = get_tweet_row(data)
+            if incremental:
+                new_tweets.append(new_data)
+            else:
+                batch.append(new_data)
 
             num_processed += 1
 
@@ -76,5 +209,113 @@ def get_tweets_twitter(name, api, output_file, num_tweets=100):
                 writer.writerow(tweet)
         print("Done writing!")
 
+    if len(new_tweets) > 0:
+        print("Merging {} new tweets into {}...".format(len(new_tweets), output_file))
+        merge_rows_into_csv(output_file, columns, new_tweets, key_column=columns.index('id_str'))
+        print("Done writing!")
+
+    if stats is not None:
+        stats['tweets'] += num_processed
+
+    end = time.time()
+    print("Successfully retrieved {} of {}'s Twitter tweets in {} seconds!\n".format(num_processed, name, end-start))
+
+    return newest_id
+
+
+def refresh_tweet_counts_twitter(name, api, output_file, stats=None):
+    """
+    Updates the retweet and favorite counts of the tweets already in output_file, looking up LOOKUP_SIZE tweets per
+    call instead of retrieving the timeline again. Tweets that were deleted since keep their last counts.
+    """
+    columns = TWEET_COLUMNS
+    id_column = columns.index('id_str')
+    rows = dict((row[id_column], row) for row in iter_written_rows(output_file) if len(row) == len(columns))
+    if len(rows) == 0:
+        return
+
+    print("Refreshing the counts of {}'s {} Twitter tweets...".format(name, len(rows)))
+    start = time.time()
+
+    ids = list(rows)
+    updated = []
+    for i in range(0, len(ids), LOOKUP_SIZE):
+        for tweet in _call_twitter(api, 'statuses/lookup', api.statuses_lookup, stats, id_=ids[i:i + LOOKUP_SIZE],
+                                   trim_user=True):
+            data = tweet._json
+            row = rows[data['id_str']]
+            row[columns.index('retweet_count')] = data['retweet_count']
+            row[columns.index('favorite_count')] = data['favorite_count']
+            updated.append(row)
+
+    merge_rows_into_csv(output_file, columns, updated, key_column=id_column)
+
+    end = time.time()
+    print("Successfully refreshed the counts of {} of {}'s Twitter tweets in {} seconds!\n".format(
+        len(updated), name, end-start))
+
+
+def _collect_handle_twitter(name, api, output_files, incremental, stats):
+    # Profile, then the tweets of one handle; see collect_twitter
+    state = ScrapeState(output_files['state'])
+    start = time.time()
+
+    get_profile_twitter(name=name, api=api, output_file=output_files['profile'], stats=stats)
+
+    # An incremental run only retrieves the tweets newer than the newest tweet of the last run, and refreshes the
+    #   counts of the tweets retrieved by earlier runs
+    since_id = state.get('since_id') if incremental and has_tweet_columns(output_files['tweets']) else None
+    if since_id is not None:
+        refresh_tweet_counts_twitter(name=name, api=api, output_file=output_files['tweets'], stats=stats)
+
+    newest_id = get_tweets_twitter(name=name, api=api, output_file=output_files['tweets'], num_tweets=TIMELINE_LIMIT,
+                                   since_id=since_id, stats=stats)
+
+    # Remember the newest tweet, for the next incremental run
+    if newest_id is not None:
+        state.update(since_id=newest_id)
+
+    stats['seconds'] = time.time() - start
+
+
+def collect_twitter(handles, auth, output_files, incremental=False, max_workers=4):
+    """
+    Gets the profile and tweets of several Twitter users at the same time (e.g. a company and its competitors).
+    Every handle has its own API object, but they all share the credential's rate limit for each endpoint (see
+    _call_twitter), so running more handles at once never makes more calls than the limits allow; the calls just
+    wait for the next window instead of failing with a 429.
+    A handle that fails doesn't stop the others.
+
+    :param handles: (list) Twitter handles
+    :param auth: tweepy.OAuthHandler of the credential to use
+    :param output_files: (dict) {handle: {'profile': path, 'tweets': path, 'state': path}}
+    :param incremental: (bool) only retrieve the tweets newer than the last run's (see _collect_handle_twitter)
+    :return: (dict) {handle: {'calls': int, 'tweets': int, 'seconds': float, 'failed': bool}}
+    """
+    stats = dict((name, {'calls': 0, 'tweets': 0, 'seconds': 0.0, 'failed': False}) for name in handles)
+
+    def collect(name):
+        try:
+            _collect_handle_twitter(name, tweepy.API(auth), output_files[name], incremental, stats[name])
+        except Exception:
+            print("Failed to get {}'s Twitter tweets:".format(name))
+            traceback.print_exc()
+            stats[name]['failed'] = True
+
+    print("Getting the Twitter profiles and tweets of {} handles...".format(len(handles)))
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(collect, handles))
+
     end = time.time()
-    print("Successfully retrieved {} of {}'s Twitter tweets in {} seconds!\n".format(num_processed, name, end-start))
\ No newline at end of file
+    for name in handles:
+        handle_stats = stats[name]
+        print("{}: {} tweets, {} calls in {} seconds ({} tweets per second){}".format(
+            name, handle_stats['tweets'], handle_stats['calls'], handle_stats['seconds'],
+            handle_stats['tweets'] / handle_stats['seconds'] if handle_stats['seconds'] > 0 else 0,
+            ' - FAILED' if handle_stats['failed'] else ''))
+    print("Successfully retrieved the tweets of {} of {} handles in {} seconds!\n".format(
+        sum(1 for name in handles if not stats[name]['failed']), len(handles), end - start))
+
+    return stats
@@ -0,0 +1,324 @@
+import os
+import csv
+import json
+import hmac
+import time
+import hashlib
+import datetime
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from utils import http_utils
+from utils.file_utils import merge_rows_into_csv
+from utils.checkpoint_utils import iter_written_rows, read_written_rows
+from utils.facebook_utils import POST_COLUMNS, COMMENT_COLUMNS, REACTION_TYPES
+
+
+# Post types sent in the item field of feed events
+POST_ITEMS = ['status', 'post', 'photo', 'video', 'share', 'link']
+
+
+def sign_payload(body, app_secret):
+    """
+    Signs a webhook payload the way Facebook does (the X-Hub-Signature-256 header).
+
+    :param body: (bytes) the request body
+    :return: (str) 'sha256=<hex digest>'
+    """
+    return 'sha256=' + hmac.new(app_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def _to_local_time(created_time):
+    # Webhook events give times as Unix timestamps; the output files use Hong Kong time
+    published = datetime.datetime.utcfromtimestamp(int(created_time)) + datetime.timedelta(hours=+8)
+    return published.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class FacebookEventWriter(object):
+    """
+    Applies the feed events of a page webhook (new posts and comments, edits, and reactions) to the rows of the posts
+    and comments csv files written by FacebookScraper, so that they stay up to date between scraping runs.
+    Events are collected and applied every flush_interval seconds; every event received is also appended to events_file
+    as is, so that it can be replayed.
+
+    facebook.py writes the posts and comments files while this runs, so they are only read here: the rows added or
+    changed by the events are appended to webhook_posts_file and webhook_comments_file (the latest row of each id
+    counts), and the next scraping run merges them into the posts and comments files (see take_webhook_rows).
+
+    Events that can't be applied to the files (e.g. a reaction to a comment that wasn't scraped yet, or a removed
+    comment, which is kept in the files) are left for the next scraping run to pick up.
+    """
+    def __init__(self, posts_file, comments_file, webhook_posts_file, webhook_comments_file, events_file,
+                 flush_interval=5):
+        self.posts_file = posts_file
+        self.comments_file = comments_file
+        self.webhook_posts_file = webhook_posts_file
+        self.webhook_comments_file = webhook_comments_file
+        self.events_file = events_file
+        self.flush_interval = flush_interval
+        self.num_events = 0
+        self.num_applied = 0
+        self.__pending = []         # changes of the events not applied yet
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+
+    def add(self, payload):
+        """
+        Records a webhook payload ({'object': 'page', 'entry': [{'changes': [{'field': 'feed', 'value': ...}]}]}).
+        """
+        with self.__lock:
+            with open(self.events_file, 'a') as f:
+                f.write(json.dumps(payload) + '\n')
+
+            for entry in payload.get('entry', []):
+                for change in entry.get('changes', []):
+                    if change.get('field') == 'feed':
+                        self.__pending.append(change['value'])
+                        self.num_events += 1
+
+
+    def start(self):
+        # Apply the events in the background every flush_interval seconds
+        def run():
+            while not self.__stopped.wait(self.flush_interval):
+                self.flush()
+
+        self.__thread = threading.Thread(target=run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.flush()
+
+
+    def flush(self):
+        """
+        Applies the events received since the last flush to the posts and comments files.
+        """
+        with self.__lock:
+            events, self.__pending = self.__pending, []
+        if len(events) == 0:
+            return
+
+        new_rows = {'posts': {}, 'comments': {}}    # {id: row} of the rows added or changed
+        updates = []                                # [(file kind, id, function that changes the row)]
+        num_applied = 0
+
+        for event in events:
+            item, verb = event.get('item'), event.get('verb')
+
+            if item == 'comment' and verb == 'add':
+                # Replies have the comment they answer as parent; comments to the post have the post itself
+                parent_id = event.get('parent_id', '')
+                parent_id = '' if parent_id == event['post_id'] else parent_id
+                row = [event['comment_id'], event['post_id'], parent_id, event.get('message', ''),
+                       event.get('from', {}).get('name'), _to_local_time(event['created_time'])] + [0] * 8
+                new_rows['comments'][event['comment_id']] = row
+                num_applied += 1
+
+            elif item in POST_ITEMS and verb == 'add':
+                row = [event['post_id'], event.get('message', ''), '', item, event.get('link', ''),
+                       _to_local_time(event['created_time'])] + [0] * 10
+                new_rows['posts'][event['post_id']] = row
+                num_applied += 1
+
+            elif item == 'comment' and verb == 'edited':
+                updates.append(('comments', event['comment_id'], self.__set_column(3, event.get('message', ''))))
+
+            elif item in POST_ITEMS and verb == 'edited':
+                updates.append(('posts', event['post_id'], self.__set_column(1, event.get('message', ''))))
+
+            elif item == 'reaction' and verb in ['add', 'remove']:
+                change = 1 if verb == 'add' else -1
+                if 'comment_id' in event:
+                    updates.append(('comments', event['comment_id'],
+                                    self.__count_reaction(COMMENT_COLUMNS, event.get('reaction_type'), change)))
+                else:
+                    updates.append(('posts', event['post_id'],
+                                    self.__count_reaction(POST_COLUMNS, event.get('reaction_type'), change)))
+
+            elif item == 'comment' and verb == 'remove':
+                print("Comment {} was removed; keeping it in {}".format(event.get('comment_id'), self.comments_file))
+
+        files = {'posts': (self.posts_file, self.webhook_posts_file, POST_COLUMNS),
+                 'comments': (self.comments_file, self.webhook_comments_file, COMMENT_COLUMNS)}
+
+        for kind, (output_file, webhook_file, columns) in files.items():
+            kind_updates = [(id, update) for update_kind, id, update in updates if update_kind == kind]
+
+            # Read the rows the updates apply to (and that weren't just added), as changed by the earlier events if
+            #   they were, or else as last scraped
+            needed = set(id for id, _ in kind_updates) - set(new_rows[kind])
+            for path in [webhook_file, output_file]:
+                if len(needed) == 0:
+                    break
+                found = {}
+                for row in iter_written_rows(path):
+                    if row[0] in needed:
+                        found[row[0]] = row
+                new_rows[kind].update(found)
+                needed -= set(found)
+
+            for id, update in kind_updates:
+                if id in new_rows[kind]:
+                    update(new_rows[kind][id])
+                    num_applied += 1
+                else:
+                    print("{} is not in {} yet; leaving the event for the next scraping run".format(id, output_file))
+
+            if len(new_rows[kind]) > 0:
+                _append_rows(webhook_file, columns, list(new_rows[kind].values()))
+
+        self.num_applied += num_applied
+        print("Applied {} of {} webhook events: {}".format(num_applied, len(events), datetime.datetime.now()))
+
+
+    def __set_column(self, column, value):
+        def update(row):
+            row[column] = value
+        return update
+
+
+    def __count_reaction(self, columns, reaction_type, change):
+        # Reaction types without a column of their own (e.g. care, pride, thankful) are counted in num_special
+        if reaction_type in REACTION_TYPES:
+            type_column = columns.index('num_{}s'.format(reaction_type))
+        else:
+            type_column = columns.index('num_special')
+
+        def update(row):
+            row[columns.index('num_reactions')] = int(row[columns.index('num_reactions')] or 0) + change
+            row[type_column] = int(row[type_column] or 0) + change
+        return update
+
+
+def _append_rows(output_file, columns, rows):
+    # The file may be moved away by take_webhook_rows at any time, so whether it needs the column names is checked on
+    #   the file actually opened
+    with open(output_file, 'a') as wf:
+        writer = csv.writer(wf)
+        if wf.tell() == 0:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+
+
+def take_webhook_rows(webhook_file):
+    """
+    Moves the rows that FacebookEventWriter appended to webhook_file aside, for a scraping run to merge once it is done
+    (see merge_webhook_rows); rows appended from then on are left for the next run. If the rows taken by an earlier
+    run weren't merged yet (e.g. the run failed), those are kept and webhook_file is left for the next run.
+
+    :return: (str) path of the rows taken
+    """
+    taken_file = webhook_file + '.taken'
+    if os.path.isfile(webhook_file) and not os.path.isfile(taken_file):
+        os.replace(webhook_file, taken_file)
+    return taken_file
+
+
+def merge_webhook_rows(output_file, columns, taken_file, retrieved_ids):
+    """
+    Merges the rows taken by take_webhook_rows into output_file, leaving out the posts or comments in retrieved_ids:
+    the scraping run retrieved those after the events were taken, so its rows are newer.
+    """
+    if not os.path.isfile(taken_file):
+        return
+
+    # The latest row of each post or comment counts
+    rows = {}
+    for row in read_written_rows(taken_file):
+        rows.pop(row[0], None)
+        rows[row[0]] = row
+    rows = [row for id, row in rows.items() if id not in retrieved_ids]
+
+    if len(rows) > 0:
+        num_updated, num_added = merge_rows_into_csv(output_file, columns, rows)
+        print("Merged the webhook events into {} ({} rows updated, {} added)".format(output_file, num_updated,
+                                                                                    num_added))
+    os.remove(taken_file)
+
+
+def make_webhook_server(writer, app_secret, verify_token, port=8000):
+    """
+    Creates an HTTP server that receives the webhook events of a Facebook page and hands them to writer.
+    GET requests answer Facebook's subscription check (hub.mode=subscribe with verify_token); POST requests are only
+    accepted with a valid X-Hub-Signature-256 signature made with app_secret.
+
+    :param writer: FacebookEventWriter
+    :return: HTTPServer; call serve_forever() on it
+    """
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            if query.get('hub.mode') == ['subscribe'] and query.get('hub.verify_token') == [verify_token]:
+                self.__respond(200, query.get('hub.challenge', [''])[0])
+            else:
+                self.__respond(403, 'Verification failed')
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            signature = self.headers.get('X-Hub-Signature-256', '')
+            if not hmac.compare_digest(signature, sign_payload(body, app_secret)):
+                self.__respond(403, 'Invalid signature')
+                return
+
+            try:
+                payload = json.loads(body.decode('utf-8'))
+            except ValueError:
+                self.__respond(400, 'Invalid JSON')
+                return
+
+            if payload.get('object') == 'page':
+                writer.add(payload)
+            # Facebook retries events that aren't acknowledged quickly, so answer before they are applied
+            self.__respond(200, 'OK')
+
+        def __respond(self, code, text):
+            self.send_response(code)
+            self.send_header('Content-Type', 'text/plain')
+            self.end_headers()
+            self.wfile.write(text.encode('utf-8'))
+
+    class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return ThreadingHTTPServer(('', port), WebhookHandler)
+
+
+def replay_events(events_file, url, app_secret, delay=0.0):
+    """
+    Sends the webhook payloads in events_file (one JSON object per line, as recorded by FacebookEventWriter) to the
+    webhook server at url, signed with app_secret as Facebook would, e.g. to test the server locally.
+
+    :return: (int) number of payloads the server accepted
+    """
+    print("Replaying the webhook events in {} to {}...".format(events_file, url))
+    start = time.time()
+
+    num_accepted = 0
+    with open(events_file, 'r') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            body = line.strip().encode('utf-8')
+            response = http_utils.post(url, data=body, headers={'Content-Type': 'application/json',
+                                                                'X-Hub-Signature-256': sign_payload(body, app_secret)})
+            if response.ok:
+                num_accepted += 1
+            else:
+                print("The server rejected an event: {} {}".format(response.status_code, response.text))
+            time.sleep(delay)
+
+    end = time.time()
+    print("Successfully replayed {} events in {} seconds!\n".format(num_accepted, end - start))
+
+    return num_accepted
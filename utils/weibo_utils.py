@@ -1,60 +1,106 @@
-from weibo_scraper import get_weibo_profile, get_weibo_tweets_by_name
+from weibo_scraper import get_weibo_profile
+from weibo_base import exist_get_uid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.checkpoint_utils import Checkpoint, read_written_rows, read_written_ids
+from utils.file_utils import merge_rows_into_csv
+from utils.ratelimit_utils import get_rate_limiter
+from utils import http_utils
 import csv
 import datetime
+import random
 import time
 import os
 import re
 
 
-def convert_to_datetime(readpath, company):
+# Column names of the tweets csv file
+TWEET_COLUMNS = ['Created at', 'Tweet', 'is_paid', 'num_reposts', 'num_comments', 'num_likes', 'mblog_id']
+# m.weibo.cn endpoint that returns one page of a container (e.g. a user's timeline)
+WEIBO_CONTAINER_URL = 'https://m.weibo.cn/api/container/getIndex'
+# Number of timeline pages fetched at the same time; every request also counts against the politeness limit of
+#   m.weibo.cn (see DEFAULT_LIMITS in utils/ratelimit_utils.py)
+MAX_PAGES_IN_FLIGHT = 4
+# m.weibo.cn endpoint that returns one page of the comments to a tweet
+WEIBO_COMMENTS_URL = 'https://m.weibo.cn/comments/hotflow'
+# Number of tweets whose comments are retrieved at the same time, and maximum number of comment pages per tweet
+MAX_TWEETS_IN_FLIGHT = 4
+MAX_COMMENT_PAGES = 10
+# Number of tries for a request that m.weibo.cn refuses (e.g. 418 when it thinks it is being crawled too fast), with a
+#   random wait of up to BACKOFF_BASE * 2^(try - 1) seconds before every retry
+MAX_TRIES = 5
+BACKOFF_BASE = 5
+# Profile fields, as named in the profile of the timeline's tweets and in weibo_scraper's UserMeta
+PROFILE_FIELDS = ['screen_name', 'profile_url', 'gender', 'followers_count', 'follow_count', 'description', 'id']
+
+
+def get_weibo_time():
     """
-    This function should primarily be used for Weibo tweet data because of their formatting in mm-dd.
-    This function will change the format to yyyy-mm-dd using the CURRENT YEAR as yyyy.
-    It assumes the date is in the first column of the .csv file.
+    Gets the current time in China (UTC+8), the time zone Weibo gives its times in.
     """
-    for file in os.listdir(readpath):
-        if 'nlp.csv' in file:
-            readfile = file
+    return datetime.datetime.utcnow() + datetime.timedelta(hours=+8)
 
-            print("Converting dates (Weibo) in {} to datetimes...".format(readfile))
-            start = time.time()
 
-            date_column = 0    # column number (zero-indexed) of the date in the .csv file; can change as needed
-
-            header_found = False
-
-            writefile = os.path.join(readpath, '{}_weibo_tweet_final.csv'.format(company))
-
-            # Keep all data to write at the end
-            data_output = []
-
-            with open(os.path.join(readpath, readfile), 'r') as rf:
-                reader = csv.reader(rf)
-
-                for row in reader:
-                    if not header_found:
-                        data_output.append(row)
-                        header_found = True
-                        continue
-                    date = row[date_column]
-
-                    # Only change it to datetime object if it is datetime-like; those that are like '16小时前' or
-                    #   '昨天 12:00' should not be converted (must do so manually)
-                    if date.count('-') == 1:
-                        current_year = datetime.datetime.now().year
-                        date = datetime.datetime.strptime(str(current_year) + '-' + date, '%Y-%m-%d')
-                        row[date_column] = date
-                        data_output.append(row)
-
-            # Write the data to the output
-            with open(writefile, 'w') as wf:
-                writer = csv.writer(wf)
-
-                for row in data_output:
-                    writer.writerow(row)
-
-            end = time.time()
-            print("Finished converting dates in {} seconds!\n".format(end-start))
+def normalize_weibo_time(created_at, fetched_at):
+    """
+    Converts the time a Weibo tweet was created at, as Weibo shows it, to '%Y-%m-%d %H:%M:%S'. Recent tweets only have
+    a relative time ('刚刚', '16分钟前', '16小时前', '昨天 12:00'), tweets of this year only a month and day ('05-21'), and
+    older tweets a full date ('2017-05-21'); all of them are resolved against fetched_at, the time the tweet was
+    retrieved.
+
+    :param created_at: (str) created_at of the mblog
+    :param fetched_at: (datetime) time (in China, see get_weibo_time) the tweet was retrieved
+    :return: (str) the time in '%Y-%m-%d %H:%M:%S', or created_at as is if its form isn't known or it isn't a valid date
+    """
+    created_at = created_at.strip()
+    published = None
+
+    # Relative times: just now, and seconds/minutes/hours/days ago
+    ago = re.match(r'^(\d+)\s*(秒|分钟|小时|天)前$', created_at)
+    if created_at == '刚刚':
+        published = fetched_at
+    elif ago:
+        unit = {'秒': 'seconds', '分钟': 'minutes', '小时': 'hours', '天': 'days'}[ago.group(2)]
+        published = fetched_at - datetime.timedelta(**{unit: int(ago.group(1))})
+    else:
+        # Today, yesterday, or the day before yesterday, at a time of day
+        day = re.match(r'^(今天|昨天|前天)\s*(\d{1,2}):(\d{2})$', created_at)
+        # Month and day (of the last 12 months), or a full date, with an optional time of day
+        date = re.match(r'^(?:(\d{4})-)?(\d{1,2})-(\d{1,2})(?:\s+(\d{1,2}):(\d{2})(?::(\d{2}))?)?$', created_at)
+
+        if day:
+            days_ago = {'今天': 0, '昨天': 1, '前天': 2}[day.group(1)]
+            published = (fetched_at - datetime.timedelta(days=days_ago)).replace(
+                hour=int(day.group(2)), minute=int(day.group(3)), second=0, microsecond=0)
+        elif date:
+            year, month, day_of_month = date.group(1), int(date.group(2)), int(date.group(3))
+            hour, minute, second = [int(value or 0) for value in date.group(4, 5, 6)]
+            if year is not None:
+                years = [int(year)]
+            else:
+                # A month and day later than the fetch time is from last year (e.g. '12-31' fetched in January), and
+                #   so is '02-29' fetched in a year that has none
+                years = [fetched_at.year, fetched_at.year - 1]
+            for candidate in years:
+                try:
+                    published = datetime.datetime(candidate, month, day_of_month, hour, minute, second)
+                except ValueError:
+                    continue
+                if year is not None or published <= fetched_at:
+                    break
+                published = None
+            if published is None:
+                print("Invalid Weibo date {}; keeping it as is".format(created_at))
+                return created_at
+        else:
+            # The full form some endpoints use, e.g. 'Sat Jul 28 19:14:48 +0800 2018'
+            try:
+                published = datetime.datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y')
+                published = published.astimezone(datetime.timezone(datetime.timedelta(hours=8))).replace(tzinfo=None)
+            except ValueError:
+                print("Unknown Weibo time {}; keeping it as is".format(created_at))
+                return created_at
+
+    return published.strftime('%Y-%m-%d %H:%M:%S')
 
 
 def cleanhtml(raw_html):
@@ -71,18 +117,26 @@ def cleanhtml(raw_html):
     return cleantext
 
 
-def get_profile_weibo(name):
+def get_profile_weibo(name, user=None):
+    """
+    Gets the profile of a Weibo user.
+
+    :param user: (dict) profile of the user as it comes with the user's tweets (see get_tweets_weibo); if given, the
+                 profile isn't requested again
+    :return: (columns, data)
+    """
     print("Getting {}'s Weibo profile...".format(name))
     start = time.time()
 
-    # Get profile of the user specified by name
-    profile = get_weibo_profile(name)
+    # Get profile of the user specified by name, unless it came with the tweets
+    if user is None:
+        profile = get_weibo_profile(name)
+        user = dict((field, getattr(profile, field)) for field in PROFILE_FIELDS)
 
     # Extract the data corresponding to the fields specified in columns
     columns = ["Screen Name", "Profile URL", "Gender",
                "Followers Count", "Follow Count", "Description", "ID"]
-    data = [profile.screen_name, profile.profile_url, profile.gender,
-            profile.followers_count, profile.follow_count, profile.description, profile.id]
+    data = [user.get(field) for field in PROFILE_FIELDS]
 
     end = time.time()
     print("Successfully retrieved {}'s Weibo profile in {} seconds!\n".format(name, end-start))
@@ -90,54 +144,374 @@ def get_profile_weibo(name):
     return columns, data
 
 
+def _get_tweet_container_id(name):
+    # The timeline of a Weibo user is the container '107603' + the user's id; searching for the name is enough to get
+    #   the id (the rest of the profile comes with the tweets)
+    get_rate_limiter('Weibo', WEIBO_CONTAINER_URL).wait()
+    uid = exist_get_uid(name=name).get('uid')
+    if uid is None:
+        raise ValueError("No Weibo user named {}".format(name))
+
+    return '107603{}'.format(uid)
+
+
+def _get_tweet_page(container_id, page):
+    """
+    Gets one page of a Weibo user's timeline.
+
+    :param container_id: (str) container of the user's timeline (see _get_tweet_container_id)
+    :param page: (int) page number, starting from 1
+    :return: list of the tweets (mblog dicts) on the page; empty once there are no more pages
+    """
+    # Every page counts against the politeness limit shared by every Weibo request
+    get_rate_limiter('Weibo', WEIBO_CONTAINER_URL).wait()
+    response = http_utils.get(WEIBO_CONTAINER_URL, params={'containerid': container_id, 'page': page})
+    response.raise_for_status()
+    output = response.json()
+
+    if output.get('ok') != 1:
+        return []
+
+    # Skip the cards that aren't tweets (e.g. recommended tweets)
+    return [card['mblog'] for card in output['data']['cards'] if 'mblog' in card]
+
+
 def get_tweets_weibo(name, output_file, pages=10):
+    """
+    Gets the tweets of a Weibo user (at most 'pages' pages of the timeline) and writes them to output_file. Pages are
+    fetched MAX_PAGES_IN_FLIGHT at a time and processed in order; a tweet that shows up on more than one page (the
+    timeline moves while it is read) is only written once.
+    If output_file already has the tweets of an earlier, finished run, only the newer tweets are retrieved: the crawl
+    stops at the first page whose tweets are all stored already, and the tweets retrieved are merged into the file
+    (updating the counts of the stored tweets that were retrieved again).
+
+    :return: (columns, all_tweets, user, updated_ids) where all_tweets has every tweet in output_file, user is the
+             profile of the user that came with the tweets (None if there were no tweets), and updated_ids has the ids
+             of the tweets that are new or whose number of comments changed (every tweet if the file was written from
+             the start), e.g. to only retrieve their comments
+    """
     # Column names in the resulting csv file
-    columns = ['Created at', 'Tweet', 'is_paid', 'num_reposts', 'num_comments', 'num_likes']
-    # Write these column names to the file first
-    with open(output_file, 'a') as wf:
-        writer = csv.writer(wf)
-        writer.writerow(columns)
+    columns = TWEET_COLUMNS
+
+    # The next page to fetch is saved after every page, so that a restarted crawl continues from there
+    checkpoint = Checkpoint(output_file)
 
     # Parameters to keep track of progress
     num_processed = 0  # total number of tweets processed thus far
     start = time.time()  # time at which scraping started
-    all_tweets = []  # contains every tweet scraped; we need to return this to retrieve total # of likes for the user
+    stored = {}  # {id: number of comments} of the tweets written by an earlier run, for incremental runs
+    new_tweets = []  # contains the tweets of an incremental run, merged into the output file at the end
+    user = None
+
+    # Files written with other columns (e.g. without mblog_id, by an older version) can't be merged into, so they are
+    #   written again
+    incremental = not checkpoint.exists() and _has_tweet_columns(output_file)
+    if checkpoint.exists():
+        # Continue from the saved page; the tweets written before it are still needed for the profile totals
+        all_tweets = _read_tweet_rows(output_file)
+        page = checkpoint.get('page')
+        print("Resuming {}'s Weibo tweets from page {} ({} tweets already written)..."
+              .format(name, page, len(all_tweets)))
+    elif incremental:
+        stored = dict((str(tweet[6]), str(tweet[4])) for tweet in _read_tweet_rows(output_file))
+        all_tweets = []
+        page = 1
+        print("Getting {}'s Weibo tweets newer than the {} tweets already stored...".format(name, len(stored)))
+    else:
+        # Write these column names to the file first, replacing whatever it held
+        with open(output_file, 'w') as wf:
+            writer = csv.writer(wf)
+            writer.writerow(columns)
+
+        # contains every tweet scraped; we need to return this to retrieve total # of likes for the user
+        all_tweets = []
+        page = 1
+        # Saved right away so that a restarted crawl doesn't write the column names again
+        checkpoint.save(page=page)
+
+    # Tweets already in the output file (e.g. written just before a crash) are not written again
+    written = set(str(tweet[6]) for tweet in all_tweets)
+
+    if not incremental:
+        print("Getting {}'s Weibo tweets...".format(name))
+
+    container_id = _get_tweet_container_id(name)
+
+    with ThreadPoolExecutor(max_workers=MAX_PAGES_IN_FLIGHT) as executor:
+        done = False
+        # Get 'pages' number of pages of tweets of the user specified by name, a few pages at a time
+        while page <= pages and not done:
+            page_numbers = range(page, min(page + MAX_PAGES_IN_FLIGHT, pages + 1))
+            # Every page comes with the time it was retrieved, to resolve the relative times on it
+            responses = executor.map(lambda number: (_get_tweet_page(container_id, number), get_weibo_time()),
+                                     page_numbers)
+
+            for response, fetched_at in responses:
+                if len(response) == 0:
+                    done = True
+                    break
+
+                batch = []  # contains the tweets of this page (for batch output)
+                # Whether every tweet on the page is stored already (pinned tweets can be old, so they don't count)
+                reached_stored = len(stored) > 0
+
+                # Extract the data corresponding to the fields specified in columns
+                for mblog in response:
+                    # Only get the tweet if it isn't retweeted (if it's retweeted, it means someone else wrote
+                    #   the tweet)
+                    if 'retweeted_status' in mblog.keys():
+                        continue
+                    if user is None and 'user' in mblog:
+                        user = mblog['user']
+                    if str(mblog['id']) not in stored and not mblog.get('isTop'):
+                        reached_stored = False
+
+                    if str(mblog['id']) not in written:
+                        # Weibo gives recent times relative to now (e.g. '16小时前'), so resolve them right away
+                        batch.append([normalize_weibo_time(mblog['created_at'], fetched_at), cleanhtml(mblog['text']),
+                                      mblog['is_paid'], mblog['reposts_count'], mblog['comments_count'],
+                                      mblog['attitudes_count'], mblog['id']])
+                        written.add(str(mblog['id']))
+
+                        num_processed += 1
+
+                page += 1
+
+                if incremental:
+                    new_tweets += batch
+                # Write every page to the output file before saving the next page to fetch
+                elif len(batch) > 0:
+                    print("Writing items {} to {} to {}...".format(num_processed - len(batch) + 1, num_processed,
+                                                                   output_file))
+                    with open(output_file, 'a') as wf:
+                        writer = csv.writer(wf)
+                        for item in batch:
+                            writer.writerow(item)
+                    print("Done writing!")
+                    print("{} tweets Processed: {}".format(num_processed, datetime.datetime.now()))
+                    all_tweets += batch
+
+                if not incremental:
+                    checkpoint.save(page=page)
+
+                # The rest of the timeline was retrieved by earlier runs
+                if reached_stored:
+                    done = True
+                    break
+
+    if incremental:
+        # Replace the stored tweets that were retrieved again (with their updated counts) and add the new ones
+        print("Merging {} tweets into {}...".format(len(new_tweets), output_file))
+        merge_rows_into_csv(output_file, columns, new_tweets, key_column=columns.index('mblog_id'))
+        print("Done writing!")
+        all_tweets = _read_tweet_rows(output_file)
+        updated_ids = [str(tweet[6]) for tweet in new_tweets if stored.get(str(tweet[6])) != str(tweet[4])]
+    else:
+        updated_ids = [str(tweet[6]) for tweet in all_tweets]
 
-    print("Getting {}'s Weibo tweets...".format(name))
+    # The crawl is complete, so the next crawl starts from the beginning
+    checkpoint.clear()
 
-    # Get 'pages' number of pages of tweets of the user specified by name
-    response = get_weibo_tweets_by_name(name, pages)
+    end = time.time()
+    print("Successfully retrieved {} of {}'s Weibo tweets in {} seconds!\n".format(num_processed, name, end-start))
 
-    # Extract the data corresponding to the fields specified in columns
-    for tweet in response:
-        # Only get the tweet if it isn't retweeted (if it's retweeted, it means someone else wrote the tweet)
-        if 'retweeted_status' not in tweet['mblog'].keys():
-            all_tweets.append([tweet['mblog']['created_at'], cleanhtml(tweet['mblog']['text']),
-                          tweet['mblog']['is_paid'], tweet['mblog']['reposts_count'],
-                          tweet['mblog']['comments_count'], tweet['mblog']['attitudes_count']])
-
-            num_processed += 1
-
-        # Once our batch size reaches 100, we write it to the output file
-        if num_processed % 100 == 0:
-            print("Writing items {} to {} to {}...".format(num_processed - 99, num_processed, output_file))
-            with open(output_file, 'a') as wf:
+    return columns, all_tweets, user, updated_ids
+
+
+def _has_tweet_columns(output_file):
+    # Whether output_file was written with the current TWEET_COLUMNS, so that new rows can be merged into it
+    if not os.path.isfile(output_file):
+        return False
+    with open(output_file, 'r') as rf:
+        return next(csv.reader(rf), None) == TWEET_COLUMNS
+
+
+def _read_tweet_rows(output_file):
+    # Reads the tweets in output_file with their counts as numbers (needed for the profile totals), leaving out rows
+    #   that aren't tweets (e.g. a header written again, or a row cut short by a crash)
+    tweets = []
+    for row in read_written_rows(output_file):
+        try:
+            if len(row) == len(TWEET_COLUMNS):
+                tweets.append(row[:3] + [int(row[3]), int(row[4]), int(row[5])] + row[6:])
+        except ValueError:
+            pass
+    return tweets
+
+
+def _get_comment_page(mblog_id, max_id=0):
+    """
+    Gets one page of the comments to a Weibo tweet, retrying with a growing random wait when m.weibo.cn refuses the
+    request.
+
+    :param max_id: (int) cursor of the page (0 for the first page)
+    :return: (comments, max_id) where comments is the list of comments on the page and max_id the cursor of the next
+             page (0 once there are no more pages)
+    """
+    limiter = get_rate_limiter('Weibo', WEIBO_CONTAINER_URL)
+    params = {'id': mblog_id, 'mid': mblog_id, 'max_id_type': 0}
+    if max_id:
+        params['max_id'] = max_id
+
+    for attempt in range(1, MAX_TRIES + 1):
+        # Every page counts against the politeness limit shared by every Weibo request
+        limiter.wait()
+        try:
+            response = http_utils.get(WEIBO_COMMENTS_URL, params=params)
+            # Any other error won't go away by asking again
+            if response.status_code not in [403, 418, 429] and response.status_code < 500:
+                break
+            error = "HTTP error {}".format(response.status_code)
+        except Exception as e:
+            error = e
+
+        if attempt == MAX_TRIES:
+            raise Exception("Giving up on the comments of Weibo tweet {} after {} tries: {}".format(
+                mblog_id, MAX_TRIES, error))
+
+        delay = random.uniform(0, BACKOFF_BASE * 2 ** (attempt - 1))
+        print("Error getting the comments of Weibo tweet {}: {}; retrying in {} seconds (try {} of {})".format(
+            mblog_id, error, round(delay, 1), attempt + 1, MAX_TRIES))
+        limiter.record_backoff(delay)
+        time.sleep(delay)
+
+    response.raise_for_status()
+    # Without a visitor cookie, m.weibo.cn answers with an HTML login page instead
+    try:
+        output = response.json()
+    except ValueError:
+        raise Exception("m.weibo.cn didn't answer with the comments of Weibo tweet {} (not JSON)".format(mblog_id))
+
+    # Tweets without comments (or with comments that aren't public) don't have a page of comments
+    if output.get('ok') != 1:
+        return [], 0
+
+    return output['data'].get('data', []), output['data'].get('max_id', 0)
+
+
+def _get_tweet_comments(mblog_id, max_pages):
+    # Every comment to one tweet (and the replies that come with it), as rows of the comments csv file
+    rows = []
+    max_id = 0
+
+    for _ in range(max_pages):
+        comments, max_id = _get_comment_page(mblog_id, max_id)
+        fetched_at = get_weibo_time()
+
+        for comment in comments:
+            # The replies Weibo shows under each comment come with it
+            replies = comment.get('comments') or []
+            for item, parent_id in [(comment, '')] + [(reply, comment['id']) for reply in replies]:
+                rows.append([item['id'], mblog_id, parent_id, cleanhtml(item.get('text', '')),
+                             item.get('user', {}).get('screen_name'),
+                             normalize_weibo_time(item['created_at'], fetched_at), item.get('like_count', 0)])
+
+        if not max_id:
+            break
+
+    return rows
+
+
+def get_comments_weibo(name, mblog_ids, output_file, max_pages=MAX_COMMENT_PAGES):
+    """
+    Gets the comments to Weibo tweets and writes them to output_file. The comments of MAX_TWEETS_IN_FLIGHT tweets are
+    retrieved at the same time (all of them within the politeness limit of m.weibo.cn), and the comments of each tweet
+    are written as soon as they are all retrieved.
+    The comments of earlier runs are kept: new comments are added to them, and the ones retrieved again replace their
+    rows (with their updated numbers of likes) at the end.
+    The tweets to retrieve and the ones that are done are saved in a checkpoint, so that a restarted crawl only
+    retrieves the others. A tweet whose comments can't be retrieved (e.g. m.weibo.cn keeps refusing) doesn't stop the
+    others; it is left in the checkpoint for the next crawl.
+
+    :param mblog_ids: (list) ids of the tweets, e.g. only the ones whose comments changed (see get_tweets_weibo)
+    :param max_pages: (int) maximum number of pages of comments retrieved for every tweet
+    :return: (list) ids of the tweets whose comments couldn't be retrieved
+    """
+    # Column names in the resulting csv file
+    columns = ['comment_id', 'mblog_id', 'parent_id', 'Comment', 'comment_author', 'Created at', 'num_likes']
+
+    checkpoint = Checkpoint(output_file)
+    todo = set(str(mblog_id) for mblog_id in mblog_ids)
+
+    if checkpoint.exists():
+        # The tweets left by the stopped crawl are still retrieved, along with the ones given now
+        todo |= set(checkpoint.get('todo', []))
+        done = set(checkpoint.get('done', []))
+        # Comments already in the output file (e.g. written just before a crash) are not written again
+        written = read_written_ids(output_file)
+        print("Resuming {}'s Weibo comments ({} tweets already done)...".format(name, len(done)))
+    else:
+        if os.path.isfile(output_file):
+            written = read_written_ids(output_file)
+        else:
+            # Write these column names to the file first
+            with open(output_file, 'w') as wf:
                 writer = csv.writer(wf)
-                for item in all_tweets[-100:]:
-                    writer.writerow(item)
-            print("Done writing!")
-            print("{} tweets Processed: {}".format(num_processed, datetime.datetime.now()))
-
-    # Ensure that if there are any remaining tweets, we write it to the output file
-    if num_processed % 100 > 0:
-        print("Writing remaining {} items to {}...".format(num_processed % 100, output_file))
-        with open(output_file, 'a') as wf:
-            writer = csv.writer(wf)
-            for tweet in all_tweets[-(num_processed % 100):]:
-                writer.writerow(tweet)
+                writer.writerow(columns)
+            written = set()
+
+        done = set()
+        # Saved right away so that a restarted crawl knows which tweets to retrieve
+        checkpoint.save(todo=sorted(todo), done=[])
+
+    # Parameters to keep track of progress
+    num_processed = 0  # total number of comments processed thus far
+    start = time.time()  # time at which scraping started
+    refreshed = []  # comments that were already written, with their updated numbers of likes
+    failed = []  # tweets whose comments couldn't be retrieved
+
+    print("Getting the comments to {} of {}'s Weibo tweets...".format(len(todo - done), name))
+
+    with ThreadPoolExecutor(max_workers=MAX_TWEETS_IN_FLIGHT) as executor:
+        futures = dict((executor.submit(_get_tweet_comments, mblog_id, max_pages), mblog_id)
+                       for mblog_id in sorted(todo - done))
+
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except Exception as e:
+                print("Leaving the comments of Weibo tweet {} for the next crawl: {}".format(futures[future], e))
+                failed.append(str(futures[future]))
+                continue
+
+            batch = []
+            for row in rows:
+                if str(row[0]) in written:
+                    refreshed.append(row)
+                else:
+                    batch.append(row)
+
+            # Write the comments of every tweet to the output file before saving that the tweet is done
+            if len(batch) > 0:
+                num_processed += len(batch)
+                print("Writing items {} to {} to {}...".format(num_processed - len(batch) + 1, num_processed,
+                                                               output_file))
+                with open(output_file, 'a') as wf:
+                    writer = csv.writer(wf)
+                    for item in batch:
+                        writer.writerow(item)
+                        written.add(str(item[0]))
+                print("Done writing!")
+                print("{} comments Processed: {}".format(num_processed, datetime.datetime.now()))
+
+            done.add(str(futures[future]))
+            checkpoint.save(todo=sorted(todo), done=sorted(done))
+
+    if len(refreshed) > 0:
+        print("Updating {} comments retrieved again in {}...".format(len(refreshed), output_file))
+        merge_rows_into_csv(output_file, columns, refreshed)
         print("Done writing!")
 
+    # The crawl is complete, so the next crawl starts from the beginning; if some tweets failed, the checkpoint is kept
+    #   so that the next crawl retries them
+    if len(failed) == 0:
+        checkpoint.clear()
+
     end = time.time()
-    print("Successfully retrieved {} of {}'s Weibo tweets in {} seconds!\n".format(num_processed, name, end-start))
+    print("Successfully retrieved {} comments to {}'s Weibo tweets in {} seconds!\n".format(num_processed, name,
+                                                                                          end-start))
+    if len(failed) > 0:
+        print("Couldn't retrieve the comments of {} Weibo tweets; they are retried by the next crawl\n".format(
+            len(failed)))
 
-    return columns, all_tweets
\ No newline at end of file
+    return sorted(failed)
@@ -1,7 +1,8 @@
 import csv
 import os
-import ast
-from utils.weibo_utils import get_profile_weibo, get_tweets_weibo
+from utils.weibo_utils import get_profile_weibo, get_tweets_weibo, get_comments_weibo
+from utils.state_utils import ScrapeState
+from utils.config_utils import load_config, get_output_files
 
 
 def write_profile_to_csv(filename, column_names, data):
@@ -11,30 +12,61 @@ def write_profile_to_csv(filename, column_names, data):
         writer.writerow(data)
 
 
-if __name__ == "__main__":
-    # Read in the credentials and parameters from the key_params.json file
-    with open('key_params.json', 'r') as f:
-        keys = ast.literal_eval(f.read())
-        weibo_name = keys['parameters']['Weibo']['username']
-        company = keys['parameters']['main']['company_folder']
+def scrape_weibo(config):
+    # Get the parameters from the config parsed from key_params.json
+    weibo_name = config.weibo.username
+    company = config.company
 
     # If the Weibo folder is not in the company folder already, create it
     if 'Weibo' not in os.listdir('../{}'.format(company)):
         os.mkdir('../{}/Weibo'.format(company))
 
     # Output files for the profile and tweets
-    tweet_output = "../{}/Weibo/{}_weibo_tweet.csv".format(company, weibo_name)
-    profile_output = "../{}/Weibo/{}_weibo_profile.csv".format(company, weibo_name)
+    outputs = get_output_files(config)['Weibo']
+    tweet_output = outputs['tweets']
+    profile_output = outputs['profile']
+    state = ScrapeState(outputs['state'])
 
     # Get the tweets of the Weibo user specified by weibo_name, and get at most 'pages' # of pages (can be changed)
     #   and write it to tweet_output
-    tweet_column, tweet_data = get_tweets_weibo(name=weibo_name, output_file=tweet_output, pages=50)
+    # updated_ids has the tweets that are new or got comments since the last run
+    tweet_column, tweet_data, user, updated_ids = get_tweets_weibo(name=weibo_name, output_file=tweet_output, pages=50)
 
-    # Get the profile of the Weibo user specified by weibo_name
-    profile_column, profile_data = get_profile_weibo(name=weibo_name)
+    # Get the profile of the Weibo user specified by weibo_name; the profile that came with the tweets is used if there
+    #   is one
+    profile_column, profile_data = get_profile_weibo(name=weibo_name, user=user)
     # Sum up the number of reposts, comments, and likes across all of the user's tweets and add this data to the profile
     profile_column += ['Total Number of Reposts', 'Total Number of Comments', 'Total Number of Likes']
     profile_data += [sum([data[3] for data in tweet_data]), sum([data[4] for data in tweet_data]), \
                     sum([data[5] for data in tweet_data])]
     # Write the profile to profile_output
     write_profile_to_csv(profile_output, profile_column, profile_data)
+
+    # The comments to the tweets that have any and are new or got comments since the last run are retrieved by
+    #   scrape_weibo_comments; tweets left by an earlier run that didn't get to them are kept
+    updated_ids = set(updated_ids)
+    comment_ids = set(state.get('comment_todo', [])) | \
+        set(str(data[6]) for data in tweet_data if data[4] > 0 and str(data[6]) in updated_ids)
+    state.update(comment_todo=sorted(comment_ids))
+
+
+def scrape_weibo_comments(config):
+    # Get the parameters from the config parsed from key_params.json
+    weibo_name = config.weibo.username
+
+    # Output file for the comments
+    outputs = get_output_files(config)['Weibo']
+    comment_output = outputs['comments']
+    state = ScrapeState(outputs['state'])
+
+    # Get the comments to the tweets that scrape_weibo found new or changed, and add them to comment_output
+    # Tweets whose comments couldn't be retrieved stay in comment_output's checkpoint for the next run
+    get_comments_weibo(name=weibo_name, mblog_ids=state.get('comment_todo', []), output_file=comment_output)
+    state.update(comment_todo=[])
+
+
+if __name__ == "__main__":
+    # Read in the credentials and parameters from the key_params.json file
+    config = load_config()
+    scrape_weibo(config)
+    scrape_weibo_comments(config)